@@ -1,4 +1,4 @@
-from modules import extra_networks, shared
+from modules import extra_networks, result_cache, shared
 import networks
 
 
@@ -60,3 +60,15 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
             p.comment("Networks with errors: " + ", ".join(f"{k} ({v})" for k, v in self.errors.items()))
 
             self.errors.clear()
+
+    def cache_identity(self, params_list):
+        names = [params.positional[0] for params in params_list if params.positional]
+        if shared.opts.sd_lora != "None":
+            names.append(shared.opts.sd_lora)
+
+        res = []
+        for name in names:
+            network_on_disk = networks.available_network_aliases.get(name) or networks.available_networks.get(name)
+            res.append([name, result_cache.file_identity(network_on_disk.filename) if network_on_disk else None])
+
+        return res
@@ -2,8 +2,19 @@ import networks
 
 list_available_loras = networks.list_available_networks
 
-available_loras = networks.available_networks
-available_lora_aliases = networks.available_network_aliases
-available_lora_hash_lookup = networks.available_network_hash_lookup
-forbidden_lora_aliases = networks.forbidden_network_aliases
 loaded_loras = networks.loaded_networks
+
+# lists of networks are replaced with new ones when they are refreshed, so they are looked up every time
+network_lists = {
+    "available_loras": "available_networks",
+    "available_lora_aliases": "available_network_aliases",
+    "available_lora_hash_lookup": "available_network_hash_lookup",
+    "forbidden_lora_aliases": "forbidden_network_aliases",
+}
+
+
+def __getattr__(name):
+    if name in network_lists:
+        return getattr(networks, network_lists[name])
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
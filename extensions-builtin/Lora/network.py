@@ -6,7 +6,7 @@ import enum
 import torch.nn as nn
 import torch.nn.functional as F
 
-from modules import sd_models, cache, errors, hashes, shared
+from modules import safetensors_index, errors, hashes, shared
 import modules.models.sd3.mmdit
 
 NetworkWeights = namedtuple('NetworkWeights', ['network_key', 'sd_key', 'w', 'sd_module'])
@@ -28,14 +28,9 @@ class NetworkOnDisk:
         self.metadata = {}
         self.is_safetensors = os.path.splitext(filename)[1].lower() == ".safetensors"
 
-        def read_metadata():
-            metadata = sd_models.read_metadata_from_safetensors(filename)
-
-            return metadata
-
         if self.is_safetensors:
             try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "lora/" + self.name, filename, read_metadata)
+                self.metadata = safetensors_index.metadata(filename)
             except Exception as e:
                 errors.display(e, f"reading lora {filename}")
 
@@ -56,6 +51,9 @@ class NetworkOnDisk:
             ''
         )
 
+        if not self.hash:
+            hashes.queue_background_hashing(self.filename, "lora/" + self.name)
+
         self.sd_version = self.detect_version()
 
     def detect_version(self):
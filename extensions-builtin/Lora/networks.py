@@ -18,7 +18,7 @@ import network_oft
 import torch
 from typing import Union
 
-from modules import shared, devices, sd_models, errors, scripts, sd_hijack
+from modules import shared, devices, sd_models, errors, scripts, sd_hijack, hashes, startup_snapshot
 import modules.textual_inversion.textual_inversion as textual_inversion
 import modules.models.sd3.mmdit
 
@@ -647,9 +647,20 @@ def network_MultiheadAttention_load_state_dict(self, *args, **kwargs):
     return originals.MultiheadAttention_load_state_dict(self, *args, **kwargs)
 
 
-def process_network_files(names: list[str] | None = None):
-    candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
-    candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
+def process_network_files(names: list[str] | None = None, networks_by_name=None, networks_by_alias=None, forbidden_aliases=None):
+    """adds networks found on disk to given dicts, by default to the ones in use"""
+
+    networks_by_name = available_networks if networks_by_name is None else networks_by_name
+    networks_by_alias = available_network_aliases if networks_by_alias is None else networks_by_alias
+    forbidden_aliases = forbidden_network_aliases if forbidden_aliases is None else forbidden_aliases
+
+    candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"], use_snapshot=True))
+    candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"], use_snapshot=True))
+
+    titles = {filename: "lora/" + os.path.splitext(os.path.basename(filename))[0] for filename in candidates}
+    hashes.prefetch_from_cache([title for filename, title in titles.items() if filename.lower().endswith(".safetensors")], use_addnet_hash=True)
+    hashes.prefetch_from_cache([title for filename, title in titles.items() if not filename.lower().endswith(".safetensors")])
+
     for filename in candidates:
         if os.path.isdir(filename):
             continue
@@ -663,13 +674,13 @@ def process_network_files(names: list[str] | None = None):
             errors.report(f"Failed to load network {name} from {filename}", exc_info=True)
             continue
 
-        available_networks[name] = entry
+        networks_by_name[name] = entry
 
-        if entry.alias in available_network_aliases:
-            forbidden_network_aliases[entry.alias.lower()] = 1
+        if entry.alias in networks_by_alias:
+            forbidden_aliases[entry.alias.lower()] = 1
 
-        available_network_aliases[name] = entry
-        available_network_aliases[entry.alias] = entry
+        networks_by_alias[name] = entry
+        networks_by_alias[entry.alias] = entry
 
 
 def update_available_networks_by_names(names: list[str]):
@@ -677,16 +688,23 @@ def update_available_networks_by_names(names: list[str]):
 
 
 def list_available_networks():
-    available_networks.clear()
-    available_network_aliases.clear()
-    forbidden_network_aliases.clear()
-    available_network_hash_lookup.clear()
-    forbidden_network_aliases.update({"none": 1, "Addams": 1})
+    global available_networks, available_network_aliases, forbidden_network_aliases, available_network_hash_lookup
+
+    # this can run in background while generating; new lists are filled separately and replace old ones when complete
+    networks_by_name = {}
+    networks_by_alias = {}
+    forbidden_aliases = {"none": 1, "Addams": 1}
 
     os.makedirs(shared.cmd_opts.lora_dir, exist_ok=True)
 
-    process_network_files()
+    process_network_files(None, networks_by_name, networks_by_alias, forbidden_aliases)
+
+    hash_lookup = {entry.shorthash: entry for entry in networks_by_name.values() if entry.shorthash}
+
+    available_networks, available_network_aliases, forbidden_network_aliases, available_network_hash_lookup = networks_by_name, networks_by_alias, forbidden_aliases, hash_lookup
+
 
+startup_snapshot.add_refresh_callback("Lora", list_available_networks)
 
 re_network_name = re.compile(r"(.*)\s*\([0-9a-fA-F]+\)")
 
@@ -0,0 +1,135 @@
+"""
+Admission control for synchronous txt2img and img2img requests of the API.
+
+Before a request starts waiting for its turn, it's checked against limits from settings: the number of requests already
+waiting, the estimated time until it could start, and the number of unfinished requests of the same client. A request
+that would exceed any of them is rejected right away with 429 Too Many Requests and a Retry-After header, instead of
+waiting until the client gives up on it.
+
+The estimated wait is the remaining time of the task that is running, as told by its progress, plus estimates for all
+requests and asynchronous jobs ahead; those come from generation_timings. Requests that can't be estimated count as
+taking no time, so the wait is never overestimated because of them.
+"""
+
+import contextlib
+import math
+import threading
+import time
+
+from fastapi.exceptions import HTTPException
+
+from modules import generation_timings, progress, sd_models, sd_samplers
+from modules.shared import opts
+
+
+def estimate_request(req, job_type):
+    """returns estimated seconds for a txt2img or img2img request model, or None if there's nothing to estimate it from"""
+
+    checkpoint = (req.override_settings or {}).get("sd_model_checkpoint") or opts.sd_model_checkpoint
+    architecture = generation_timings.checkpoint_architecture(sd_models.get_closet_checkpoint_match(checkpoint))
+    sampler, _ = sd_samplers.get_sampler_and_scheduler(req.sampler_name or req.sampler_index, req.scheduler)
+    width, height = req.width, req.height
+
+    passes = [(width, height, sampler, generation_timings.sampling_steps(req.steps, req.denoising_strength if job_type == "img2img" else None))]
+
+    if job_type == "txt2img" and req.enable_hr:
+        hr_width = req.hr_resize_x or int(width * req.hr_scale)
+        hr_height = req.hr_resize_y or int(height * req.hr_scale)
+        hr_steps = generation_timings.sampling_steps(req.hr_second_pass_steps or req.steps, req.denoising_strength)
+        passes.append((hr_width, hr_height, req.hr_sampler_name or sampler, hr_steps))
+
+    total = 0
+    for pass_width, pass_height, pass_sampler, steps in passes:
+        seconds = generation_timings.estimate(architecture, pass_width, pass_height, pass_sampler, steps)
+        if seconds is None:
+            return None
+
+        total += seconds
+
+    return total * req.batch_size * req.n_iter
+
+
+class Ticket:
+    def __init__(self, task_id, client, priority, estimate):
+        self.task_id = task_id
+        self.client = client
+        self.priority = priority
+        self.estimate = estimate
+        self.created = time.time()
+
+
+class Admission:
+    def __init__(self, job_queue):
+        """job_queue is the JobQueue of asynchronous jobs; its queued jobs are counted as waiting ahead of new requests"""
+
+        self.job_queue = job_queue
+        self.tickets = []
+        self.lock = threading.Lock()
+
+    def schedule(self):
+        """returns a list of (client, priority, estimated seconds until finished) for the running task and everything waiting, in the order they are going to run"""
+
+        active = progress.active_tasks()
+        res = []
+        if active:
+            tickets = [next((x for x in self.tickets if x.task_id == task_id), None) for task_id in active]
+            _, eta = progress.current_progress()
+            if eta is None and tickets[0] is not None:
+                eta = tickets[0].estimate
+
+            # coalesced requests finish together with the current one
+            res += [(ticket.client if ticket else None, math.inf, eta or 0) for ticket in tickets]
+
+        waiting = [(x.client, x.priority, x.created, x.estimate) for x in self.tickets if x.task_id not in active]
+        waiting += [(x.client, x.priority, x.created, estimate_request(x.request, x.type)) for x in list(self.job_queue.queued) if x.request is not None]
+        waiting.sort(key=lambda x: (-x[1], x[2]))
+
+        finish = res[0][2] if res else 0
+        for client, priority, _, estimate in waiting:
+            finish += estimate or 0
+            res.append((client, priority, finish))
+
+        return res
+
+    def check(self, client, priority):
+        """raises 429 if a new request from client with given priority would exceed a limit from settings"""
+
+        schedule = self.schedule()
+        waiting = sum(1 for _, priority, _ in schedule if priority != math.inf)
+
+        def reject(reason, retry_after):
+            retry_after = max(1, math.ceil(retry_after))
+            raise HTTPException(status_code=429, detail=f"{reason}; retry in {retry_after} s", headers={"Retry-After": str(retry_after)})
+
+        max_queue = opts.api_admission_max_queue
+        if max_queue > 0 and waiting >= max_queue:
+            reject(f"There are already {waiting} requests in queue", schedule[0][2])
+
+        max_per_client = opts.api_admission_max_per_client
+        own = [finish for owner, _, finish in schedule if owner == client]
+        if max_per_client > 0 and len(own) >= max_per_client:
+            reject(f"Client {client} already has {len(own)} unfinished requests", min(own))
+
+        max_wait = opts.api_admission_max_wait
+        wait = max((finish for _, other_priority, finish in schedule if other_priority >= priority), default=0)
+        if max_wait > 0 and wait > max_wait:
+            reject(f"Estimated wait of {int(wait)} s is longer than {max_wait} s", wait - max_wait)
+
+    @contextlib.contextmanager
+    def admit(self, req, job_type, client, priority=0):
+        """checks a request against limits, and counts it as waiting or running until the with block ends; gives the request a task id if it has none"""
+
+        if not req.force_task_id:
+            req.force_task_id = progress.create_task_id(job_type)
+
+        ticket = Ticket(req.force_task_id, client, priority, estimate_request(req, job_type))
+
+        with self.lock:
+            self.check(client, priority)
+            self.tickets.append(ticket)
+
+        try:
+            yield ticket
+        finally:
+            with self.lock:
+                self.tickets.remove(ticket)
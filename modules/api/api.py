@@ -1,5 +1,5 @@
 import base64
-import io
+import json
 import os
 import time
 import datetime
@@ -17,19 +17,16 @@ from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_models_prefetch, sd_schedulers, hashes, tensor_cache, cache, cache_maintenance, progress_stream, metrics, tracing, task_results
+from modules.api import models, jobs, coalescer, encoding, admission
 from modules.shared import opts
-from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
+from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images, get_fixed_seed
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
-from PIL import PngImagePlugin
 from modules.sd_models_config import find_checkpoint_config_near_filename
 from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
 from typing import Any
-import piexif
-import piexif.helper
 from contextlib import closing
 from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
 
@@ -100,36 +97,10 @@ def decode_base64_to_image(encoding):
 
 
 def encode_pil_to_base64(image):
-    with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
-        if opts.samples_format.lower() == 'png':
-            use_metadata = False
-            metadata = PngImagePlugin.PngInfo()
-            for key, value in image.info.items():
-                if isinstance(key, str) and isinstance(value, str):
-                    metadata.add_text(key, value)
-                    use_metadata = True
-            image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=opts.jpeg_quality)
-
-        elif opts.samples_format.lower() in ("jpg", "jpeg", "webp"):
-            if image.mode in ("RGBA", "P"):
-                image = image.convert("RGB")
-            parameters = image.info.get('parameters', None)
-            exif_bytes = piexif.dump({
-                "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
-            })
-            if opts.samples_format.lower() in ("jpg", "jpeg"):
-                image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=opts.jpeg_quality)
-            else:
-                image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=opts.jpeg_quality)
-
-        else:
-            raise HTTPException(status_code=500, detail="Invalid image format")
-
-        bytes_data = output_bytes.getvalue()
+    if isinstance(image, str):
+        return image
 
-    return base64.b64encode(bytes_data)
+    return base64.b64encode(encoding.encode_image(image))
 
 
 def api_middleware(app: FastAPI):
@@ -178,7 +149,7 @@ def api_middleware(app: FastAPI):
                 console.print_exception(show_locals=True, max_frames=2, extra_lines=1, suppress=[anyio, starlette], word_wrap=False, width=min([console.width, 200]))
             else:
                 errors.report(message, exc_info=True)
-        return JSONResponse(status_code=vars(e).get('status_code', 500), content=jsonable_encoder(err))
+        return JSONResponse(status_code=vars(e).get('status_code', 500), content=jsonable_encoder(err), headers=vars(e).get('headers'))
 
     @app.middleware("http")
     async def exception_handling(request: Request, call_next):
@@ -207,13 +178,29 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.jobs = jobs.JobQueue({
+            "txt2img": lambda req, job: self.run_txt2img(req, priority=job.priority),
+            "img2img": lambda req, job: self.run_img2img(req, priority=job.priority),
+        }, batch_key=self.job_batch_key)
+        self.admission = admission.Admission(self.jobs)
+        self.txt2img_coalescer = coalescer.Coalescer(self.queue_lock, self.run_txt2img_batch)
         api_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/jobs/txt2img", self.submit_txt2img_job, methods=["POST"], response_model=models.JobInfo)
+        self.add_api_route("/sdapi/v1/jobs/img2img", self.submit_img2img_job, methods=["POST"], response_model=models.JobInfo)
+        self.add_api_route("/sdapi/v1/jobs", self.list_jobs, methods=["GET"], response_model=list[models.JobInfo])
+        self.add_api_route("/sdapi/v1/jobs/{job_id}", self.get_job, methods=["GET"], response_model=models.JobInfo)
+        self.add_api_route("/sdapi/v1/jobs/{job_id}/result", self.get_job_result, methods=["GET"])
+        self.add_api_route("/sdapi/v1/jobs/{job_id}/cancel", self.cancel_job, methods=["POST"], response_model=models.JobInfo)
+        self.add_api_route("/sdapi/v1/images/{image_id}", encoding.get_image, methods=["GET"])
+        self.add_api_route("/sdapi/v1/results/{task_id}", self.get_task_result, methods=["GET"], response_model=models.TaskResultResponse)
+        self.add_api_route("/sdapi/v1/worker-status", self.get_worker_status, methods=["GET"], response_model=models.WorkerStatus)
         self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
         self.add_api_route("/sdapi/v1/progress", self.progressapi, methods=["GET"], response_model=models.ProgressResponse)
+        self.add_api_route("/sdapi/v1/progress/stream", progress_stream.progress_stream_api, methods=["GET"])
         self.add_api_route("/sdapi/v1/interrogate", self.interrogateapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/interrupt", self.interruptapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/skip", self.skip, methods=["POST"])
@@ -239,6 +226,17 @@ class Api:
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/sdapi/v1/hashing", self.get_hashing, methods=["GET"], response_model=models.HashingResponse)
+        self.add_api_route("/sdapi/v1/tensor-cache", self.get_tensor_cache, methods=["GET"], response_model=models.TensorCacheResponse)
+        self.add_api_route("/sdapi/v1/prefetch", self.get_prefetch, methods=["GET"], response_model=models.PrefetchResponse)
+        self.add_api_route("/sdapi/v1/cache", self.get_cache, methods=["GET"], response_model=models.CacheStatsResponse)
+        self.add_api_route("/sdapi/v1/cache/prune", self.prune_cache, methods=["POST"], response_model=models.CachePruneResponse)
+        self.add_api_route("/sdapi/v1/cache/compact", self.compact_cache, methods=["POST"], response_model=models.CacheCompactResponse)
+        self.add_api_route("/sdapi/v1/cache/pin", self.pin_cache, methods=["POST"], response_model=models.CachePinResponse)
+        self.add_api_route("/metrics", self.get_metrics, methods=["GET"])
+        self.add_api_route("/sdapi/v1/traces", self.list_traces, methods=["GET"], response_model=list[models.TraceInfo])
+        self.add_api_route("/sdapi/v1/traces/{task_id}", self.get_trace, methods=["GET"], response_model=models.TraceInfo)
+        self.add_api_route("/sdapi/v1/traces/{task_id}/chrome", self.get_chrome_trace, methods=["GET"])
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
@@ -257,7 +255,7 @@ class Api:
         img2img_script_runner = scripts.scripts_img2img
 
         if not txt2img_script_runner.scripts or not img2img_script_runner.scripts:
-            ui.create_ui()
+            scripts.setup_scripts_without_ui()
 
         if not txt2img_script_runner.scripts:
             txt2img_script_runner.initialize_scripts(False)
@@ -429,7 +427,18 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def expect_checkpoint(self, task_id, override_settings):
+        """tells the prefetcher which checkpoint a queued request is going to load, so it can be read while earlier requests run"""
+
+        checkpoint = (override_settings or {}).get('sd_model_checkpoint')
+        if checkpoint:
+            sd_models_prefetch.prefetcher.expect(task_id, [sd_models.get_closet_checkpoint_match(checkpoint)])
+
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request):
+        with self.admission.admit(txt2imgreq, "txt2img", self.job_client(request)):
+            return self.run_txt2img(txt2imgreq)
+
+    def run_txt2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, priority=0):
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
         script_runner = scripts.scripts_txt2img
@@ -461,35 +470,215 @@ class Api:
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
+        encoder = self.pop_image_encoder(args)
+
+        with tracing.hold(task_id):
+            add_task_to_queue(task_id)
+            self.expect_checkpoint(task_id, args.get('override_settings'))
+
+            if self.can_coalesce_txt2img(txt2imgreq, selectable_scripts, infotext_script_args):
+                key = (self.coalesce_key(txt2imgreq), priority)
+                max_wait = opts.api_coalesce_max_wait / 1000
+                entry = (task_id, args, script_args, encoder if send_images else None)
+                processed, batch_encoder = self.txt2img_coalescer.submit(key, entry, opts.api_coalesce_max_batch, max_wait, priority=priority)
+                tracing.attach(task_id)
+                task_results.store(task_id, processed.images, processed.js())
+
+                data = batch_encoder.encode_all(processed.images) if send_images else []
+
+                return encoder.response(models.TextToImageResponse, data, vars(txt2imgreq), processed.js())
+
+            with self.queue_lock.at_priority(priority):
+                with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+                    p.is_api = True
+                    p.scripts = script_runner
+                    p.outpath_grids = opts.outdir_txt2img_grids
+                    p.outpath_samples = opts.outdir_txt2img_samples
+                    if send_images:
+                        p.image_callback = encoder.submit
+
+                    try:
+                        shared.state.begin(job="scripts_txt2img")
+                        start_task(task_id)
+                        if self.jobs.is_cancelled(task_id):
+                            shared.state.interrupt()
+                        if selectable_scripts is not None:
+                            p.script_args = script_args
+                            processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
+                        else:
+                            p.script_args = tuple(script_args) # Need to pass args as tuple here
+                            processed = process_images(p)
+                        finish_task(task_id, self.jobs.task_status(task_id))
+                    finally:
+                        shared.state.end()
+                        shared.total_tqdm.clear()
+                        sd_models_prefetch.prefetcher.forget(task_id)
+
+            task_results.store(task_id, processed.images, processed.js())
+
+            data = encoder.encode_all(processed.images) if send_images else []
+
+            return encoder.response(models.TextToImageResponse, data, vars(txt2imgreq), processed.js())
+
+    def pop_image_encoder(self, args):
+        """removes fields that describe how to send images from request args, and returns an encoder for images of the response"""
+
+        return encoding.ImageEncoder(
+            response_format=args.pop('response_format', None) or "base64",
+            image_format=args.pop('image_format', None),
+            quality=args.pop('image_quality', None),
+            png_compress_level=args.pop('png_compress_level', None),
+        )
 
-        add_task_to_queue(task_id)
+    def can_coalesce_txt2img(self, txt2imgreq, selectable_scripts, infotext_script_args):
+        """only plain single-image requests are merged with others; anything that runs scripts or makes several images runs alone"""
+
+        return (
+            opts.api_coalesce_max_batch > 1
+            and txt2imgreq.batch_size == 1
+            and txt2imgreq.n_iter == 1
+            and not txt2imgreq.enable_hr
+            and selectable_scripts is None
+            and not txt2imgreq.alwayson_scripts
+            and not infotext_script_args
+        )
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_txt2img_grids
-                p.outpath_samples = opts.outdir_txt2img_samples
+    def job_batch_key(self, job):
+        """returns a key shared by queued jobs that run_txt2img would coalesce into one batch, or None for jobs that run alone"""
+
+        req = job.request
+        if job.type != "txt2img" or req.script_name or req.infotext or not self.can_coalesce_txt2img(req, None, {}):
+            return None
+
+        return self.coalesce_key(req), job.priority
+
+    def coalesce_key(self, req):
+        """requests with equal keys differ only in prompts and seeds, and can be generated as one batch"""
+
+        fields = req.dict(exclude={"prompt", "negative_prompt", "seed", "subseed", "force_task_id", "send_images", "response_format", "infotext"})
+        return json.dumps(fields, sort_keys=True, default=str)
+
+    def run_txt2img_batch(self, entries):
+        """
+        generates coalesced txt2img requests as one batch with per-sample prompts and seeds; called with queue_lock held.
+        Returns a (Processed, ImageEncoder) tuple for every request; requests in a batch have same image format, so the encoder
+        of one of them encodes images for all while the batch is being generated.
+        """
 
+        task_ids = [task_id for task_id, _, _, _ in entries]
+        _, args, script_args, _ = entries[0]
+        args = {
+            **args,
+            "prompt": [x["prompt"] for _, x, _, _ in entries],
+            "negative_prompt": [x["negative_prompt"] for _, x, _, _ in entries],
+            "seed": [get_fixed_seed(x["seed"]) for _, x, _, _ in entries],
+            "subseed": [get_fixed_seed(x["subseed"]) for _, x, _, _ in entries],
+            "batch_size": len(entries),
+            "do_not_save_grid": True,
+        }
+
+        encoder = next((x for _, _, _, x in entries if x is not None), None)
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+            p.is_api = True
+            p.scripts = scripts.scripts_txt2img
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+            p.script_args = tuple(script_args)
+            if encoder is not None:
+                p.image_callback = encoder.submit
+
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                start_task(task_ids[0], coalesced=task_ids[1:])
+                if all(self.jobs.is_cancelled(task_id) for task_id in task_ids):
+                    shared.state.interrupt()
+                processed = process_images(p)
+                for task_id in task_ids:
+                    finish_task(task_id, self.jobs.task_status(task_id))
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+                for task_id in task_ids:
+                    sd_models_prefetch.prefetcher.forget(task_id)
+
+        if len(processed.images) - processed.index_of_first_image != len(entries):
+            raise HTTPException(status_code=500, detail=f"Batch of {len(entries)} coalesced requests produced {len(processed.images)} images")
+
+        return [(coalescer.split_processed(processed, i), encoder) for i in range(len(entries))]
+
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request):
+        with self.admission.admit(img2imgreq, "img2img", self.job_client(request)):
+            return self.run_img2img(img2imgreq)
+
+    def job_client(self, request: Request):
+        """
+        returns who the request is from, for per-client limits: the API user with --api-auth, otherwise the IP address;
+        headers a client can set freely are not used, so that limits can't be avoided by changing them
+        """
+
+        if shared.cmd_opts.api_auth:
+            scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() == "basic":
                 try:
-                    shared.state.begin(job="scripts_txt2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
-
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
-
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
-
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+                    return "user " + base64.b64decode(credentials).decode("utf8").partition(":")[0]
+                except Exception:
+                    pass
+
+        host = request.client.host if request.client else "unknown"
+
+        # the dispatcher passes the address of the client it forwards the request for
+        forwarded_for = request.headers.get("X-Forwarded-For")
+        if forwarded_for and shared.cmd_opts.nowebui and host != "unknown" and ipaddress.ip_address(host).is_loopback:
+            host = forwarded_for.split(",")[-1].strip()
+
+        return host
+
+    def submit_txt2img_job(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request, priority: int = 0):
+        job = self.jobs.submit("txt2img", txt2imgreq, self.job_client(request), priority)
+        self.expect_checkpoint(job.id, txt2imgreq.override_settings)
+        return models.JobInfo(**job.info(self.jobs.position(job)))
+
+    def submit_img2img_job(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request, priority: int = 0):
+        if img2imgreq.init_images is None:
+            raise HTTPException(status_code=404, detail="Init image not found")
+
+        job = self.jobs.submit("img2img", img2imgreq, self.job_client(request), priority)
+        self.expect_checkpoint(job.id, img2imgreq.override_settings)
+        return models.JobInfo(**job.info(self.jobs.position(job)))
+
+    def list_jobs(self):
+        return [models.JobInfo(**info) for info in self.jobs.list()]
+
+    def get_job(self, job_id: str):
+        job = self.jobs.get(job_id)
+        return models.JobInfo(**job.info(self.jobs.position(job)))
+
+    def get_job_result(self, job_id: str):
+        job = self.jobs.get(job_id)
+
+        if job.status == jobs.FAILED:
+            raise HTTPException(status_code=500, detail=f"Job {job_id} failed: {job.error}")
+        if job.status == jobs.CANCELLED:
+            raise HTTPException(status_code=410, detail=f"Job {job_id} was cancelled")
+        if job.status != jobs.DONE:
+            raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+
+        return job.result
+
+    def get_task_result(self, task_id: str):
+        stored = task_results.get(task_id)
+        if stored is None:
+            raise HTTPException(status_code=404, detail=f"Results of task {task_id} not found; they either expired or were never obtained")
+
+        images = [x for x in map(task_results.image_bytes, stored["images"]) if x is not None]
+        return models.TaskResultResponse(images=[base64.b64encode(x) for x in images], info=stored["info"], created=stored["created"])
+
+    def cancel_job(self, job_id: str):
+        job = self.jobs.cancel(job_id)
+        return models.JobInfo(**job.info(self.jobs.position(job)))
+
+    def run_img2img(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, priority=0):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
         init_images = img2imgreq.init_images
@@ -531,38 +720,48 @@ class Api:
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
-
-        add_task_to_queue(task_id)
-
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
-                p.init_images = [decode_base64_to_image(x) for x in init_images]
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_img2img_grids
-                p.outpath_samples = opts.outdir_img2img_samples
-
-                try:
-                    shared.state.begin(job="scripts_img2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
-
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
-
-        if not img2imgreq.include_init_images:
-            img2imgreq.init_images = None
-            img2imgreq.mask = None
-
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+        encoder = self.pop_image_encoder(args)
+
+        with tracing.hold(task_id):
+            add_task_to_queue(task_id)
+            self.expect_checkpoint(task_id, args.get('override_settings'))
+
+            with self.queue_lock.at_priority(priority):
+                with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
+                    p.init_images = [decode_base64_to_image(x) for x in init_images]
+                    p.is_api = True
+                    p.scripts = script_runner
+                    p.outpath_grids = opts.outdir_img2img_grids
+                    p.outpath_samples = opts.outdir_img2img_samples
+                    if send_images:
+                        p.image_callback = encoder.submit
+
+                    try:
+                        shared.state.begin(job="scripts_img2img")
+                        start_task(task_id)
+                        if self.jobs.is_cancelled(task_id):
+                            shared.state.interrupt()
+                        if selectable_scripts is not None:
+                            p.script_args = script_args
+                            processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
+                        else:
+                            p.script_args = tuple(script_args) # Need to pass args as tuple here
+                            processed = process_images(p)
+                        finish_task(task_id, self.jobs.task_status(task_id))
+                    finally:
+                        shared.state.end()
+                        shared.total_tqdm.clear()
+                        sd_models_prefetch.prefetcher.forget(task_id)
+
+            task_results.store(task_id, processed.images, processed.js())
+
+            data = encoder.encode_all(processed.images) if send_images else []
+
+            if not img2imgreq.include_init_images:
+                img2imgreq.init_images = None
+                img2imgreq.mask = None
+
+            return encoder.response(models.ImageToImageResponse, data, vars(img2imgreq), processed.js())
 
     def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
         reqDict = setUpscalers(req)
@@ -675,7 +874,7 @@ class Api:
 
         return options
 
-    def set_config(self, req: dict[str, Any]):
+    def set_config(self, req: dict[str, Any], request: Request):
         checkpoint_name = req.get("sd_model_checkpoint", None)
         if checkpoint_name is not None and checkpoint_name not in sd_models.checkpoint_aliases:
             raise RuntimeError(f"model {checkpoint_name!r} not found")
@@ -683,7 +882,9 @@ class Api:
         for k, v in req.items():
             shared.opts.set(k, v, is_api=True)
 
-        shared.opts.save(shared.config_filename)
+        # the dispatcher sends settings to every worker, and only one of them saves them to the config file they share
+        if request.headers.get("X-Dispatcher-Copy") is None:
+            shared.opts.save(shared.config_filename)
         return
 
     def get_cmd_flags(self):
@@ -723,9 +924,15 @@ class Api:
             for upscale_mode in [*(shared.latent_upscale_modes or {})]
         ]
 
+    def get_worker_status(self):
+        sd_model = sd_models.model_data.sd_model
+        checkpoint = sd_model.sd_checkpoint_info.title if sd_model is not None else None
+
+        return models.WorkerStatus(checkpoint=checkpoint, busy=self.queue_lock.locked(), queued=self.queue_lock.waiting() + len(self.jobs.queued))
+
     def get_sd_models(self):
         import modules.sd_models as sd_models
-        return [{"title": x.title, "model_name": x.model_name, "hash": x.shorthash, "sha256": x.sha256, "filename": x.filename, "config": find_checkpoint_config_near_filename(x)} for x in sd_models.checkpoints_list.values()]
+        return [{"title": x.title, "model_name": x.model_name, "hash": x.shorthash, "sha256": x.sha256, "filename": x.filename, "config": find_checkpoint_config_near_filename(x), "architecture": x.detect_architecture()} for x in sd_models.checkpoints_list.values()]
 
     def get_sd_vaes(self):
         import modules.sd_vae as sd_vae
@@ -883,6 +1090,51 @@ class Api:
             cuda = {'error': f'{err}'}
         return models.MemoryResponse(ram=ram, cuda=cuda)
 
+    def get_hashing(self):
+        return models.HashingResponse(**hashes.hashing_service.stats())
+
+    def get_tensor_cache(self):
+        return models.TensorCacheResponse(**tensor_cache.tensor_cache.stats())
+
+    def get_prefetch(self):
+        return models.PrefetchResponse(**sd_models_prefetch.prefetcher.stats())
+
+    def get_cache(self):
+        return models.CacheStatsResponse(subsections=cache_maintenance.subsection_stats(), memory=cache.stats())
+
+    def prune_cache(self, req: models.CachePruneRequest):
+        return models.CachePruneResponse(removed=cache_maintenance.prune(dry_run=req.dry_run))
+
+    def compact_cache(self):
+        return models.CacheCompactResponse(sizes={name: {"before": before, "after": after} for name, (before, after) in cache_maintenance.compact().items()})
+
+    def pin_cache(self, req: models.CachePinRequest):
+        if req.subsection not in cache_maintenance.subsections():
+            raise HTTPException(status_code=404, detail=f"Cache subsection {req.subsection} not found")
+
+        func = cache_maintenance.unpin if req.unpin else cache_maintenance.pin
+        return models.CachePinResponse(count=func(req.subsection, req.keys, req.prefix))
+
+    def get_metrics(self):
+        return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def list_traces(self):
+        return [models.TraceInfo(**info) for info in tracing.list_traces()]
+
+    def find_trace(self, task_id):
+        trace = tracing.get(task_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail=f"Trace for task {task_id} not found")
+
+        return trace
+
+    def get_trace(self, task_id: str):
+        return models.TraceInfo(**self.find_trace(task_id).info())
+
+    def get_chrome_trace(self, task_id: str):
+        trace = self.find_trace(task_id)
+        return JSONResponse(content=trace.chrome_trace(), headers={"Content-Disposition": f'attachment; filename="trace-{task_id}.json"'})
+
     def get_extensions_list(self):
         from modules import extensions
         extensions.list_extensions()
@@ -0,0 +1,110 @@
+"""
+Coalescing of compatible API generation requests into one batch.
+
+Requests that can run together are given the same key. The first request with a key opens a batch and waits for others
+to join it, for up to a set time or until the batch is full; it then takes the queue lock and runs all requests in the
+batch at once, while the others wait for it to finish and take their own results.
+"""
+
+import copy
+import re
+import threading
+
+re_batch_params = re.compile(r",\s*Batch (?:size|pos): \d+")
+
+
+class Batch:
+    def __init__(self, key):
+        self.key = key
+        self.entries = []
+        self.results = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class Coalescer:
+    def __init__(self, queue_lock, run_batch):
+        """run_batch is a function that takes a list of entries and returns a list of results in the same order; it's called with queue_lock held"""
+
+        self.queue_lock = queue_lock
+        self.run_batch = run_batch
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def close(self, batch):
+        """stops batch from accepting new entries; must be called with self.lock held"""
+
+        if self.pending.get(batch.key) is batch:
+            del self.pending[batch.key]
+
+        batch.full.set()
+
+    def submit(self, key, entry, max_batch_size, max_wait, priority=0):
+        """runs entry in a batch together with other entries with same key submitted within max_wait seconds, and returns its result"""
+
+        with self.lock:
+            batch = self.pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = Batch(key)
+                self.pending[key] = batch
+
+            index = len(batch.entries)
+            batch.entries.append(entry)
+
+            if len(batch.entries) >= max_batch_size:
+                self.close(batch)
+
+        if is_leader:
+            batch.full.wait(max_wait)
+
+            try:
+                with self.queue_lock.at_priority(priority):
+                    # entries keep joining while an earlier generation holds the lock
+                    with self.lock:
+                        self.close(batch)
+
+                    batch.results = self.run_batch(batch.entries)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+        return batch.results[index]
+
+
+def split_processed(processed, index):
+    """returns a copy of Processed object from a batch that only describes the image at index, as if it was generated alone"""
+
+    res = copy.copy(processed)
+    position = processed.index_of_first_image + index
+
+    res.images = [processed.images[position]]
+    res.infotexts = [strip_batch_params(processed.infotexts[position])]
+    res.info = res.infotexts[0]
+    res.index_of_first_image = 0
+    res.batch_size = 1
+
+    res.all_prompts = [processed.all_prompts[index]]
+    res.all_negative_prompts = [processed.all_negative_prompts[index]]
+    res.all_seeds = [processed.all_seeds[index]]
+    res.all_subseeds = [processed.all_subseeds[index]]
+    res.prompt = res.all_prompts[0]
+    res.negative_prompt = res.all_negative_prompts[0]
+    res.seed = res.all_seeds[0]
+    res.subseed = res.all_subseeds[0]
+
+    return res
+
+
+def strip_batch_params(infotext):
+    """removes batch size and position from the last line of infotext; they describe the coalesced batch, not the request"""
+
+    prompts, newline, params = infotext.rpartition("\n")
+    return prompts + newline + re_batch_params.sub("", params)
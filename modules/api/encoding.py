@@ -0,0 +1,189 @@
+"""
+Encoding of generated images for API responses.
+
+Images are encoded in a thread pool: an ImageEncoder starts encoding each image as soon as processing produces it, so
+that most of the work is done by the time generation finishes. Encoded images are returned either as base64 strings
+inside JSON, as parts of a multipart response, or kept in memory for a while and returned as URLs to fetch them from.
+"""
+
+import base64
+import collections
+import concurrent.futures
+import io
+import json
+import os
+import threading
+import uuid
+
+import piexif
+import piexif.helper
+from fastapi import Response
+from fastapi.exceptions import HTTPException
+from PIL import PngImagePlugin
+
+from modules import metrics, tracing
+from modules.shared import opts
+
+response_formats = ["base64", "multipart", "urls"]
+media_types = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "webp": "image/webp"}
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="api image encoding")
+
+
+@metrics.image_encode.time()
+@tracing.span("encode image")
+def encode_image(image, image_format=None, quality=None, png_compress_level=None):
+    """returns bytes of the image saved in given format; format and quality default to ones from settings"""
+
+    image_format = (image_format or opts.samples_format).lower()
+    quality = opts.jpeg_quality if quality is None else quality
+
+    with io.BytesIO() as output_bytes:
+        if image_format == 'png':
+            use_metadata = False
+            metadata = PngImagePlugin.PngInfo()
+            for key, value in image.info.items():
+                if isinstance(key, str) and isinstance(value, str):
+                    metadata.add_text(key, value)
+                    use_metadata = True
+
+            save_kwargs = {} if png_compress_level is None else {"compress_level": png_compress_level}
+            image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=quality, **save_kwargs)
+
+        elif image_format in ("jpg", "jpeg", "webp"):
+            if image.mode in ("RGBA", "P"):
+                image = image.convert("RGB")
+            parameters = image.info.get('parameters', None)
+            exif_bytes = piexif.dump({
+                "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
+            })
+            if image_format in ("jpg", "jpeg"):
+                image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=quality)
+            else:
+                image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=quality)
+
+        else:
+            raise HTTPException(status_code=500, detail="Invalid image format")
+
+        return output_bytes.getvalue()
+
+
+class ImageEncoder:
+    def __init__(self, response_format="base64", image_format=None, quality=None, png_compress_level=None):
+        if response_format not in response_formats:
+            raise HTTPException(status_code=422, detail=f"Unknown response format {response_format}; must be one of: {', '.join(response_formats)}")
+
+        self.image_format = (image_format or opts.samples_format).lower()
+        if self.image_format not in media_types:
+            raise HTTPException(status_code=422, detail=f"Unknown image format {image_format}; must be one of: {', '.join(media_types)}")
+
+        self.response_format = response_format
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    @property
+    def media_type(self):
+        return media_types[self.image_format]
+
+    def submit(self, image):
+        """starts encoding the image in background; used as processing's image_callback"""
+
+        with self.lock:
+            if id(image) not in self.futures:
+                future = executor.submit(tracing.bind(encode_image), image, self.image_format, self.quality, self.png_compress_level)
+                self.futures[id(image)] = (image, future)
+
+    def encode_all(self, images):
+        """returns list of bytes for images; ones that were submitted before are not encoded again"""
+
+        for image in images:
+            if not isinstance(image, str):
+                self.submit(image)
+
+        res = []
+        for image in images:
+            if isinstance(image, str):
+                res.append(base64.b64decode(image))
+                continue
+
+            _, future = self.futures[id(image)]
+            res.append(future.result())
+
+        return res
+
+    @metrics.api_response.time()
+    @tracing.span("api response")
+    def response(self, response_model, data, parameters, info):
+        """makes a response with encoded images in the format that was requested; json is serialized here rather than by FastAPI, so that it's timed"""
+
+        if self.response_format == "multipart":
+            return multipart_response({"parameters": parameters, "info": info}, data, self.media_type, self.image_format)
+
+        if self.response_format == "urls":
+            encoded = [f"/sdapi/v1/images/{image_store.add(x, self.media_type)}" for x in data]
+        else:
+            encoded = [base64.b64encode(x) for x in data]
+
+        res = response_model(images=encoded, parameters=parameters, info=info)
+        return Response(content=res.json(), media_type="application/json")
+
+
+def multipart_response(data, images, media_type, extension):
+    """returns a multipart/mixed response with json in the first part and raw bytes of one image in every following part"""
+
+    boundary = uuid.uuid4().hex
+
+    parts = [
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode('utf8'),
+        json.dumps(data, default=str).encode('utf8'),
+    ]
+
+    for i, image in enumerate(images):
+        parts.append(f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\nContent-Disposition: attachment; filename=\"{i:05}.{extension}\"\r\n\r\n".encode('utf8'))
+        parts.append(image)
+
+    parts.append(f"\r\n--{boundary}--\r\n".encode('utf8'))
+
+    return Response(content=b"".join(parts), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+class ImageStore:
+    """keeps encoded images in memory for clients to fetch by URL; oldest images are dropped when the size limit in settings is exceeded"""
+
+    def __init__(self):
+        self.images = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def add(self, data, media_type):
+        image_id = uuid.uuid4().hex
+
+        with self.lock:
+            self.images[image_id] = (data, media_type)
+            self.size += len(data)
+
+            limit = opts.api_image_store_mb * 1024 * 1024
+            while self.size > limit and len(self.images) > 1:
+                _, (old_data, _) = self.images.popitem(last=False)
+                self.size -= len(old_data)
+
+        return image_id
+
+    def get(self, image_id):
+        with self.lock:
+            entry = self.images.get(image_id)
+
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Image {image_id} not found")
+
+        return entry
+
+
+image_store = ImageStore()
+
+
+def get_image(image_id: str):
+    data, media_type = image_store.get(image_id)
+    return Response(content=data, media_type=media_type)
@@ -0,0 +1,217 @@
+"""
+Asynchronous generation jobs for the API.
+
+A job is submitted with a request for txt2img or img2img and gets an id right away; a worker thread runs jobs one by one,
+using the same code as the synchronous endpoints, and keeps results until the client fetches them. Jobs with higher priority
+run first; among jobs with the same priority, clients take turns, and each client may only have a limited number of
+unfinished jobs. When the job to run next can be generated as one batch with other queued jobs, they are all started at
+once, so that they are coalesced the same way as concurrent synchronous requests are.
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+from fastapi.exceptions import HTTPException
+
+from modules import errors, progress, shared
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+finished_states = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    def __init__(self, job_id, job_type, request, client, priority):
+        self.id = job_id
+        self.type = job_type
+        self.request = request
+        self.client = client
+        self.priority = priority
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+
+    def info(self, position=None):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "client": self.client,
+            "priority": self.priority,
+            "position": position,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, runners, batch_key=None):
+        """
+        runners is a dict of job type -> function that takes the request and the job and returns the response;
+        batch_key is a function that takes a job and returns a key shared by jobs that can be generated together, or None
+        """
+
+        self.runners = runners
+        self.batch_key = batch_key
+        self.jobs = collections.OrderedDict()
+        self.queued = []
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.last_served = {}
+        self.worker = None
+
+    def submit(self, job_type, request, client, priority=0):
+        max_jobs = shared.opts.api_jobs_max_per_client
+        with self.condition:
+            unfinished = sum(1 for job in self.jobs.values() if job.client == client and job.status not in finished_states)
+            if max_jobs > 0 and unfinished >= max_jobs:
+                raise HTTPException(status_code=429, detail=f"Client {client} already has {unfinished} unfinished jobs")
+
+            job = Job(request.force_task_id or progress.create_task_id(job_type), job_type, request, client, priority)
+            request.force_task_id = job.id
+
+            self.jobs[job.id] = job
+            self.queued.append(job)
+            progress.add_task_to_queue(job.id)
+            self.forget_old_jobs()
+
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.work, name="api jobs", daemon=True)
+                self.worker.start()
+
+            self.condition.notify_all()
+
+        return job
+
+    def order_key(self, job):
+        """jobs run in order of this key: highest priority first, then the client that was served longest ago, then the oldest job"""
+
+        return -job.priority, self.last_served.get(job.client, 0), job.created
+
+    def next_jobs(self):
+        """returns the job to run next, followed by queued jobs that can be generated together with it as one batch"""
+
+        order = sorted(self.queued, key=self.order_key)
+        job = order[0]
+
+        key = self.batch_key(job) if self.batch_key is not None else None
+        if key is None:
+            return [job]
+
+        max_batch = shared.opts.api_coalesce_max_batch
+        return [job, *[x for x in order[1:] if self.batch_key(x) == key][:max_batch - 1]]
+
+    def position(self, job):
+        with self.condition:
+            if job.status != QUEUED:
+                return None
+
+            order = sorted(self.queued, key=self.order_key)
+            return order.index(job)
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queued:
+                    self.condition.wait()
+
+                batch = self.next_jobs()
+                self.last_served[batch[0].client] = time.time()
+                for job in batch:
+                    self.queued.remove(job)
+                    job.status = RUNNING
+                    job.started = time.time()
+
+            # runners of jobs from one batch wait for each other in the coalescer, so each one gets its own thread
+            helpers = [threading.Thread(target=self.run, args=(job,), name="api jobs batch", daemon=True) for job in batch[1:]]
+            for thread in helpers:
+                thread.start()
+
+            self.run(batch[0])
+
+            for thread in helpers:
+                thread.join()
+
+    def run(self, job):
+        try:
+            result = self.runners[job.type](job.request, job)
+            status = CANCELLED if job.cancel_requested else DONE
+        except Exception as e:
+            errors.report(f"Error running API job {job.id}", exc_info=True)
+            result = None
+            status = FAILED
+            job.error = getattr(e, "detail", None) or str(e)
+            self.finish_task(job.id, FAILED, job.error)
+
+        with self.condition:
+            job.result = result
+            job.status = status
+            job.finished = time.time()
+            job.request = None
+            self.condition.notify_all()
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+        return job
+
+    def is_cancelled(self, job_id):
+        job = self.jobs.get(job_id)
+        return job is not None and job.cancel_requested
+
+    def cancel(self, job_id):
+        with self.condition:
+            job = self.get(job_id)
+            if job.status in finished_states:
+                return job
+
+            job.cancel_requested = True
+
+            if job.status == QUEUED:
+                self.queued.remove(job)
+                self.finish_task(job.id, CANCELLED)
+                job.status = CANCELLED
+                job.finished = time.time()
+                job.request = None
+            elif job.id in progress.active_tasks() and all(self.is_cancelled(x) for x in progress.active_tasks()):
+                # a batch of coalesced requests is only interrupted when every one of them is cancelled
+                shared.state.interrupt()
+
+        return job
+
+    def task_status(self, task_id):
+        """returns how a task that ran to the end finished: cancelled if it's a job that was requested to be cancelled, otherwise done"""
+
+        return CANCELLED if self.is_cancelled(task_id) else DONE
+
+    def finish_task(self, task_id, status, error=None):
+        """removes the task of a job that failed or was cancelled from the queue of progress and records how it ended"""
+
+        progress.remove_from_queue(task_id)
+        progress.finish_task(task_id, status, error)
+
+    def forget_old_jobs(self):
+        """removes finished jobs over the limit set in settings, oldest first"""
+
+        limit = shared.opts.api_jobs_keep_results
+        finished = [job for job in self.jobs.values() if job.status in finished_states]
+        for job in finished[:max(0, len(finished) - limit)]:
+            del self.jobs[job.id]
+
+    def list(self):
+        with self.condition:
+            return [job.info(self.position(job)) for job in self.jobs.values()]
@@ -97,6 +97,13 @@ class PydanticModelGenerator:
         DynamicModel.__config__.allow_mutation = True
         return DynamicModel
 
+response_image_fields = [
+    {"key": "response_format", "type": str, "default": "base64"},  # base64, multipart or urls
+    {"key": "image_format", "type": str, "default": None},  # png, jpeg or webp; defaults to format from settings
+    {"key": "image_quality", "type": int, "default": None},  # for jpeg and webp; defaults to quality from settings
+    {"key": "png_compress_level", "type": int, "default": None},  # 0 to 9
+]
+
 StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
     "StableDiffusionProcessingTxt2Img",
     StableDiffusionProcessingTxt2Img,
@@ -109,6 +116,7 @@ StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        *response_image_fields,
     ]
 ).generate_model()
 
@@ -128,6 +136,7 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        *response_image_fields,
     ]
 ).generate_model()
 
@@ -259,6 +268,7 @@ class SDModelItem(BaseModel):
     sha256: Optional[str] = Field(title="sha256 hash")
     filename: str = Field(title="Filename")
     config: Optional[str] = Field(title="Config file")
+    architecture: Optional[str] = Field(title="Architecture", description="Model architecture found from names and shapes of tensors in the file; None if unknown")
 
 class SDVaeItem(BaseModel):
     model_name: str = Field(title="Model Name")
@@ -298,6 +308,114 @@ class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
 
+class HashingResponse(BaseModel):
+    queue_depth: int = Field(title="Queue depth", description="Number of files waiting to be hashed")
+    active: int = Field(title="Active", description="Number of files being hashed right now")
+    threads: int = Field(title="Threads", description="Number of running hashing threads")
+    completed: int = Field(title="Completed", description="Number of files hashed since startup")
+    failed: int = Field(title="Failed", description="Number of files that could not be hashed")
+    bytes_hashed: int = Field(title="Bytes hashed", description="Total size of files hashed since startup")
+    seconds: float = Field(title="Seconds", description="Total time spent hashing")
+    throughput: float = Field(title="Throughput", description="Average hashing speed, in bytes per second")
+
+class TensorCacheResponse(BaseModel):
+    entries: int = Field(title="Entries", description="Number of checkpoints and VAEs in the cache")
+    tensors: int = Field(title="Tensors", description="Number of unique tensors stored")
+    bytes: int = Field(title="Bytes", description="Total size of stored tensors")
+    budget: int = Field(title="Budget", description="Maximum total size of stored tensors; 0 if unlimited")
+    deduplicated_bytes: int = Field(title="Deduplicated bytes", description="Total size of tensors that were not stored because the same tensor was already in the cache")
+    hits: int = Field(title="Hits", description="Number of times a requested model was in the cache")
+    misses: int = Field(title="Misses", description="Number of times a requested model was not in the cache")
+    evictions: int = Field(title="Evictions", description="Number of models evicted from the cache")
+    policy: str = Field(title="Policy", description="Eviction policy")
+
+class PrefetchResponse(BaseModel):
+    mode: str = Field(title="Mode", description="Where checkpoints are prefetched to: Disabled, Page cache or RAM cache")
+    pending: list[str] = Field(title="Pending", description="Checkpoints that queued jobs are going to load, in order")
+    warmed: list[str] = Field(title="Warmed", description="Files of prefetched checkpoints that were not loaded yet")
+    hits: int = Field(title="Hits", description="Number of checkpoint loads that were prefetched in advance")
+    misses: int = Field(title="Misses", description="Number of checkpoint loads that were not prefetched in advance")
+    bytes_prefetched: int = Field(title="Bytes prefetched", description="Total size of prefetched checkpoints")
+    jobs: dict[str, dict[str, int]] = Field(title="Jobs", description="Hits and misses for recent jobs")
+
+
+class JobInfo(BaseModel):
+    id: str = Field(title="Id", description="Job id; can also be used as id_task for progress")
+    type: str = Field(title="Type", description="txt2img or img2img")
+    status: str = Field(title="Status", description="queued, running, done, failed or cancelled")
+    client: str = Field(title="Client", description="Client that submitted the job: API user with --api-auth, or IP address")
+    priority: int = Field(title="Priority", description="Jobs with higher priority run first")
+    position: Optional[int] = Field(default=None, title="Position", description="Number of queued jobs that will run before this one")
+    created: float = Field(title="Created", description="Time when the job was submitted, as a unix timestamp")
+    started: Optional[float] = Field(default=None, title="Started", description="Time when the job started running")
+    finished: Optional[float] = Field(default=None, title="Finished", description="Time when the job finished")
+    error: Optional[str] = Field(default=None, title="Error", description="Error message for failed jobs")
+
+
+class TaskResultResponse(BaseModel):
+    images: list[str] = Field(default=None, title="Image", description="The generated images in base64 format; images that were saved to disk and since deleted are left out")
+    info: str = Field(title="Info", description="Generation info as json")
+    created: float = Field(title="Created", description="Time when the results were stored, as a unix timestamp")
+
+
+class WorkerStatus(BaseModel):
+    checkpoint: Optional[str] = Field(default=None, title="Checkpoint", description="Title of the checkpoint that is loaded, or None if no checkpoint is loaded yet")
+    busy: bool = Field(title="Busy", description="Whether a generation is running")
+    queued: int = Field(title="Queued", description="Number of requests and asynchronous jobs waiting for the generation to finish")
+
+
+class TraceSpan(BaseModel):
+    name: str = Field(title="Name")
+    start: float = Field(title="Start", description="Seconds from the start of the task")
+    duration: float = Field(title="Duration", description="Duration in seconds")
+    thread: str = Field(title="Thread", description="Name of the thread that ran the span")
+    args: Optional[dict] = Field(default=None, title="Arguments")
+
+
+class TraceInfo(BaseModel):
+    task_id: str = Field(title="Task id")
+    coalesced: list[str] = Field(default=[], title="Coalesced", description="Ids of other tasks generated in one batch with this one; they share the trace")
+    started: float = Field(title="Started", description="Time when the task started, as a unix timestamp")
+    finished: Optional[float] = Field(default=None, title="Finished", description="Time when the task finished, or None if it's running or failed")
+    queue_wait: Optional[float] = Field(default=None, title="Queue wait", description="Seconds the task waited in queue before starting")
+    duration: Optional[float] = Field(default=None, title="Duration", description="Seconds from start to finish of the task")
+    span_count: int = Field(title="Span count")
+    spans: Optional[list[TraceSpan]] = Field(default=None, title="Spans", description="Recorded spans, ordered by start")
+
+
+class CacheSubsectionStats(BaseModel):
+    entries: int = Field(title="Entries", description="Number of entries, including pinned ones")
+    pinned: int = Field(title="Pinned", description="Number of entries that are never culled")
+    bytes: int = Field(title="Bytes", description="Disk space used by the subsection")
+
+
+class CacheStatsResponse(BaseModel):
+    subsections: dict[str, CacheSubsectionStats] = Field(title="Subsections", description="Entries and disk space of every subsection in the cache directory")
+    memory: dict[str, dict] = Field(title="Memory", description="Hit/miss/latency counters of subsections used since startup")
+
+
+class CachePruneRequest(BaseModel):
+    dry_run: bool = Field(default=False, title="Dry run", description="Only count entries that would be removed")
+
+
+class CachePruneResponse(BaseModel):
+    removed: dict[str, int] = Field(title="Removed", description="Number of removed entries for files that no longer exist or were modified, by subsection")
+
+
+class CacheCompactResponse(BaseModel):
+    sizes: dict[str, dict[str, int]] = Field(title="Sizes", description="Size of SQLite files before and after compaction, by subsection")
+
+
+class CachePinRequest(BaseModel):
+    subsection: str = Field(title="Subsection", description="Cache subsection, for example hashes")
+    keys: list[str] = Field(default=[], title="Keys", description="Keys of entries")
+    prefix: Optional[str] = Field(default=None, title="Prefix", description="Also include all entries with keys starting with this")
+    unpin: bool = Field(default=False, title="Unpin", description="Unpin entries instead of pinning them")
+
+
+class CachePinResponse(BaseModel):
+    count: int = Field(title="Count", description="Number of entries pinned or unpinned")
+
 
 class ScriptsList(BaseModel):
     txt2img: list = Field(default=None, title="Txt2img", description="Titles of scripts (txt2img)")
@@ -1,7 +1,11 @@
+import atexit
+import collections
 import json
 import os
 import os.path
+import pickle
 import threading
+import time
 
 import diskcache
 import tqdm
@@ -10,23 +14,348 @@ from modules.paths import data_path, script_path
 
 cache_filename = os.environ.get('SD_WEBUI_CACHE_FILE', os.path.join(data_path, "cache.json"))
 cache_dir = os.environ.get('SD_WEBUI_CACHE_DIR', os.path.join(data_path, "cache"))
+memory_tier = os.environ.get('SD_WEBUI_CACHE_MEMORY', '1') != '0'  # off for processes that share cache_dir with others, see modules.dispatcher
 caches = {}
 cache_lock = threading.Lock()
 
+memory_items_limit = 16384
+memory_items_limits = {
+    "safetensors-headers": 256,  # headers of big checkpoints list thousands of tensors
+    "tensor-digests": 64,
+}
+
+flush_delay = 2.0
+flush_batch_size = 256
+
+pinned_dirname = "pinned"
+results_dirname = "results"  # used by modules.result_cache
+task_results_dirname = "task-results"  # used by modules.task_results
+
+missing = object()
+absent = object()  # remembered in memory for entries that are not on disk
+deleted = object()  # pending write for removed entries
+
+
+def freeze(value):
+    """serializes a value kept in memory, so that callers that change values they got from the cache do not change the cache"""
+
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def thaw(data):
+    return pickle.loads(data)
+
 
 def dump_cache():
-    """old function for dumping cache to disk; does nothing since diskcache."""
+    """writes all changes made to caches that are waiting in memory to disk"""
 
-    pass
+    for cache_obj in list(caches.values()):
+        cache_obj.flush()
 
 
-def make_cache(subsection: str) -> diskcache.Cache:
-    return diskcache.Cache(
+class TieredCache:
+    """
+    Cache for one subsection: an in-memory LRU tier in front of diskcache.
+
+    Reads are served from memory when possible; entries that are not in memory are read from disk and remembered,
+    including the fact that an entry does not exist. Values are kept in memory serialized, so every read returns a
+    new object, same as a read from disk would. Writes go to memory immediately and are written to disk in
+    batches, one transaction per batch, either when enough of them have accumulated or shortly after the first one.
+    get_many and set_many work with many entries in one disk transaction.
+
+    Pinned entries are kept in a separate diskcache in pinned_directory that never culls, so they survive the
+    size limit of the main one; see pin and unpin.
+
+    With max_items of 0 there is no memory tier: every read goes to disk and every write is written right away, so that
+    several processes can share the same directory and see each other's changes.
+    """
+
+    def __init__(self, subsection, disk, max_items, pinned_directory=None):
+        self.subsection = subsection
+        self.disk = disk
+        self.max_items = max_items
+        self.pinned_directory = pinned_directory
+        self.pinned = None
+        self.pinned_keys = set()
+        self.lock = threading.RLock()
+        self.memory = collections.OrderedDict()
+        self.pending = {}
+        self.flush_timer = None
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_reads = 0
+        self.disk_read_seconds = 0.0
+        self.writes = 0
+        self.flushes = 0
+        self.disk_write_seconds = 0.0
+
+        if pinned_directory is not None and os.path.isdir(pinned_directory):
+            self.open_pinned()
+
+    def open_pinned(self):
+        if self.pinned is None:
+            if self.pinned_directory is None:
+                raise ValueError(f"cache {self.subsection} does not support pinning")
+
+            self.pinned = diskcache.Cache(self.pinned_directory, eviction_policy="none")
+            self.pinned_keys = set(self.pinned.iterkeys())
+
+        return self.pinned
+
+    def store_for(self, key):
+        return self.pinned if key in self.pinned_keys else self.disk
+
+    def remember(self, key, value):
+        """remembers value read from or written to disk; value must be serialized with freeze or be one of sentinels"""
+
+        self.memory[key] = absent if value is missing else value
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def lookup_memory(self, key):
+        """returns (value, found); value is missing if the entry is known to not exist; found is False if the disk has to be checked"""
+
+        value = self.pending.get(key, missing)
+        if value is missing:
+            value = self.memory.get(key, missing)
+            if value is not missing:
+                self.memory.move_to_end(key)
+
+        found = value is not missing
+
+        return missing if value is absent or value is deleted or value is missing else thaw(value), found
+
+    def get(self, key, default=None):
+        with self.lock:
+            value, found = self.lookup_memory(key)
+            if found:
+                self.hits += 1
+                return default if value is missing else value
+
+            self.misses += 1
+            start = time.perf_counter()
+            value = self.store_for(key).get(key, missing)
+            self.disk_reads += 1
+            self.disk_read_seconds += time.perf_counter() - start
+
+            self.remember(key, value if value is missing else freeze(value))
+
+        return default if value is missing else value
+
+    def get_many(self, keys):
+        """returns a dict with entries for those of keys that are in the cache; entries not in memory are read in one disk transaction"""
+
+        res = {}
+        with self.lock:
+            to_read = []
+            for key in keys:
+                value, found = self.lookup_memory(key)
+                if not found:
+                    to_read.append(key)
+                elif value is not missing:
+                    res[key] = value
+
+            self.hits += len(keys) - len(to_read)
+            self.misses += len(to_read)
+
+            if to_read:
+                start = time.perf_counter()
+                with self.disk.transact():
+                    for key in to_read:
+                        value = self.store_for(key).get(key, missing)
+                        self.remember(key, value if value is missing else freeze(value))
+                        if value is not missing:
+                            res[key] = value
+
+                self.disk_reads += len(to_read)
+                self.disk_read_seconds += time.perf_counter() - start
+
+        return res
+
+    def __getitem__(self, key):
+        value = self.get(key, missing)
+        if value is missing:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, missing) is not missing
+
+    def set_many(self, items):
+        with self.lock:
+            for key, value in items.items():
+                data = freeze(value)
+                self.remember(key, data)
+                self.pending[key] = data
+
+            self.writes += len(items)
+            self.schedule_flush()
+
+    def __setitem__(self, key, value):
+        self.set_many({key: value})
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self.pop(key)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            value = self.get(key, missing)
+            self.remember(key, missing)
+            self.pending[key] = deleted
+            self.schedule_flush()
+
+        return default if value is missing else value
+
+    def schedule_flush(self):
+        if len(self.pending) >= flush_batch_size or self.max_items == 0:
+            self.flush()
+        elif self.pending and self.flush_timer is None:
+            self.flush_timer = threading.Timer(flush_delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        """writes pending changes to disk in one transaction"""
+
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+
+            if not self.pending:
+                return
+
+            pending = self.pending
+            self.pending = {}
+
+            start = time.perf_counter()
+            with self.disk.transact():
+                for key, value in pending.items():
+                    store = self.store_for(key)
+                    if value is deleted:
+                        store.pop(key, None)
+                        self.pinned_keys.discard(key)
+                    else:
+                        store[key] = thaw(value)
+
+            self.flushes += 1
+            self.disk_write_seconds += time.perf_counter() - start
+
+    def pin(self, keys):
+        """moves entries with given keys to the store that is never culled; returns the number of entries pinned"""
+
+        with self.lock:
+            self.flush()
+            pinned = self.open_pinned()
+
+            count = 0
+            for key in keys:
+                if key in self.pinned_keys:
+                    continue
+
+                value = self.disk.get(key, missing)
+                if value is missing:
+                    continue
+
+                pinned[key] = value
+                self.pinned_keys.add(key)
+                self.disk.pop(key, None)
+                count += 1
+
+        return count
+
+    def unpin(self, keys):
+        """moves pinned entries with given keys back to the regular store; returns the number of entries unpinned"""
+
+        with self.lock:
+            self.flush()
+            if self.pinned is None:
+                return 0
+
+            count = 0
+            for key in keys:
+                if key not in self.pinned_keys:
+                    continue
+
+                value = self.pinned.pop(key, missing)
+                self.pinned_keys.discard(key)
+                if value is not missing:
+                    self.disk[key] = value
+                    count += 1
+
+        return count
+
+    def keys(self):
+        self.flush()
+        return list(self.disk.iterkeys()) + sorted(self.pinned_keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        self.flush()
+        return len(self.disk) + len(self.pinned_keys)
+
+    def clear(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+
+            self.pending.clear()
+            self.memory.clear()
+            self.disk.clear()
+
+            if self.pinned is not None:
+                self.pinned.clear()
+                self.pinned_keys.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "memory_items": len(self.memory),
+                "memory_items_limit": self.max_items,
+                "pending_writes": len(self.pending),
+                "pinned_items": len(self.pinned_keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_reads": self.disk_reads,
+                "disk_read_ms": self.disk_read_seconds * 1000 / self.disk_reads if self.disk_reads else 0.0,
+                "writes": self.writes,
+                "flushes": self.flushes,
+                "disk_write_ms": self.disk_write_seconds * 1000 / self.flushes if self.flushes else 0.0,
+            }
+
+
+def make_cache(subsection: str) -> TieredCache:
+    disk = diskcache.Cache(
         os.path.join(cache_dir, subsection),
         size_limit=2**32,  # 4 GB, culling oldest first
         disk_min_file_size=2**18,  # keep up to 256KB in Sqlite
     )
 
+    pinned_directory = os.path.join(cache_dir, pinned_dirname, subsection)
+
+    max_items = memory_items_limits.get(subsection, memory_items_limit) if memory_tier else 0
+
+    return TieredCache(subsection, disk, max_items, pinned_directory=pinned_directory)
+
+
+def stats():
+    """returns hit/miss/latency counters for every subsection that was used since startup"""
+
+    return {subsection: cache_obj.stats() for subsection, cache_obj in caches.items()}
+
 
 def convert_old_cached_data():
     try:
@@ -48,9 +377,10 @@ def convert_old_cached_data():
                 cache_obj = make_cache(subsection)
                 caches[subsection] = cache_obj
 
-            for key, value in keyvalues.items():
-                cache_obj[key] = value
-                progress.update(1)
+            cache_obj.set_many(keyvalues)
+            progress.update(len(keyvalues))
+
+    dump_cache()
 
 
 def cache(subsection):
@@ -61,7 +391,7 @@ def cache(subsection):
         subsection (str): The subsection identifier for the cache.
 
     Returns:
-        diskcache.Cache: The cache data for the specified subsection.
+        TieredCache: The cache data for the specified subsection.
     """
 
     cache_obj = caches.get(subsection)
@@ -115,9 +445,10 @@ def cached_data_for_file(subsection, title, filename, func):
         if value is None:
             return None
 
-        entry = {'mtime': ondisk_mtime, 'value': value}
+        entry = {'mtime': ondisk_mtime, 'value': value, 'filename': os.path.abspath(filename)}
         existing_cache[title] = entry
 
-        dump_cache()
-
     return entry['value']
+
+
+atexit.register(dump_cache)
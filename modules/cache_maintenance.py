@@ -0,0 +1,255 @@
+"""
+Maintenance of the cache directory: statistics, pruning of entries for files that no longer exist or were changed,
+compaction of SQLite files, and pinning of entries so that they are never culled.
+
+Used by the /sdapi/v1/cache API endpoints, and can be run from the command line while the webui is not running:
+
+    python -m modules.cache_maintenance stats
+    python -m modules.cache_maintenance prune [--dry-run]
+    python -m modules.cache_maintenance compact
+    python -m modules.cache_maintenance pin hashes --prefix checkpoint/
+    python -m modules.cache_maintenance unpin hashes "checkpoint/model.safetensors"
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+
+from modules import cache
+
+file_subsections = {
+    "converted-weights": ".json",
+    "safetensors-twins": ".safetensors",
+}
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+
+    return total
+
+
+def subsections():
+    """returns names of all diskcache subsections in the cache directory"""
+
+    if not os.path.isdir(cache.cache_dir):
+        return []
+
+    return sorted(name for name in os.listdir(cache.cache_dir) if name not in (cache.pinned_dirname, cache.results_dirname, cache.task_results_dirname) and os.path.isfile(os.path.join(cache.cache_dir, name, "cache.db")))
+
+
+def subsection_stats():
+    """returns a dict of subsection name -> entries, pinned entries and bytes used on disk, also for subsections that store plain files"""
+
+    res = {}
+    for name in subsections():
+        cache_obj = cache.cache(name)
+        pinned_directory = os.path.join(cache.cache_dir, cache.pinned_dirname, name)
+
+        res[name] = {
+            "entries": len(cache_obj),
+            "pinned": len(cache_obj.pinned_keys),
+            "bytes": directory_size(os.path.join(cache.cache_dir, name)) + directory_size(pinned_directory),
+        }
+
+    for name, ext in file_subsections.items():
+        path = os.path.join(cache.cache_dir, name)
+        if not os.path.isdir(path):
+            continue
+
+        res[name] = {
+            "entries": len([fn for fn in os.listdir(path) if fn.endswith(ext)]),
+            "pinned": 0,
+            "bytes": directory_size(path),
+        }
+
+    return res
+
+
+def is_orphaned(key, value):
+    """returns True if the cache entry was made for a file that no longer exists or has been changed since"""
+
+    if not isinstance(value, dict):
+        return False
+
+    if "stat" in value and isinstance(key, str) and os.path.isabs(key):
+        from modules import safetensors_index
+
+        try:
+            return safetensors_index.stat_key(key) != value["stat"]
+        except OSError:
+            return True
+
+    filename = value.get("filename")
+    if filename is None or "mtime" not in value:
+        return False
+
+    try:
+        return os.path.getmtime(filename) != value["mtime"]
+    except OSError:
+        return True
+
+
+def prune_subsection(name, dry_run=False):
+    cache_obj = cache.cache(name)
+    keys = [key for key in cache_obj.keys() if key not in cache_obj.pinned_keys]
+
+    orphaned = [key for key, value in cache_obj.get_many(keys).items() if is_orphaned(key, value)]
+    if not dry_run:
+        for key in orphaned:
+            cache_obj.pop(key)
+
+        cache_obj.flush()
+
+    return len(orphaned)
+
+
+def prune_files(name, dry_run=False):
+    """removes converted weights and safetensors twins whose source file no longer exists or was modified after they were written"""
+
+    path = os.path.join(cache.cache_dir, name)
+    if not os.path.isdir(path):
+        return 0
+
+    count = 0
+    for fn in os.listdir(path):
+        fullpath = os.path.join(path, fn)
+
+        try:
+            if name == "converted-weights" and fn.endswith(".json"):
+                with open(fullpath, "r", encoding="utf8") as file:
+                    source = json.load(file).get("source")
+                files = [fullpath, os.path.splitext(fullpath)[0] + ".safetensors"]
+            elif name == "safetensors-twins" and fn.endswith(".safetensors"):
+                from modules import safetensors_index
+
+                source = safetensors_index.read_header(fullpath)["metadata"].get("source")
+                files = [fullpath]
+            else:
+                continue
+
+            if source and os.path.isfile(source) and os.path.getmtime(source) <= os.path.getmtime(fullpath):
+                continue
+        except Exception:
+            continue
+
+        count += 1
+        if dry_run:
+            continue
+
+        for filename in files:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    return count
+
+
+def prune(dry_run=False):
+    """
+    Removes cache entries made for files that no longer exist or whose modification time changed; pinned entries are kept.
+    Returns a dict of subsection name -> number of removed entries.
+    """
+
+    res = {name: prune_subsection(name, dry_run) for name in subsections()}
+
+    for name in file_subsections:
+        res[name] = prune_files(name, dry_run)
+
+    return res
+
+
+def compact():
+    """writes all pending changes and runs VACUUM on SQLite files of all subsections; returns a dict of subsection name -> (bytes before, bytes after)"""
+
+    cache.dump_cache()
+
+    res = {}
+    for name in subsections():
+        for path in [os.path.join(cache.cache_dir, name), os.path.join(cache.cache_dir, cache.pinned_dirname, name)]:
+            db_path = os.path.join(path, "cache.db")
+            if not os.path.isfile(db_path):
+                continue
+
+            before = os.path.getsize(db_path)
+
+            conn = sqlite3.connect(db_path, isolation_level=None, timeout=60)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+
+            before_total, after_total = res.get(name, (0, 0))
+            res[name] = (before_total + before, after_total + os.path.getsize(db_path))
+
+    return res
+
+
+def matching_keys(cache_obj, keys=None, prefix=None):
+    res = list(keys or [])
+    if prefix is not None:
+        res += [key for key in cache_obj.keys() if isinstance(key, str) and key.startswith(prefix)]
+
+    return res
+
+
+def pin(name, keys=None, prefix=None):
+    """pins entries of a subsection given by keys or by key prefix; returns the number of entries pinned"""
+
+    cache_obj = cache.cache(name)
+    return cache_obj.pin(matching_keys(cache_obj, keys, prefix))
+
+
+def unpin(name, keys=None, prefix=None):
+    """unpins entries of a subsection given by keys or by key prefix; returns the number of entries unpinned"""
+
+    cache_obj = cache.cache(name)
+    return cache_obj.unpin(matching_keys(cache_obj, keys, prefix))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m modules.cache_maintenance", description="Maintenance of the webui cache directory; run while the webui is not running")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="show number of entries and disk space used by each subsection")
+
+    prune_parser = commands.add_parser("prune", help="remove entries for files that no longer exist or were modified")
+    prune_parser.add_argument("--dry-run", action="store_true", help="only show how many entries would be removed")
+
+    commands.add_parser("compact", help="reclaim unused space in SQLite files")
+
+    for command in ["pin", "unpin"]:
+        pin_parser = commands.add_parser(command, help=f"{command} entries of a subsection")
+        pin_parser.add_argument("subsection")
+        pin_parser.add_argument("keys", nargs="*")
+        pin_parser.add_argument("--prefix", default=None, help="all entries with keys starting with this")
+
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        for name, info in subsection_stats().items():
+            print(f"{name}: {info['entries']} entries, {info['pinned']} pinned, {info['bytes'] / 1024 / 1024:.1f} MB")
+    elif args.command == "prune":
+        for name, count in prune(dry_run=args.dry_run).items():
+            print(f"{name}: {count} {'entries to remove' if args.dry_run else 'entries removed'}")
+    elif args.command == "compact":
+        for name, (before, after) in compact().items():
+            print(f"{name}: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+    elif args.command in ("pin", "unpin"):
+        func = pin if args.command == "pin" else unpin
+        count = func(args.subsection, args.keys, args.prefix)
+        print(f"{args.subsection}: {count} entries {args.command}ned")
+
+    cache.dump_cache()
+
+
+if __name__ == "__main__":
+    main()
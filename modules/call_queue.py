@@ -33,11 +33,13 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
+            status = "failed"
             try:
                 res = func(*args, **kwargs)
                 progress.record_results(id_task, res)
+                status = "done"
             finally:
-                progress.finish_task(id_task)
+                progress.finish_task(id_task, status)
 
             shared.state.end()
 
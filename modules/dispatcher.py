@@ -0,0 +1,593 @@
+"""
+Dispatcher that spreads API requests over several worker processes.
+
+With --dispatcher-workers N, launch.py starts N copies of itself with --nowebui on ports following the dispatcher's own
+port, and serves /sdapi/v1/* by forwarding every request to one of them:
+
+- txt2img and img2img requests, and asynchronous jobs for them, go to a worker that already has the requested checkpoint
+  loaded, unless it's much busier than others;
+- requests that change state of the server (settings, refreshing lists of models, loading checkpoints) go to every
+  worker; settings are saved to config.json, which workers share, only by one of them, and sd_model_checkpoint in
+  settings is only applied by the worker that is best placed to load it, so that every worker does not load the same
+  checkpoint; to generate with a checkpoint, pass it in override_settings;
+- requests about a task, job, trace, results or image made earlier go to the worker that made it; so do interrupt and
+  skip, for the task given by id_task, or for the last generation request otherwise;
+- everything else goes to the least busy worker.
+
+/metrics is gathered from every worker and returned as one text, with a worker label added to every sample.
+
+Workers are checked every few seconds with /sdapi/v1/worker-status, which also tells which checkpoint they have loaded;
+a worker whose process exits is started again. This module only uses the standard library, so that the dispatcher
+process does not load torch or models.
+"""
+
+import base64
+import collections
+import http.client
+import http.server
+import json
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from modules import errors
+
+health_interval = 2.0
+status_timeout = 5.0
+request_timeout = 3600.0
+
+checkpoint_switch_cost = 2
+"""loading a different checkpoint is considered as expensive as this many queued requests"""
+
+max_remembered_ids = 10000
+
+generation_paths = {"/sdapi/v1/txt2img", "/sdapi/v1/img2img", "/sdapi/v1/jobs/txt2img", "/sdapi/v1/jobs/img2img"}
+broadcast_paths = {
+    "/sdapi/v1/options",
+    "/sdapi/v1/refresh-checkpoints",
+    "/sdapi/v1/refresh-vae",
+    "/sdapi/v1/refresh-loras",
+    "/sdapi/v1/refresh-embeddings",
+    "/sdapi/v1/reload-checkpoint",
+    "/sdapi/v1/unload-checkpoint",
+}
+task_control_paths = {"/sdapi/v1/interrupt", "/sdapi/v1/skip"}
+copy_header = "X-Dispatcher-Copy"
+"""added to requests that are sent to every worker, for all workers but one; such a worker must not save anything shared"""
+
+hop_by_hop_headers = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length"}
+
+job_path_re = re.compile(r"^/sdapi/v1/(?:jobs|traces|results)/([^/]+)(/.*)?$")
+image_path_re = re.compile(r"^/sdapi/v1/images/([0-9a-f]+)$")
+image_url_re = re.compile(rb"/sdapi/v1/images/([0-9a-f]{32})")
+metric_sample_re = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?( .*)$")
+
+
+def checkpoint_name(title):
+    """returns checkpoint's filename without extension and hash, for comparing titles that are written differently"""
+
+    if not title:
+        return None
+
+    name = title.split(" [")[0]
+    return os.path.splitext(os.path.basename(name.replace("\\", "/")))[0].lower()
+
+
+def merge_metrics(texts):
+    """combines metrics in Prometheus text format from several workers into one; texts is a list of (worker index, text)"""
+
+    families = collections.OrderedDict()
+    for index, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = families.setdefault(line.split()[2], {"comments": [], "samples": []})
+                if line not in family["comments"]:
+                    family["comments"].append(line)
+                continue
+
+            m = metric_sample_re.match(line)
+            if m is None or family is None:
+                continue
+
+            name, labels, value = m.groups()
+            labels = f'worker="{index}",{labels}' if labels else f'worker="{index}"'
+            family["samples"].append(f"{name}{{{labels}}}{value}")
+
+    lines = []
+    for family in families.values():
+        lines += family["comments"] + family["samples"]
+
+    return "\n".join(lines) + "\n"
+
+
+class Worker:
+    def __init__(self, index, port, command, host="127.0.0.1", env=None):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.command = command
+        self.env = env
+        self.process = None
+        self.lock = threading.Lock()
+
+        self.healthy = False
+        self.checkpoint = None
+        self.busy = False
+        self.queued = 0
+        self.in_flight = 0
+        self.restarts = 0
+        self.started = None
+        self.last_seen = None
+
+    def __repr__(self):
+        return f"worker {self.index} (port {self.port})"
+
+    def start(self):
+        self.healthy = False
+        self.started = time.time()
+        self.process = subprocess.Popen(self.command, env=self.env)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def exited(self):
+        return self.process is not None and self.process.poll() is not None
+
+    def load(self):
+        """number of requests this worker has to finish before it can start a new one"""
+
+        return max(self.in_flight, int(self.busy) + self.queued)
+
+    def connection(self, timeout=request_timeout):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+
+class Dispatcher:
+    def __init__(self, workers, auth=None):
+        """workers is a list of Worker objects; auth is a "user:password" pair that the dispatcher uses to check workers' status"""
+
+        self.workers = workers
+        self.auth_header = "Basic " + base64.b64encode(auth.encode('utf8')).decode('ascii') if auth else None
+        self.owners = collections.OrderedDict()
+        self.owners_lock = threading.Lock()
+        self.last_generation_worker = None
+        self.stopping = threading.Event()
+        self.monitor_thread = None
+        self.server = None
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+        self.monitor_thread = threading.Thread(target=self.monitor, name="dispatcher monitor", daemon=True)
+        self.monitor_thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+        for worker in self.workers:
+            worker.stop()
+
+    def monitor(self):
+        while not self.stopping.is_set():
+            for worker in self.workers:
+                self.check(worker)
+
+            self.stopping.wait(health_interval)
+
+    def check(self, worker):
+        if worker.exited():
+            worker.healthy = False
+
+            # a worker that keeps crashing right after start is restarted less and less often
+            if time.time() - worker.started < min(2 ** worker.restarts, 60):
+                return
+
+            print(f"Dispatcher: {worker} exited with code {worker.process.returncode}; restarting", file=sys.stderr)
+            worker.restarts += 1
+            worker.start()
+            return
+
+        try:
+            conn = worker.connection(timeout=status_timeout)
+            headers = {"Authorization": self.auth_header} if self.auth_header else {}
+            conn.request("GET", "/sdapi/v1/worker-status", headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            conn.close()
+
+            if response.status != 200:
+                raise ConnectionError(f"status {response.status}")
+
+            status = json.loads(data)
+        except Exception:
+            if worker.healthy:
+                errors.report(f"Dispatcher: {worker} does not respond", exc_info=True)
+            worker.healthy = False
+            return
+
+        if not worker.healthy:
+            print(f"Dispatcher: {worker} is ready")
+
+        worker.checkpoint = status.get("checkpoint")
+        worker.busy = status.get("busy", False)
+        worker.queued = status.get("queued", 0)
+        worker.last_seen = time.time()
+        worker.healthy = True
+
+    def remember_owner(self, key, worker):
+        with self.owners_lock:
+            self.owners[key] = worker
+            self.owners.move_to_end(key)
+            while len(self.owners) > max_remembered_ids:
+                self.owners.popitem(last=False)
+
+    def owner(self, key):
+        with self.owners_lock:
+            return self.owners.get(key)
+
+    def healthy_workers(self):
+        return [worker for worker in self.workers if worker.healthy]
+
+    def choose_worker(self, checkpoint=None):
+        """returns the worker that can start a request for the checkpoint soonest, or None if no worker is available"""
+
+        requested = checkpoint_name(checkpoint)
+
+        def cost(worker):
+            switch = checkpoint_switch_cost if requested is not None and checkpoint_name(worker.checkpoint) != requested else 0
+            return worker.load() + switch, worker.index
+
+        return min(self.healthy_workers(), key=cost, default=None)
+
+    def route_options(self, body):
+        """returns requests to send to workers for new settings: all of them get settings, the first one also saves them and loads the checkpoint"""
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+
+        checkpoint = data.get("sd_model_checkpoint") if isinstance(data, dict) else None
+        workers = self.healthy_workers()
+        first = self.choose_worker(checkpoint) if checkpoint else next(iter(workers), None)
+        if first is None:
+            return []
+
+        if checkpoint:
+            first.checkpoint = checkpoint  # until next status check tells otherwise
+
+            data = {k: v for k, v in data.items() if k != "sd_model_checkpoint"}
+            if not data:
+                return [(first, body, {})]
+
+            body_copy = json.dumps(data).encode('utf8')
+        else:
+            body_copy = body
+
+        return [(first, body, {}), *[(worker, body_copy, {copy_header: "1"}) for worker in workers if worker is not first]]
+
+    def route(self, method, path, query, body):
+        """returns a list of (worker, body, additional headers) to send the request to; an empty list means that no worker can take it"""
+
+        if method == "POST" and path == "/sdapi/v1/options":
+            return self.route_options(body)
+
+        if method == "POST" and path in broadcast_paths:
+            return [(worker, body, {}) for worker in self.healthy_workers()]
+
+        if path in generation_paths and body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+
+            if isinstance(data, dict):
+                checkpoint = (data.get("override_settings") or {}).get("sd_model_checkpoint")
+                worker = self.choose_worker(checkpoint)
+                if worker is None:
+                    return []
+
+                if checkpoint:
+                    worker.checkpoint = checkpoint  # until next status check tells otherwise
+
+                # task id is chosen here so that progress and jobs for it can be routed to the same worker later
+                task_id = data.get("force_task_id")
+                if not task_id:
+                    task_id = f"task({path.rsplit('/', 1)[-1]}-{''.join(random.choices(string.ascii_uppercase + string.digits, k=7))})"
+                    data["force_task_id"] = task_id
+                    body = json.dumps(data).encode('utf8')
+
+                self.remember_owner(task_id, worker)
+                self.last_generation_worker = worker
+                return [(worker, body, {})]
+
+        params = urllib.parse.parse_qs(query)
+        m = job_path_re.match(path)
+        key = urllib.parse.unquote(m.group(1)) if m else params.get("id_task", [None])[0]
+
+        if key is None and path in task_control_paths and body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+
+            key = data.get("id_task") if isinstance(data, dict) else None
+
+        m = image_path_re.match(path)
+        if m:
+            key = m.group(1)
+
+        if key is not None:
+            worker = self.owner(key)
+            if worker is not None:
+                return [(worker, body, {})]
+
+        if (path == "/sdapi/v1/progress" or path in task_control_paths) and self.last_generation_worker is not None:
+            return [(self.last_generation_worker, body, {})]
+
+        worker = self.choose_worker()
+        return [(worker, body, {})] if worker else []
+
+    def forward(self, worker, method, path_and_query, headers, body, client_address=None, extra_headers=None):
+        """
+        sends the request to the worker and returns an open http.client response; client_address is passed to the worker in
+        X-Forwarded-For, replacing the header if the client sent one, so that the worker can tell clients apart for its limits;
+        headers set by the dispatcher itself are only ever taken from extra_headers
+        """
+
+        conn = worker.connection()
+        conn.putrequest(method, path_and_query, skip_host=True, skip_accept_encoding=True)
+        conn.putheader("Host", f"{worker.host}:{worker.port}")
+        for name, value in headers.items():
+            if name.lower() not in hop_by_hop_headers and name.lower() not in ("x-forwarded-for", copy_header.lower()):
+                conn.putheader(name, value)
+        if client_address is not None:
+            conn.putheader("X-Forwarded-For", client_address)
+        for name, value in (extra_headers or {}).items():
+            conn.putheader(name, value)
+        conn.putheader("Content-Length", str(len(body or b"")))
+        conn.endheaders(body or None)
+
+        return conn.getresponse()
+
+    def serve(self, host, port):
+        dispatcher = self
+
+        class Handler(DispatcherRequestHandler):
+            pass
+
+        Handler.dispatcher = dispatcher
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.serve_forever()
+
+
+class DispatcherRequestHandler(http.server.BaseHTTPRequestHandler):
+    dispatcher = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def dispatch(self):
+        dispatcher = self.dispatcher
+        parsed = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if self.command == "GET" and parsed.path == "/metrics":
+            self.metrics()
+            return
+
+        if not parsed.path.startswith("/sdapi/v1/"):
+            self.send_json(404, {"detail": "Not Found"})
+            return
+
+        if self.command == "GET" and parsed.path == "/sdapi/v1/jobs":
+            self.list_jobs()
+            return
+
+        forwards = dispatcher.route(self.command, parsed.path, parsed.query, body)
+        if not forwards:
+            self.send_json(503, {"detail": "No workers are available"}, {"Retry-After": str(int(health_interval) + 1)})
+            return
+
+        # when a request goes to several workers, all responses are read, and the client gets the first failed one, if any
+        results = []
+        for worker, worker_body, extra_headers in forwards:
+            with worker.lock:
+                worker.in_flight += 1
+
+            try:
+                response = dispatcher.forward(worker, self.command, self.path, self.headers, worker_body, self.client_address[0], extra_headers)
+                data = response.read() if len(forwards) > 1 else None
+                results.append((worker, response, data, None))
+            except Exception as e:
+                errors.report(f"Dispatcher: error forwarding {self.command} {parsed.path} to {worker}", exc_info=True)
+                results.append((worker, None, None, e))
+            finally:
+                with worker.lock:
+                    worker.in_flight -= 1
+
+        failed = [x for x in results if x[1] is None or x[1].status >= 400]
+        worker, response, data, error = failed[0] if failed else results[-1]
+
+        if response is None:
+            self.send_json(502, {"detail": f"Error sending request to {worker}: {error}"})
+            return
+
+        self.relay(response, worker, parsed.path, data)
+
+    def relay(self, response, worker, path, data=None):
+        """sends worker's response back to the client; data is the body if it was already read; event streams are passed through as they arrive"""
+
+        streaming = response.getheader("Content-Type", "").startswith("text/event-stream")
+
+        self.send_response(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in hop_by_hop_headers:
+                self.send_header(name, value)
+
+        if streaming and data is None:
+            self.send_header("Connection", "close")
+            self.end_headers()
+            while True:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                self.wfile.flush()
+            return
+
+        if data is None:
+            data = response.read()
+
+        # images returned as URLs are kept by the worker that made them
+        if path in generation_paths or path.endswith("/result"):
+            for image_id in image_url_re.findall(data):
+                self.dispatcher.remember_owner(image_id.decode('ascii'), worker)
+
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def metrics(self):
+        """asks every worker for its metrics and returns all of them, labelled with the worker"""
+
+        texts = []
+        for worker in self.dispatcher.healthy_workers():
+            try:
+                response = self.dispatcher.forward(worker, "GET", self.path, self.headers, b"")
+                data = response.read()
+            except Exception:
+                errors.report(f"Dispatcher: error getting metrics from {worker}", exc_info=True)
+                continue
+
+            if response.status != 200:
+                self.relay(response, worker, "/metrics", data)
+                return
+
+            texts.append((worker.index, data.decode('utf8')))
+
+        body = merge_metrics(texts).encode('utf8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def list_jobs(self):
+        """asks every worker for its jobs and returns all of them"""
+
+        res = []
+        for worker in self.dispatcher.healthy_workers():
+            try:
+                response = self.dispatcher.forward(worker, "GET", self.path, self.headers, b"")
+                data = response.read()
+                if response.status != 200:
+                    self.send_json(response.status, json.loads(data or b"{}"))
+                    return
+
+                res += json.loads(data)
+            except Exception as e:
+                self.send_json(502, {"detail": f"Error sending request to {worker}: {e}"})
+                return
+
+        self.send_json(200, res)
+
+
+removed_worker_arguments = {"--dispatcher-workers": 1, "--port": 1, "--server-name": 1, "--listen": 0, "--share": 0, "--nowebui": 0, "--api": 0}
+
+
+def worker_arguments(argv, port):
+    """returns command line arguments for a worker process from arguments given to the dispatcher"""
+
+    res = []
+    skip = 0
+    for arg in argv:
+        if skip:
+            skip -= 1
+            continue
+
+        name = arg.split("=", 1)[0]
+        if name in removed_worker_arguments:
+            skip = removed_worker_arguments[name] if "=" not in arg else 0
+            continue
+
+        res.append(arg)
+
+    return res + ["--nowebui", "--port", str(port), "--skip-prepare-environment"]
+
+
+def main(args, argv):
+    """runs the dispatcher with workers until interrupted; args are parsed command line options, argv is the raw command line"""
+
+    if args.tls_keyfile or args.tls_certfile:
+        print("Dispatcher: TLS is not supported in dispatcher mode; put a TLS-terminating proxy in front of it", file=sys.stderr)
+        sys.exit(1)
+
+    host = args.server_name or ("0.0.0.0" if args.listen else "127.0.0.1")
+    port = args.port or 7861
+    launch_script = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "launch.py")
+
+    # argv already includes COMMANDLINE_ARGS, so workers must not get them again; workers share the cache directory, so
+    # they read and write it directly rather than keep entries in memory that other workers would not see
+    env = {**os.environ, "COMMANDLINE_ARGS": "", "SD_WEBUI_CACHE_MEMORY": "0"}
+
+    workers = []
+    for i in range(args.dispatcher_workers):
+        worker_port = port + 1 + i
+        command = [sys.executable, launch_script, *worker_arguments(argv, worker_port)]
+        workers.append(Worker(i, worker_port, command, env=env))
+
+    auth = args.api_auth.split(",")[0] if args.api_auth else None
+    dispatcher = Dispatcher(workers, auth=auth)
+    dispatcher.start()
+
+    print(f"Dispatcher: forwarding http://{host}:{port}/sdapi/v1/ to {len(workers)} workers on ports {port + 1}-{port + len(workers)}")
+
+    try:
+        dispatcher.serve(host, port)
+    except KeyboardInterrupt:
+        print("Caught KeyboardInterrupt, stopping workers...")
+    finally:
+        dispatcher.stop()
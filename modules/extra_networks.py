@@ -4,7 +4,7 @@ import re
 import logging
 from collections import defaultdict
 
-from modules import errors
+from modules import errors, tracing
 
 extra_network_registry = {}
 extra_network_aliases = {}
@@ -86,6 +86,16 @@ class ExtraNetwork:
 
         raise NotImplementedError
 
+    def cache_identity(self, params_list):
+        """
+        Called by result cache with arguments that would be passed to activate(). Should return a JSON-like value that changes
+        whenever files used by this extra network change, for example a list of file hashes or modification times.
+
+        If this returns None and params_list is not empty, results of the processing are not cached.
+        """
+
+        return None
+
 
 def lookup_extra_networks(extra_network_data):
     """returns a dict mapping ExtraNetwork objects to lists of arguments for those extra networks.
@@ -132,7 +142,8 @@ def activate(p, extra_network_data):
     for extra_network, extra_network_args in lookup_extra_networks(extra_network_data).items():
 
         try:
-            extra_network.activate(p, extra_network_args)
+            with tracing.span(f"activate {extra_network.name}"):
+                extra_network.activate(p, extra_network_args)
             activated.append(extra_network)
         except Exception as e:
             errors.display(e, f"activating extra network {extra_network.name} with arguments {extra_network_args}")
@@ -1,4 +1,4 @@
-from modules import extra_networks, shared
+from modules import extra_networks, result_cache, shared
 from modules.hypernetworks import hypernetwork
 
 
@@ -26,3 +26,10 @@ class ExtraNetworkHypernet(extra_networks.ExtraNetwork):
 
     def deactivate(self, p):
         pass
+
+    def cache_identity(self, params_list):
+        names = [params.items[0] for params in params_list if params.items]
+        if shared.opts.sd_hypernetwork != "None":
+            names.append(shared.opts.sd_hypernetwork)
+
+        return [[name, result_cache.file_identity(shared.hypernetworks.get(name))] for name in names]
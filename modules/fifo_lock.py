@@ -1,15 +1,23 @@
+import contextlib
+import heapq
+import itertools
 import threading
-import collections
 
 
 # reference: https://gist.github.com/vitaliyp/6d54dd76ca2c3cdfc1149d33007dc34a
 class FIFOLock(object):
+    """
+    A lock that is given to waiting threads in the order they started waiting in. Threads may wait with a priority:
+    ones with higher priority get the lock first, ones with the same priority get it in FIFO order.
+    """
+
     def __init__(self):
         self._lock = threading.Lock()
         self._inner_lock = threading.Lock()
-        self._pending_threads = collections.deque()
+        self._pending_threads = []
+        self._counter = itertools.count()
 
-    def acquire(self, blocking=True):
+    def acquire(self, blocking=True, priority=0):
         with self._inner_lock:
             lock_acquired = self._lock.acquire(False)
             if lock_acquired:
@@ -18,7 +26,7 @@ class FIFOLock(object):
                 return False
 
             release_event = threading.Event()
-            self._pending_threads.append(release_event)
+            heapq.heappush(self._pending_threads, (-priority, next(self._counter), release_event))
 
         release_event.wait()
         return self._lock.acquire()
@@ -26,11 +34,30 @@ class FIFOLock(object):
     def release(self):
         with self._inner_lock:
             if self._pending_threads:
-                release_event = self._pending_threads.popleft()
+                _, _, release_event = heapq.heappop(self._pending_threads)
                 release_event.set()
 
             self._lock.release()
 
+    @contextlib.contextmanager
+    def at_priority(self, priority):
+        """context manager that holds the lock, waiting for it with given priority"""
+
+        self.acquire(priority=priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def waiting(self):
+        """returns the number of threads waiting for the lock"""
+
+        with self._inner_lock:
+            return len(self._pending_threads)
+
     __enter__ = acquire
 
     def __exit__(self, t, v, tb):
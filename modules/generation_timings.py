@@ -0,0 +1,107 @@
+"""
+History of how long generations take, used to estimate how long new ones are going to take.
+
+After every generation that runs the sampler, the time it took per step of one image is recorded for its profile:
+architecture of the checkpoint, resolution, sampler and number of steps. Running averages are kept in the
+"generation-timings" cache subsection so that they survive restarts. A profile that was never seen is estimated from
+the time per step and pixel of ones that were, preferring ones with the same architecture and sampler.
+"""
+
+import threading
+
+from modules import cache, errors, shared
+from modules.shared import opts
+
+subsection = "generation-timings"
+
+smoothing = 0.25
+"""weight of the newest measurement in running averages"""
+
+lock = threading.Lock()
+timings = None
+
+
+def checkpoint_architecture(checkpoint_info):
+    architecture = checkpoint_info.detect_architecture() if checkpoint_info is not None else None
+    return architecture or "unknown"
+
+
+def sampling_steps(steps, denoising_strength=None):
+    """number of steps the sampler actually makes; with img2img_fix_steps, img2img only makes a part of them"""
+
+    if denoising_strength is not None and opts.img2img_fix_steps:
+        return max(1, int(min(denoising_strength, 0.999) * steps))
+
+    return steps
+
+
+def profile_key(architecture, width, height, sampler, steps):
+    return f"{architecture}:{width}x{height}:{sampler}:{steps}"
+
+
+def load():
+    global timings
+
+    with lock:
+        if timings is None:
+            storage = cache.cache(subsection)
+            timings = storage.get_many(storage.keys())
+
+    return timings
+
+
+def record(architecture, width, height, sampler, steps, seconds_per_image):
+    key = profile_key(architecture, width, height, sampler, steps)
+    step_seconds = seconds_per_image / max(steps, 1)
+
+    load()
+    with lock:
+        entry = timings.get(key)
+        if entry is None:
+            entry = {"architecture": architecture, "pixels": width * height, "sampler": sampler, "step_seconds": step_seconds, "count": 1}
+        else:
+            entry = {**entry, "step_seconds": entry["step_seconds"] * (1 - smoothing) + step_seconds * smoothing, "count": entry["count"] + 1}
+
+        timings[key] = entry
+
+    cache.cache(subsection)[key] = entry
+
+
+def record_processing(p, seconds):
+    """records time it took to run process_images_inner for p; generations that were interrupted or ran two passes are not recorded"""
+
+    if shared.state.interrupted or shared.state.skipped or getattr(p, "enable_hr", False):
+        return
+
+    images = p.n_iter * p.batch_size
+    if images <= 0:
+        return
+
+    try:
+        steps = sampling_steps(p.steps, getattr(p, "denoising_strength", None) if hasattr(p, "init_images") else None)
+        record(checkpoint_architecture(p.sd_model.sd_checkpoint_info), p.width, p.height, p.sampler_name, steps, seconds / images)
+    except Exception as e:
+        errors.display(e, "recording generation time")
+
+
+def estimate(architecture, width, height, sampler, steps):
+    """returns estimated seconds to make one image with given profile, or None if there's nothing to estimate it from"""
+
+    load()
+    with lock:
+        entry = timings.get(profile_key(architecture, width, height, sampler, steps))
+        if entry is not None:
+            return entry["step_seconds"] * steps
+
+        entries = list(timings.values())
+
+    for similar in (
+        [x for x in entries if x["architecture"] == architecture and x["sampler"] == sampler],
+        [x for x in entries if x["architecture"] == architecture],
+        entries,
+    ):
+        if similar:
+            pixel_step_seconds = sum(x["step_seconds"] / x["pixels"] for x in similar) / len(similar)
+            return pixel_step_seconds * width * height * steps
+
+    return None
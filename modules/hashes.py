@@ -1,12 +1,20 @@
 import hashlib
+import heapq
+import itertools
 import os.path
+import threading
+import time
 
-from modules import shared
+from modules import shared, safetensors_index
 import modules.cache
 
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+PRIORITY_IMMEDIATE = 0
+PRIORITY_HIGH = 10
+PRIORITY_BACKGROUND = 100
+
 
 def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
@@ -19,6 +27,85 @@ def calculate_sha256(filename):
     return hash_sha256.hexdigest()
 
 
+def tensor_digest_hasher(dtype, shape):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{dtype}{shape}".encode("utf8"))
+    return h
+
+
+def calculate_sha256_and_addnet_hash(filename, header_info=None):
+    """Calculates sha256 of the whole file and, for safetensors files, the kohya-ss addnet hash, reading the file only once.
+
+    If header_info (see safetensors_index.read_header) is given, also calculates a digest of each tensor's dtype, shape and data
+    in the same pass.
+
+    Returns a tuple (sha256, addnet_hash, tensor digests, number of bytes read); addnet_hash is None for files that are not
+    safetensors, tensor digests is None if header_info is not given."""
+
+    hash_sha256 = hashlib.sha256()
+    hash_addnet = hashlib.sha256() if os.path.splitext(filename)[1].lower() == ".safetensors" else None
+    blksize = 1024 * 1024
+    total = 0
+
+    spans = []
+    digests = None
+    if header_info is not None:
+        data_offset = header_info["data_offset"]
+        spans = sorted((data_offset + begin, data_offset + end, name) for name, (_, _, (begin, end)) in header_info["tensors"].items())
+        digests = {}
+
+    span_index = 0
+    hasher = None
+
+    with open(filename, "rb") as f:
+        header = f.read(8)
+        hash_sha256.update(header)
+        total += len(header)
+
+        # bytes until the start of tensor data are not included into addnet hash
+        skip = int.from_bytes(header, "little") if len(header) == 8 else 0
+
+        for chunk in iter(lambda: f.read(blksize), b""):
+            hash_sha256.update(chunk)
+            chunk_start = total
+            total += len(chunk)
+
+            view = memoryview(chunk)
+            while span_index < len(spans) and spans[span_index][0] < total:
+                begin, end, name = spans[span_index]
+                if hasher is None:
+                    dtype, shape, _ = header_info["tensors"][name]
+                    hasher = tensor_digest_hasher(dtype, shape)
+
+                hasher.update(view[max(begin, chunk_start) - chunk_start:min(end, total) - chunk_start])
+                if end > total:
+                    break
+
+                digests[name] = hasher.hexdigest()
+                hasher = None
+                span_index += 1
+
+            if hash_addnet is None:
+                continue
+
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+
+            hash_addnet.update(view[skip:])
+            skip = 0
+
+    for _, _, name in spans[span_index:]:
+        if hasher is None:
+            dtype, shape, _ = header_info["tensors"][name]
+            hasher = tensor_digest_hasher(dtype, shape)
+
+        digests[name] = hasher.hexdigest()
+        hasher = None
+
+    return hash_sha256.hexdigest(), hash_addnet.hexdigest() if hash_addnet is not None else None, digests, total
+
+
 def sha256_from_cache(filename, title, use_addnet_hash=False):
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
     try:
@@ -38,9 +125,49 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
     return cached_sha256
 
 
-def sha256(filename, title, use_addnet_hash=False):
+def prefetch_from_cache(titles, use_addnet_hash=False):
+    """reads cached hashes for many files in one go, so that sha256_from_cache calls for them that follow do not go to disk"""
+
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+    hashes.get_many(titles)
+
+
+def tensor_digests_from_cache(filename, title):
+    digests = cache("tensor-digests")
+    try:
+        ondisk_mtime = os.path.getmtime(filename)
+    except FileNotFoundError:
+        return None
+
+    entry = digests.get(title)
+    if entry is None or ondisk_mtime > entry.get("mtime", 0):
+        return None
+
+    return entry.get("digests")
+
+
+def tensor_digests(filename, title):
+    """Returns a dict of tensor name -> digest of tensor's dtype, shape and data for a safetensors file.
+
+    Digests are calculated in the same pass over the file as sha256 and cached, so for a file that was hashed they are free."""
+
+    digests = tensor_digests_from_cache(filename, title)
+    if digests is not None:
+        return digests
+
+    if shared.cmd_opts.no_hashing:
+        return None
+
+    job = hashing_service.submit(filename, title, priority=PRIORITY_IMMEDIATE, need_tensor_digests=True)
+    hashing_service.run_or_wait(job)
+
+    if job.error is not None:
+        raise job.error
 
+    return job.tensor_digests
+
+
+def sha256(filename, title, use_addnet_hash=False):
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,22 +175,13 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
-    print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+    job = hashing_service.submit(filename, title, priority=PRIORITY_IMMEDIATE)
+    hashing_service.run_or_wait(job)
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
+    if job.error is not None:
+        raise job.error
 
-    dump_cache()
-
-    return sha256_value
+    return job.addnet_hash if use_addnet_hash else job.sha256
 
 
 def addnet_hash_safetensors(b):
@@ -82,3 +200,189 @@ def addnet_hash_safetensors(b):
 
     return hash_sha256.hexdigest()
 
+
+class HashingJob:
+    def __init__(self, filename, title, priority):
+        self.filename = filename
+        self.title = title
+        self.priority = priority
+        self.started = False
+        self.done = threading.Event()
+        self.need_tensor_digests = False
+        self.sha256 = None
+        self.addnet_hash = None
+        self.tensor_digests = None
+        self.error = None
+
+
+class HashingService:
+    """
+    Calculates hashes of model files using a bounded pool of background threads.
+
+    Jobs are taken from a priority queue, so a file that is about to be loaded can be moved ahead of files
+    queued for background hashing. Each file is read once, producing both sha256 and addnet hash, which are
+    written into "hashes" and "hashes-addnet" cache sections.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+
+        self.completed = 0
+        self.failed = 0
+        self.bytes_hashed = 0
+        self.time_hashing = 0.0
+
+    def submit(self, filename, title, priority=PRIORITY_BACKGROUND, need_tensor_digests=False):
+        """Adds a file to the queue, or raises priority of an already queued job for the same file; returns the job."""
+
+        key = os.path.abspath(filename)
+
+        with self.condition:
+            job = self.jobs.get(key)
+            if job is not None and need_tensor_digests and not job.need_tensor_digests and job.started:
+                job = None  # the running job may skip calculating digests; hash the file again
+
+            if job is None:
+                job = HashingJob(filename, title, priority)
+                job.need_tensor_digests = need_tensor_digests
+                self.jobs[key] = job
+            elif priority < job.priority and not job.started:
+                job.priority = priority
+                job.need_tensor_digests = job.need_tensor_digests or need_tensor_digests
+            else:
+                job.need_tensor_digests = job.need_tensor_digests or need_tensor_digests
+                return job
+
+            heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+
+            self.start_threads()
+            self.condition.notify()
+
+        return job
+
+    def run_or_wait(self, job):
+        """Hashes the file for the job on calling thread if no worker has taken the job yet; otherwise waits for the worker to finish it."""
+
+        with self.condition:
+            claimed = not job.started
+            job.started = True
+
+        if claimed:
+            self.process(job)
+        else:
+            job.done.wait()
+
+    def start_threads(self):
+        wanted = max(int(shared.opts.hashing_threads), 1) if shared.opts is not None else 1
+
+        self.threads = [x for x in self.threads if x.is_alive()]
+        while len(self.threads) < wanted:
+            thread = threading.Thread(target=self.worker, name=f"hashing-{len(self.threads)}", daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    if not self.condition.wait(timeout=60):
+                        if not self.queue:
+                            # while the lock is held, so that a job submitted right after this starts a new thread
+                            self.threads.remove(threading.current_thread())
+                            return
+
+                _, _, job = heapq.heappop(self.queue)
+                if job.started:
+                    continue
+
+                job.started = True
+
+            self.process(job)
+
+    def process(self, job):
+        try:
+            cached_sha256 = sha256_from_cache(job.filename, job.title)
+            cached_addnet = sha256_from_cache(job.filename, job.title, use_addnet_hash=True)
+            cached_digests = tensor_digests_from_cache(job.filename, job.title)
+            is_safetensors = os.path.splitext(job.filename)[1].lower() == ".safetensors"
+
+            if cached_sha256 is not None and (cached_addnet is not None or not is_safetensors) and (cached_digests is not None or not is_safetensors or not job.need_tensor_digests):
+                job.sha256, job.addnet_hash, job.tensor_digests = cached_sha256, cached_addnet, cached_digests
+                return
+
+            header_info = None
+            if is_safetensors:
+                try:
+                    header_info = safetensors_index.get(job.filename)
+                except Exception:
+                    pass
+
+            print(f"Calculating sha256 for {job.filename}: ", end='')
+            mtime = os.path.getmtime(job.filename)
+            time_start = time.time()
+            job.sha256, job.addnet_hash, job.tensor_digests, nbytes = calculate_sha256_and_addnet_hash(job.filename, header_info)
+            elapsed = time.time() - time_start
+            print(f"{job.sha256}")
+
+            filename = os.path.abspath(job.filename)
+            cache("hashes")[job.title] = {"mtime": mtime, "sha256": job.sha256, "filename": filename}
+            if job.addnet_hash is not None:
+                cache("hashes-addnet")[job.title] = {"mtime": mtime, "sha256": job.addnet_hash, "filename": filename}
+            if job.tensor_digests is not None:
+                cache("tensor-digests")[job.title] = {"mtime": mtime, "digests": job.tensor_digests, "filename": filename}
+
+            if job.title.startswith("checkpoint/") and shared.opts.data.get("cache_pin_checkpoint_hashes", True):
+                cache("hashes").pin([job.title])
+
+            dump_cache()
+
+            with self.condition:
+                self.completed += 1
+                self.bytes_hashed += nbytes
+                self.time_hashing += elapsed
+
+        except Exception as e:
+            job.error = e
+
+            with self.condition:
+                self.failed += 1
+
+        finally:
+            with self.condition:
+                key = os.path.abspath(job.filename)
+                if self.jobs.get(key) is job:
+                    del self.jobs[key]
+
+            job.done.set()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queue_depth": len({id(job) for _, _, job in self.queue if not job.started}),
+                "active": sum(1 for job in self.jobs.values() if job.started),
+                "threads": len([x for x in self.threads if x.is_alive()]),
+                "completed": self.completed,
+                "failed": self.failed,
+                "bytes_hashed": self.bytes_hashed,
+                "seconds": self.time_hashing,
+                "throughput": self.bytes_hashed / self.time_hashing if self.time_hashing > 0 else 0.0,
+            }
+
+
+hashing_service = HashingService()
+
+
+def queue_background_hashing(filename, title, priority=PRIORITY_BACKGROUND):
+    """Schedules the file to be hashed in background if it's enabled in settings and the hash is not in cache already."""
+
+    if shared.cmd_opts.no_hashing or not shared.opts.hashing_background:
+        return
+
+    if sha256_from_cache(filename, title) is not None:
+        return
+
+    hashing_service.submit(filename, title, priority=priority)
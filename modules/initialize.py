@@ -36,7 +36,13 @@ def imports():
     shared_init.initialize()
     startup_timer.record("initialize shared")
 
-    from modules import processing, gradio_extensons, ui  # noqa: F401
+    from modules import processing  # noqa: F401
+
+    # with --nowebui, UI modules are not needed; API sets up scripts without building the UI, see scripts.setup_scripts_without_ui
+    from modules.shared_cmd_options import cmd_opts
+    if not cmd_opts.nowebui:
+        from modules import gradio_extensons, ui  # noqa: F401
+
     startup_timer.record("other imports")
 
 
@@ -57,6 +63,10 @@ def initialize():
     initialize_util.configure_sigint_handler()
     initialize_util.configure_opts_onchange()
 
+    from modules import startup_snapshot
+    startup_snapshot.load()
+    startup_timer.record("load startup snapshot")
+
     from modules import sd_models
     sd_models.setup_model()
     startup_timer.record("setup SD model")
@@ -167,3 +177,6 @@ def initialize_rest(*, reload_script_modules=False):
     extra_networks.initialize()
     extra_networks.register_default_extra_networks()
     startup_timer.record("initialize extra networks")
+
+    from modules import startup_snapshot
+    startup_snapshot.revalidate_in_background()
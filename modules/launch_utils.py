@@ -461,6 +461,11 @@ def configure_for_tests():
 
 
 def start():
+    if args.dispatcher_workers:
+        from modules import dispatcher
+        dispatcher.main(args, sys.argv[1:])
+        return
+
     print(f"Launching {'API server' if '--nowebui' in sys.argv else 'Web UI'} with arguments: {shlex.join(sys.argv[1:])}")
     import webui
     if '--nowebui' in sys.argv:
@@ -0,0 +1,196 @@
+"""
+Metrics of the generation pipeline in Prometheus text format, served by the API at /metrics.
+
+Histograms and counters are updated by instrumented code as things happen: queue wait, conditioning, every sampling
+step, VAE decode, postprocessing scripts, saving and encoding images, and making API responses; model loads and switches,
+NaN retries in VAE and interrupts. Gauges and cache counters are read from their sources when metrics are requested.
+Only the standard library is imported at module level, so any module can use this one.
+"""
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+registry = []
+
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    escaped = {name: str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for name, value in labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self):
+        """returns a list of (name suffix, labels dict, value)"""
+
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}")
+
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [("", {}, self.value)]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=default_buckets):
+        super().__init__(name, documentation)
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        """observes how long the with block takes; can also be used as a decorator"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        res = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [math.inf], counts):
+            cumulative += count
+            res.append(("_bucket", {"le": format_value(float(bound))}, cumulative))
+
+        res.append(("_sum", {}, total))
+        res.append(("_count", {}, cumulative))
+        return res
+
+
+class Collected(Metric):
+    """gauge or counter whose values are returned by func when metrics are requested: a number, or a list of (labels dict, value)"""
+
+    def __init__(self, name, documentation, metric_type, func):
+        super().__init__(name, documentation)
+        self.type = metric_type
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if value is None:
+            return []
+
+        if isinstance(value, list):
+            return [("", labels, x) for labels, x in value]
+
+        return [("", {}, value)]
+
+
+queue_wait = Histogram("sd_queue_wait_seconds", "Time generation tasks spent in queue before starting")
+conditioning = Histogram("sd_conditioning_seconds", "Time to compute prompt conditioning for a batch")
+sampling_step = Histogram("sd_sampling_step_seconds", "Time of one sampling step", buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0))
+vae_decode = Histogram("sd_vae_decode_seconds", "Time to decode a batch of latents with VAE")
+postprocess_scripts = Histogram("sd_postprocess_scripts_seconds", "Time spent in postprocess_batch and postprocess_batch_list of scripts for a batch")
+image_save = Histogram("sd_image_save_seconds", "Time to save one image to disk")
+image_encode = Histogram("sd_image_encode_seconds", "Time to encode one image for an API response")
+api_response = Histogram("sd_api_response_seconds", "Time to make an API response from encoded images, including JSON serialization")
+
+model_loads = Counter("sd_model_loads_total", "Number of times a model was created and loaded from a checkpoint")
+model_switches = Counter("sd_model_switches_total", "Number of times a different checkpoint was loaded")
+vae_nan_retries = Counter("sd_vae_nan_retries_total", "Number of times VAE produced NaNs and decoding was retried with a different precision")
+interrupts = Counter("sd_interrupts_total", "Number of interrupt requests")
+
+
+def cache_counts(field):
+    from modules import cache, result_cache
+
+    res = [({"cache": subsection}, stats[field]) for subsection, stats in cache.stats().items()]
+    res.append(({"cache": "generation-results"}, result_cache.stats()[field]))
+    return res
+
+
+def resident_memory():
+    import psutil
+
+    return psutil.Process().memory_info().rss
+
+
+def cuda_memory(func_name):
+    import torch
+
+    if not torch.cuda.is_available():
+        return None
+
+    return getattr(torch.cuda, func_name)()
+
+
+def queue_depth():
+    from modules import progress
+
+    return len(progress.pending_tasks)
+
+
+Collected("sd_cache_hits_total", "Number of lookups that found an entry, by cache", "counter", lambda: cache_counts("hits"))
+Collected("sd_cache_misses_total", "Number of lookups that found no entry, by cache", "counter", lambda: cache_counts("misses"))
+Collected("sd_process_resident_memory_bytes", "Resident memory of the process", "gauge", resident_memory)
+Collected("sd_cuda_memory_allocated_bytes", "CUDA memory occupied by tensors", "gauge", lambda: cuda_memory("memory_allocated"))
+Collected("sd_cuda_memory_reserved_bytes", "CUDA memory reserved by the caching allocator", "gauge", lambda: cuda_memory("memory_reserved"))
+Collected("sd_queue_depth", "Number of generation tasks waiting in queue", "gauge", queue_depth)
+
+
+def render():
+    """returns all metrics in Prometheus text exposition format"""
+
+    from modules import errors
+
+    lines = []
+    for metric in registry:
+        try:
+            lines += metric.render()
+        except Exception as e:
+            errors.display(e, f"collecting metric {metric.name}")
+
+    return "\n".join(lines) + "\n"
@@ -8,7 +8,7 @@ from urllib.parse import urlparse
 
 import torch
 
-from modules import shared
+from modules import shared, startup_snapshot
 from modules.upscaler import Upscaler, UpscalerLanczos, UpscalerNearest, UpscalerNone
 
 if TYPE_CHECKING:
@@ -69,7 +69,7 @@ def load_models(model_path: str, model_url: str = None, command_path: str = None
         places.append(model_path)
 
         for place in places:
-            for full_path in shared.walk_files(place, allowed_extensions=ext_filter):
+            for full_path in shared.walk_files(place, allowed_extensions=ext_filter, use_snapshot=True):
                 if os.path.islink(full_path) and not os.path.exists(full_path):
                     print(f"Skipping broken symlink: {full_path}")
                     continue
@@ -139,6 +139,10 @@ def load_upscalers():
         key=lambda x: x.name.lower() if not isinstance(x.scaler, (UpscalerNone, UpscalerLanczos, UpscalerNearest)) else ""
     )
 
+
+startup_snapshot.add_refresh_callback("upscalers", load_upscalers)
+
+
 # None: not loaded, False: failed to load, True: loaded
 _spandrel_extra_init_state = None
 
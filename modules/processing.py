@@ -5,6 +5,7 @@ import math
 import os
 import sys
 import hashlib
+import time
 from dataclasses import dataclass, field
 
 import torch
@@ -16,7 +17,7 @@ from skimage import exposure
 from typing import Any
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, result_cache, generation_timings, metrics, tracing
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -224,6 +225,7 @@ class StableDiffusionProcessing:
     sd_vae_hash: str = field(default=None, init=False)
 
     is_api: bool = field(default=False, init=False)
+    image_callback: Any = field(default=None, init=False)  # called with every generated image as soon as it's ready
 
     def __post_init__(self):
         if self.sampler_index is not None:
@@ -658,6 +660,8 @@ def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
                     f"To disable this behavior, disable the '{autofix_dtype_setting}' setting.{autofix_dtype_comment}"
                 )
 
+                metrics.vae_nan_retries.inc()
+
                 devices.dtype_vae = autofix_dtype
                 model.first_stage_model.to(devices.dtype_vae)
                 batch = batch.to(devices.dtype_vae)
@@ -844,7 +848,13 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
         sd_samplers.fix_p_invalid_sampler_and_scheduler(p)
 
         with profiling.Profiler():
-            res = process_images_inner(p)
+            result_cache_key, res = result_cache.lookup(p)
+            if res is None:
+                started = time.perf_counter()
+                with tracing.span("process_images_inner"):
+                    res = process_images_inner(p)
+                generation_timings.record_processing(p, time.perf_counter() - started)
+                result_cache.store(result_cache_key, res)
 
     finally:
         sd_models.apply_token_merging(p.sd_model, 0)
@@ -917,7 +927,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
     infotexts = []
     output_images = []
     with torch.no_grad(), p.sd_model.ema_scope():
-        with devices.autocast():
+        with devices.autocast(), tracing.span("init"):
             p.init(p.all_prompts, p.all_seeds, p.all_subseeds)
 
             # for OSX, loading the model during sampling changes the generated picture, so it is loaded here
@@ -957,13 +967,14 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             p.parse_extra_network_prompts()
 
             if not p.disable_extra_networks:
-                with devices.autocast():
+                with devices.autocast(), tracing.span("activate extra networks"):
                     extra_networks.activate(p, p.extra_network_data)
 
             if p.scripts is not None:
                 p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
 
-            p.setup_conds()
+            with metrics.conditioning.time(), tracing.span("conditioning"):
+                p.setup_conds()
 
             p.extra_generation_params.update(model_hijack.extra_generation_params)
 
@@ -984,7 +995,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
             sd_models.apply_alpha_schedule_override(p.sd_model, p)
 
-            with devices.without_autocast() if devices.unet_needs_upcast else devices.autocast():
+            with devices.without_autocast() if devices.unet_needs_upcast else devices.autocast(), tracing.span("sampling", batch=n):
                 samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
 
             if p.scripts is not None:
@@ -999,7 +1010,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
                 if opts.sd_vae_decode_method != 'Full':
                     p.extra_generation_params['VAE Decoder'] = opts.sd_vae_decode_method
-                x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
+                with metrics.vae_decode.time(), tracing.span("vae decode"):
+                    x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
 
             x_samples_ddim = torch.stack(x_samples_ddim).float()
             x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
@@ -1014,14 +1026,15 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             state.nextjob()
 
             if p.scripts is not None:
-                p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
+                with metrics.postprocess_scripts.time(), tracing.span("postprocess scripts"):
+                    p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
 
-                p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
-                p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+                    p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+                    p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
 
-                batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
-                p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
-                x_samples_ddim = batch_params.images
+                    batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
+                    p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
+                    x_samples_ddim = batch_params.images
 
             def infotext(index=0, use_main_prompt=False):
                 return create_infotext(p, p.prompts, p.seeds, p.subseeds, use_main_prompt=use_main_prompt, index=index, all_negative_prompts=p.negative_prompts)
@@ -1090,6 +1103,9 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image.info["parameters"] = text
                 output_images.append(image)
 
+                if p.image_callback is not None:
+                    p.image_callback(image)
+
                 if mask_for_overlay is not None:
                     if opts.return_mask or opts.save_mask:
                         image_mask = mask_for_overlay.convert('RGB')
@@ -2,10 +2,10 @@ import json
 
 import gradio as gr
 
-from modules import scripts, ui, errors
+from modules import scripts, errors
 from modules.infotext_utils import PasteField
 from modules.shared import cmd_opts
-from modules.ui_components import ToolButton
+from modules.ui_components import ToolButton, random_symbol, reuse_symbol
 from modules import infotext_utils
 
 
@@ -31,16 +31,16 @@ class ScriptSeed(scripts.ScriptBuiltinUI):
             else:
                 self.seed = gr.Number(label='Seed', value=-1, elem_id=self.elem_id("seed"), min_width=100, precision=0)
 
-            random_seed = ToolButton(ui.random_symbol, elem_id=self.elem_id("random_seed"), tooltip="Set seed to -1, which will cause a new random number to be used every time")
-            reuse_seed = ToolButton(ui.reuse_symbol, elem_id=self.elem_id("reuse_seed"), tooltip="Reuse seed from last generation, mostly useful if it was randomized")
+            random_seed = ToolButton(random_symbol, elem_id=self.elem_id("random_seed"), tooltip="Set seed to -1, which will cause a new random number to be used every time")
+            reuse_seed = ToolButton(reuse_symbol, elem_id=self.elem_id("reuse_seed"), tooltip="Reuse seed from last generation, mostly useful if it was randomized")
 
             seed_checkbox = gr.Checkbox(label='Extra', elem_id=self.elem_id("subseed_show"), value=False)
 
         with gr.Group(visible=False, elem_id=self.elem_id("seed_extras")) as seed_extras:
             with gr.Row(elem_id=self.elem_id("subseed_row")):
                 subseed = gr.Number(label='Variation seed', value=-1, elem_id=self.elem_id("subseed"), precision=0)
-                random_subseed = ToolButton(ui.random_symbol, elem_id=self.elem_id("random_subseed"))
-                reuse_subseed = ToolButton(ui.reuse_symbol, elem_id=self.elem_id("reuse_subseed"))
+                random_subseed = ToolButton(random_symbol, elem_id=self.elem_id("random_subseed"))
+                reuse_subseed = ToolButton(reuse_symbol, elem_id=self.elem_id("reuse_subseed"))
                 subseed_strength = gr.Slider(label='Variation strength', value=0.0, minimum=0, maximum=1, step=0.01, elem_id=self.elem_id("subseed_strength"))
 
             with gr.Row(elem_id=self.elem_id("seed_resize_from_row")):
@@ -1,5 +1,6 @@
 import base64
 import io
+import threading
 import time
 
 import gradio as gr
@@ -8,34 +9,90 @@ from pydantic import BaseModel, Field
 from modules.shared import opts
 
 import modules.shared as shared
+from modules import metrics, tracing
 from collections import OrderedDict
 import string
 import random
 from typing import List
 
+lock = threading.RLock()  # held while changing or reading the structures below, which are used from many threads
 current_task = None
+coalesced_tasks = []  # other tasks that are generated in one batch with current_task; they share its progress
 pending_tasks = OrderedDict()
 finished_tasks = []
+task_outcomes = OrderedDict()  # how recent tasks ended: id -> {"status": "done", "failed" or "cancelled", "error": ...}
+task_outcomes_limit = 1024
 recorded_results = []
 recorded_results_limit = 2
 
 
-def start_task(id_task):
+def start_task(id_task, coalesced=()):
+    """marks the task as running; coalesced are ids of other tasks whose requests are generated together with it as one batch"""
+
     global current_task
 
-    current_task = id_task
-    pending_tasks.pop(id_task, None)
+    with lock:
+        current_task = id_task
+        coalesced_tasks[:] = coalesced
+
+        queued_at = {task_id: pending_tasks.pop(task_id, None) for task_id in (id_task, *coalesced)}
+
+    for task_id in (id_task, *coalesced):
+        if queued_at[task_id] is not None:
+            metrics.queue_wait.observe(time.time() - queued_at[task_id])
+
+    tracing.begin(id_task, queued_at[id_task], coalesced)
+
+
+def active_tasks():
+    """returns ids of tasks being worked on right now: the current task followed by tasks coalesced with it"""
+
+    with lock:
+        if current_task is None:
+            return []
+
+        return [current_task, *coalesced_tasks]
+
+
+def queue_order():
+    """returns ids of queued tasks in the order they were queued in"""
+
+    with lock:
+        return sorted(pending_tasks, key=lambda x: pending_tasks[x])
+
+
+def tasks_snapshot(task_ids):
+    """returns ids of active tasks, ids of queued tasks in order, and a dict of id -> outcome for those of task_ids that finished"""
 
+    with lock:
+        outcomes = {task_id: task_outcomes[task_id] for task_id in task_ids if task_id in task_outcomes}
+        return active_tasks(), queue_order(), outcomes
+
+
+def finish_task(id_task, status="done", error=None):
+    """marks the task as finished; status tells how it ended: done, failed or cancelled"""
 
-def finish_task(id_task):
     global current_task
 
-    if current_task == id_task:
-        current_task = None
+    with lock:
+        # tasks of a batch may finish one by one; the rest of them stay active
+        if current_task == id_task:
+            current_task = coalesced_tasks.pop(0) if coalesced_tasks else None
+        elif id_task in coalesced_tasks:
+            coalesced_tasks.remove(id_task)
+
+        if id_task not in finished_tasks:
+            finished_tasks.append(id_task)
+        if len(finished_tasks) > 16:
+            finished_tasks.pop(0)
+
+        if id_task is not None:
+            task_outcomes[id_task] = {"status": status, "error": error}
+            task_outcomes.move_to_end(id_task)
+            while len(task_outcomes) > task_outcomes_limit:
+                task_outcomes.popitem(last=False)
 
-    finished_tasks.append(id_task)
-    if len(finished_tasks) > 16:
-        finished_tasks.pop(0)
+    tracing.finish(id_task)
 
 def create_task_id(task_type):
     N = 7
@@ -48,9 +105,25 @@ def record_results(id_task, res):
     if len(recorded_results) > recorded_results_limit:
         recorded_results.pop(0)
 
+    # txt2img and img2img return gallery, generation info and two html fields; those are also kept on disk
+    if isinstance(res, (list, tuple)) and len(res) == 4 and isinstance(res[0], list):
+        from modules import task_results
+
+        task_results.store(id_task, *res)
+
 
 def add_task_to_queue(id_job):
-    pending_tasks[id_job] = time.time()
+    """adds the task to the queue; a task that is already queued keeps the time it was first queued at"""
+
+    with lock:
+        pending_tasks.setdefault(id_job, time.time())
+
+
+def remove_from_queue(id_job):
+    """removes the task from the queue without running it"""
+
+    with lock:
+        pending_tasks.pop(id_job, None)
 
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
@@ -74,29 +147,52 @@ class ProgressResponse(BaseModel):
 
 
 def setup_progress_api(app):
+    from modules import progress_stream
+
     app.add_api_route("/internal/pending-tasks", get_pending_tasks, methods=["GET"])
+    app.add_api_route("/internal/progress-stream", progress_stream.progress_stream_api, methods=["GET"])
     return app.add_api_route("/internal/progress", progressapi, methods=["POST"], response_model=ProgressResponse)
 
 
 def get_pending_tasks():
-    pending_tasks_ids = list(pending_tasks)
+    pending_tasks_ids = queue_order()
     pending_len = len(pending_tasks_ids)
     return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
 
 
 def progressapi(req: ProgressRequest):
-    active = req.id_task == current_task
-    queued = req.id_task in pending_tasks
-    completed = req.id_task in finished_tasks
+    with lock:
+        active = req.id_task in active_tasks()
+        sorted_queued = queue_order()
+        queued = req.id_task in sorted_queued
+        completed = req.id_task in finished_tasks or req.id_task in task_outcomes
 
     if not active:
         textinfo = "Waiting..."
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
             queue_index = sorted_queued.index(req.id_task)
             textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
         return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
 
+    progress, eta = current_progress()
+
+    live_preview = None
+    id_live_preview = req.id_live_preview
+
+    if opts.live_previews_enable and req.live_preview:
+        shared.state.set_current_image()
+        if shared.state.id_live_preview != req.id_live_preview:
+            image = shared.state.current_image
+            if image is not None:
+                live_preview = encode_live_preview(image)
+                id_live_preview = shared.state.id_live_preview
+
+    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
+
+
+def current_progress():
+    """returns progress of the current task from 0 to 1, and estimated time left in seconds or None"""
+
     progress = 0
 
     job_count, job_no = shared.state.job_count, shared.state.job_no
@@ -113,40 +209,42 @@ def progressapi(req: ProgressRequest):
     predicted_duration = elapsed_since_start / progress if progress > 0 else None
     eta = predicted_duration - elapsed_since_start if predicted_duration is not None else None
 
-    live_preview = None
-    id_live_preview = req.id_live_preview
+    return progress, eta
 
-    if opts.live_previews_enable and req.live_preview:
-        shared.state.set_current_image()
-        if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
 
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
+def encode_live_preview(image):
+    """returns live preview image as a data: uri"""
 
-                else:
-                    save_kwargs = {}
+    buffered = io.BytesIO()
 
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
-                id_live_preview = shared.state.id_live_preview
+    if opts.live_previews_image_format == "png":
+        # using optimize for large images takes an enormous amount of time
+        if max(*image.size) <= 256:
+            save_kwargs = {"optimize": True}
+        else:
+            save_kwargs = {"optimize": False, "compress_level": 1}
 
-    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
+    else:
+        save_kwargs = {}
+
+    image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
+    base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    return f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
 
 
 def restore_progress(id_task):
-    while id_task == current_task or id_task in pending_tasks:
+    while id_task in active_tasks() or id_task in pending_tasks:
         time.sleep(0.1)
 
     res = next(iter([x[1] for x in recorded_results if id_task == x[0]]), None)
     if res is not None:
         return res
 
+    from modules import task_results
+
+    stored = task_results.get(id_task)
+    if stored is not None:
+        images = [x for x in map(task_results.load_image, stored["images"]) if x is not None]
+        return images, stored["info"], stored["html_info"] or gr.update(), stored["html_comments"] or gr.update()
+
     return gr.update(), gr.update(), gr.update(), f"Couldn't restore progress for {id_task}: results either have been discarded or never were obtained"
@@ -0,0 +1,231 @@
+"""
+Progress of generation tasks pushed to clients as server-sent events.
+
+One background thread watches shared.state while anyone is subscribed, and makes a snapshot of it whenever something
+changes; the live preview is encoded once per change and the same snapshot is given to every subscriber. Each
+subscriber gets events about one task:
+
+- queued: {"position": ..., "size": ...} while the task waits in queue
+- progress: {"progress": ..., "eta": ..., "textinfo": ..., ...} while the task is running
+- preview: {"id_live_preview": ..., "live_preview": "data:image/..."} when there's a new live preview; the event id is id_live_preview
+- done: {} when the task is finished
+- error: {"error": ...} when the task failed
+- cancelled: {} when the task was cancelled
+- unknown: {} when the task has been neither queued, running nor finished for unknown_task_timeout seconds, e.g. because
+  its id is wrong, or it finished so long ago that it was forgotten
+
+The stream ends after done, error, cancelled or unknown.
+
+A client that reconnects with same id_task gets the current state right away; the preview is only sent again if it's not
+the one client already has, as told by Last-Event-ID header or id_live_preview parameter.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from modules import errors, progress, shared
+from modules.shared import opts
+
+poll_interval = 0.1
+keepalive_interval = 15
+unknown_task_timeout = 60
+
+final_events = {"done": "done", "failed": "error", "cancelled": "cancelled"}
+
+
+class Broadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.snapshot = None
+        self.preview_key = None
+        self.preview = None
+        self.preview_time = 0
+        self.thread = None
+
+    def subscribe(self, subscriber):
+        """subscriber is a tuple of (event loop, asyncio.Event, id_task); the event is set whenever there's a new snapshot"""
+
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="progress stream", daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def live_preview(self, task_id):
+        """returns (id_live_preview, data uri) for current task, encoding the image only when it changes"""
+
+        if not opts.live_previews_enable:
+            return None, None
+
+        now = time.time()
+        if now - self.preview_time >= opts.live_preview_refresh_period / 1000:
+            self.preview_time = now
+            shared.state.set_current_image()
+
+        key = (task_id, shared.state.id_live_preview)
+        if key != self.preview_key:
+            image = shared.state.current_image
+            self.preview = progress.encode_live_preview(image) if image is not None else None
+            self.preview_key = key
+
+        return self.preview_key[1], self.preview
+
+    def take_snapshot(self, task_ids):
+        """returns the state of generation; outcomes are only included for task_ids, the tasks that subscribers watch"""
+
+        active, pending, outcomes = progress.tasks_snapshot(task_ids)
+        task_id = active[0] if active else None
+
+        snapshot = {
+            "current_task": task_id,
+            "active": active,
+            "pending": pending,
+            "outcomes": outcomes,
+        }
+
+        if task_id is not None:
+            value, eta = progress.current_progress()
+            id_live_preview, live_preview = self.live_preview(task_id)
+
+            task_progress = {
+                "progress": round(value, 4),
+                "job_no": shared.state.job_no,
+                "job_count": shared.state.job_count,
+                "sampling_step": shared.state.sampling_step,
+                "sampling_steps": shared.state.sampling_steps,
+                "textinfo": shared.state.textinfo,
+            }
+
+            # ETA changes with time alone; it's only updated together with the rest of progress so that idle polls send nothing
+            previous = (self.snapshot or {}).get("progress")
+            if previous is not None and previous == {**task_progress, "eta": previous["eta"]} and self.snapshot["current_task"] == task_id:
+                task_progress["eta"] = previous["eta"]
+            else:
+                task_progress["eta"] = round(eta, 1) if eta is not None else None
+
+            snapshot.update({
+                "progress": task_progress,
+                "id_live_preview": id_live_preview,
+                "live_preview": live_preview,
+            })
+
+        return snapshot
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    self.snapshot = None
+                    return
+
+                subscribers = list(self.subscribers)
+
+            try:
+                snapshot = self.take_snapshot({id_task for _, _, id_task in subscribers})
+            except Exception:
+                errors.report("Error making progress snapshot", exc_info=True)
+                snapshot = self.snapshot
+
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                for loop, event, _ in subscribers:
+                    loop.call_soon_threadsafe(event.set)
+
+            time.sleep(poll_interval)
+
+
+broadcaster = Broadcaster()
+
+
+def task_events(snapshot, id_task, sent):
+    """returns list of (event name, data, event id) for id_task that were not yet sent; sent is a dict of what was sent before, and is updated"""
+
+    res = []
+
+    def add(name, data, event_id=None):
+        if sent.get(name) != data:
+            sent[name] = data
+            res.append((name, data, event_id))
+
+    if id_task in snapshot["active"]:
+        add("progress", snapshot["progress"])
+
+        if snapshot["live_preview"] is not None and sent.get("id_live_preview") != snapshot["id_live_preview"]:
+            sent["id_live_preview"] = snapshot["id_live_preview"]
+            res.append(("preview", {"id_live_preview": snapshot["id_live_preview"], "live_preview": snapshot["live_preview"]}, snapshot["id_live_preview"]))
+    elif id_task in snapshot["pending"]:
+        add("queued", {"position": snapshot["pending"].index(id_task) + 1, "size": len(snapshot["pending"])})
+    elif id_task in snapshot["outcomes"]:
+        outcome = snapshot["outcomes"][id_task]
+        name = final_events.get(outcome["status"], "done")
+        add(name, {"error": outcome["error"]} if name == "error" else {})
+    else:
+        add("waiting", {"textinfo": "Waiting..."})
+
+    return res
+
+
+def is_unknown(snapshot, id_task):
+    return id_task not in snapshot["active"] and id_task not in snapshot["pending"] and id_task not in snapshot["outcomes"]
+
+
+def format_event(name, data, event_id=None):
+    res = f"event: {name}\n"
+    if event_id is not None:
+        res += f"id: {event_id}\n"
+
+    return res + f"data: {json.dumps(data)}\n\n"
+
+
+async def stream_task(id_task, id_live_preview):
+    event = asyncio.Event()
+    subscriber = (asyncio.get_running_loop(), event, id_task)
+    sent = {"id_live_preview": id_live_preview}
+
+    waiting_since = time.time()
+
+    broadcaster.subscribe(subscriber)
+    try:
+        while True:
+            event.clear()
+
+            snapshot = broadcaster.snapshot
+            if snapshot is not None:
+                for name, data, event_id in task_events(snapshot, id_task, sent):
+                    yield format_event(name, data, event_id)
+
+                    if name in final_events.values():
+                        return
+
+                if not is_unknown(snapshot, id_task):
+                    waiting_since = time.time()
+                elif time.time() - waiting_since >= unknown_task_timeout:
+                    yield format_event("unknown", {})
+                    return
+
+            try:
+                await asyncio.wait_for(event.wait(), keepalive_interval)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def progress_stream_api(request: Request, id_task: str, id_live_preview: int = -1):
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id is not None and last_event_id.isdigit():
+        id_live_preview = int(last_event_id)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream_task(id_task, id_live_preview), media_type="text/event-stream", headers=headers)
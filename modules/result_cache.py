@@ -0,0 +1,272 @@
+"""
+Cache of generation results keyed on everything that determines the images.
+
+When enabled in settings, process_images makes a hash of all parameters of the processing object, all settings (including
+overrides), identities of loaded checkpoint and VAE, identities of extra networks mentioned in prompts, and script
+arguments. If the same generation was done before, its images and infotexts are returned without sampling. Results are
+kept on disk with a size limit; least recently used ones are evicted first.
+
+Processing is not cached when its results can't be reproduced from parameters: when it runs scripts that are not known to
+be deterministic, or any of parameters can't be hashed; and when images are going to be saved to disk, so that saving
+still happens.
+"""
+
+import dataclasses
+import hashlib
+import io
+import json
+import os
+import threading
+
+import diskcache
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+from modules import cache, errors, extra_networks, paths_internal, sd_vae, shared
+from modules.shared import opts
+
+format_version = 1
+
+excluded_fields = {"sd_model", "outpath_samples", "outpath_grids", "do_not_save_samples", "do_not_save_grid", "override_settings", "override_settings_restore_afterwards", "do_not_reload_embeddings", "force_task_id"}
+"""fields of processing objects that do not affect images; override settings are accounted for by hashing all settings after they are applied"""
+
+trusted_script_dirs = [os.path.join(paths_internal.script_path, "scripts"), paths_internal.extensions_builtin_dir, paths_internal.modules_path]
+
+lock = threading.Lock()
+disk = None
+hits = 0
+misses = 0
+
+
+class Uncacheable(Exception):
+    pass
+
+
+def update_hash(h, obj):
+    """feeds a canonical representation of obj into hashlib object h; raises Uncacheable for objects that can't be hashed reliably"""
+
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        h.update(json.dumps(obj).encode('utf8'))
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for x in obj:
+            update_hash(h, x)
+            h.update(b",")
+        h.update(b"]")
+    elif isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj, key=str):
+            update_hash(h, str(k))
+            h.update(b":")
+            update_hash(h, obj[k])
+            h.update(b",")
+        h.update(b"}")
+    elif isinstance(obj, Image.Image):
+        h.update(f"image:{obj.mode}:{obj.size}:".encode('utf8'))
+        h.update(obj.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"array:{obj.dtype}:{obj.shape}:".encode('utf8'))
+        h.update(np.ascontiguousarray(obj).tobytes())
+    else:
+        raise Uncacheable(f"can't hash {type(obj).__name__}")
+
+
+def file_identity(filename):
+    """returns a value that changes when the file changes, without reading it"""
+
+    if not filename:
+        return None
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return [filename, None]
+
+    return [filename, stat.st_mtime_ns, stat.st_size]
+
+
+def is_script_deterministic(script):
+    if script.deterministic is not None:
+        return script.deterministic
+
+    filename = os.path.realpath(script.filename or "")
+    return any(filename.startswith(os.path.realpath(path) + os.sep) for path in trusted_script_dirs)
+
+
+def extra_networks_identity(p):
+    if p.disable_extra_networks:
+        return None
+
+    prompts = p.prompt if isinstance(p.prompt, list) else [p.prompt]
+    prompts = [shared.prompt_styles.apply_styles_to_prompt(x, p.styles) for x in prompts]
+    prompts += [x for x in [getattr(p, 'hr_prompt', None)] if x]
+
+    _, extra_network_data = extra_networks.parse_prompts(prompts)
+
+    res = {}
+    for name, extra_network in extra_networks.extra_network_registry.items():
+        params_list = extra_network_data.get(name, [])
+        identity = extra_network.cache_identity(params_list)
+        if identity is None and params_list:
+            raise Uncacheable(f"extra network {name} can't be identified")
+
+        res[name] = identity
+
+    return res
+
+
+def model_identity():
+    checkpoint_info = shared.sd_model.sd_checkpoint_info
+    return {
+        "checkpoint": checkpoint_info.sha256 or file_identity(checkpoint_info.filename),
+        "vae": file_identity(sd_vae.loaded_vae_file),
+    }
+
+
+def make_key(p):
+    """returns hash of everything that affects images made by p, or None if they should not be cached"""
+
+    from modules import processing
+
+    if p.save_samples():
+        return None
+
+    if p.scripts is not None and not all(is_script_deterministic(script) for script in p.scripts.alwayson_scripts):
+        return None
+
+    # fixed seeds are chosen here rather than in process_images_inner so that they can be part of the key
+    if not isinstance(p.seed, list):
+        p.seed = processing.get_fixed_seed(p.seed)
+    if not isinstance(p.subseed, list):
+        p.subseed = processing.get_fixed_seed(p.subseed)
+
+    fields = {field.name: getattr(p, field.name) for field in dataclasses.fields(p) if field.init and field.name not in excluded_fields}
+
+    h = hashlib.sha256()
+    try:
+        update_hash(h, [
+            format_version,
+            type(p).__name__,
+            fields,
+            getattr(p, "init_images", None),
+            opts.data,
+            model_identity(),
+            extra_networks_identity(p),
+            p.script_args,
+        ])
+    except Uncacheable:
+        return None
+
+    return h.hexdigest()
+
+
+def open_disk():
+    global disk
+
+    size_limit = int(opts.result_cache_size_mb) * 1024 * 1024
+
+    with lock:
+        if disk is None:
+            disk = diskcache.Cache(os.path.join(cache.cache_dir, cache.results_dirname), size_limit=size_limit, eviction_policy="least-recently-used", disk_min_file_size=2**18)
+        elif disk.size_limit != size_limit:
+            disk.reset('size_limit', size_limit)
+
+    return disk
+
+
+def encode_image(image):
+    metadata = PngImagePlugin.PngInfo()
+    for key, value in image.info.items():
+        if isinstance(key, str) and isinstance(value, str):
+            metadata.add_text(key, value)
+
+    with io.BytesIO() as output:
+        image.save(output, format="PNG", pnginfo=metadata, compress_level=1)
+        return output.getvalue()
+
+
+def decode_image(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def lookup(p):
+    """returns (key, Processed) if results for p are cached; (key, None) if they are not; key is None if results for p should not be cached"""
+
+    global hits, misses
+
+    if not opts.result_cache:
+        return None, None
+
+    try:
+        key = make_key(p)
+        if key is None:
+            return None, None
+
+        value = open_disk().get(key)
+    except Exception as e:
+        errors.display(e, "reading result cache")
+        return None, None
+
+    if value is None:
+        misses += 1
+        return key, None
+
+    hits += 1
+    return key, restore(p, value)
+
+
+def restore(p, value):
+    from modules import processing
+
+    data = json.loads(value["js"])
+
+    p.sd_model_name = data["sd_model_name"]
+    p.sd_model_hash = data["sd_model_hash"]
+    p.sd_vae_name = data["sd_vae_name"]
+    p.sd_vae_hash = data["sd_vae_hash"]
+    p.all_prompts = data["all_prompts"]
+    p.all_negative_prompts = data["all_negative_prompts"]
+    p.all_seeds = data["all_seeds"]
+    p.all_subseeds = data["all_subseeds"]
+    p.extra_generation_params.update(data["extra_generation_params"] or {})
+
+    return processing.Processed(
+        p,
+        images_list=[decode_image(x) for x in value["images"]],
+        seed=data["seed"],
+        info=value["infotexts"][0] if value["infotexts"] else "",
+        subseed=data["subseed"],
+        all_prompts=data["all_prompts"],
+        all_negative_prompts=data["all_negative_prompts"],
+        all_seeds=data["all_seeds"],
+        all_subseeds=data["all_subseeds"],
+        index_of_first_image=data["index_of_first_image"],
+        infotexts=value["infotexts"],
+    )
+
+
+def store(key, processed):
+    if key is None or shared.state.interrupted or shared.state.skipped or not processed.images:
+        return
+
+    try:
+        value = {
+            "images": [encode_image(image) for image in processed.images],
+            "infotexts": processed.infotexts,
+            "js": processed.js(),
+        }
+
+        open_disk().set(key, value)
+    except Exception as e:
+        errors.display(e, "writing result cache")
+
+
+def stats():
+    res = {"hits": hits, "misses": misses}
+
+    if disk is not None:
+        res.update({"items": len(disk), "bytes": disk.volume()})
+
+    return res
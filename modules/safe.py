@@ -2,10 +2,12 @@
 
 import pickle
 import collections
+import types
 
 import torch
 import numpy
 import _codecs
+import os
 import zipfile
 import re
 
@@ -20,6 +22,43 @@ def encode(*args):
     return out
 
 
+class UnsafePickleError(Exception):
+    pass
+
+
+def find_allowed_class(module, name, extra_handler=None):
+    if extra_handler is not None:
+        res = extra_handler(module, name)
+        if res is not None:
+            return res
+
+    if module == 'collections' and name == 'OrderedDict':
+        return getattr(collections, name)
+    if module == 'torch._utils' and name in ['_rebuild_tensor_v2', '_rebuild_parameter', '_rebuild_device_tensor_from_numpy']:
+        return getattr(torch._utils, name)
+    if module == 'torch' and name in ['FloatStorage', 'HalfStorage', 'IntStorage', 'LongStorage', 'DoubleStorage', 'ByteStorage', 'float32', 'BFloat16Storage']:
+        return getattr(torch, name)
+    if module == 'torch.nn.modules.container' and name in ['ParameterDict']:
+        return getattr(torch.nn.modules.container, name)
+    if module == 'numpy.core.multiarray' and name in ['scalar', '_reconstruct']:
+        return getattr(numpy.core.multiarray, name)
+    if module == 'numpy' and name in ['dtype', 'ndarray']:
+        return getattr(numpy, name)
+    if module == '_codecs' and name == 'encode':
+        return encode
+    if module == "pytorch_lightning.callbacks" and name == 'model_checkpoint':
+        import pytorch_lightning.callbacks
+        return pytorch_lightning.callbacks.model_checkpoint
+    if module == "pytorch_lightning.callbacks.model_checkpoint" and name == 'ModelCheckpoint':
+        import pytorch_lightning.callbacks.model_checkpoint
+        return pytorch_lightning.callbacks.model_checkpoint.ModelCheckpoint
+    if module == "__builtin__" and name == 'set':
+        return set
+
+    # Forbid everything else.
+    raise UnsafePickleError(f"global '{module}/{name}' is forbidden")
+
+
 class RestrictedUnpickler(pickle.Unpickler):
     extra_handler = None
 
@@ -32,36 +71,25 @@ class RestrictedUnpickler(pickle.Unpickler):
             return TypedStorage()  # PyTorch before 2.0 does not have the _internal argument
 
     def find_class(self, module, name):
-        if self.extra_handler is not None:
-            res = self.extra_handler(module, name)
-            if res is not None:
-                return res
+        return find_allowed_class(module, name, self.extra_handler)
 
-        if module == 'collections' and name == 'OrderedDict':
-            return getattr(collections, name)
-        if module == 'torch._utils' and name in ['_rebuild_tensor_v2', '_rebuild_parameter', '_rebuild_device_tensor_from_numpy']:
-            return getattr(torch._utils, name)
-        if module == 'torch' and name in ['FloatStorage', 'HalfStorage', 'IntStorage', 'LongStorage', 'DoubleStorage', 'ByteStorage', 'float32', 'BFloat16Storage']:
-            return getattr(torch, name)
-        if module == 'torch.nn.modules.container' and name in ['ParameterDict']:
-            return getattr(torch.nn.modules.container, name)
-        if module == 'numpy.core.multiarray' and name in ['scalar', '_reconstruct']:
-            return getattr(numpy.core.multiarray, name)
-        if module == 'numpy' and name in ['dtype', 'ndarray']:
-            return getattr(numpy, name)
-        if module == '_codecs' and name == 'encode':
-            return encode
-        if module == "pytorch_lightning.callbacks" and name == 'model_checkpoint':
-            import pytorch_lightning.callbacks
-            return pytorch_lightning.callbacks.model_checkpoint
-        if module == "pytorch_lightning.callbacks.model_checkpoint" and name == 'ModelCheckpoint':
-            import pytorch_lightning.callbacks.model_checkpoint
-            return pytorch_lightning.callbacks.model_checkpoint.ModelCheckpoint
-        if module == "__builtin__" and name == 'set':
-            return set
-
-        # Forbid everything else.
-        raise Exception(f"global '{module}/{name}' is forbidden")
+
+def restricted_pickle_module(extra_handler=None):
+    """
+    Returns a module to be used as pickle_module argument for torch.load that only allows the same globals as RestrictedUnpickler.
+    With it, torch.load checks the file and creates tensors in a single unpickling pass. torch replaces persistent_load
+    of the unpickler with its own, so storages are read as usual.
+    """
+
+    class Unpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            return find_allowed_class(module, name, extra_handler)
+
+    module = types.ModuleType("restricted_pickle")
+    module.Unpickler = Unpickler
+    module.load = lambda file, **kwargs: Unpickler(file, **kwargs).load()
+
+    return module
 
 
 # Regular expression that accepts 'dirname/version', 'dirname/byteorder', 'dirname/data.pkl', '.data/serialization_id', and 'dirname/data/<number>'
@@ -73,7 +101,32 @@ def check_zip_filenames(filename, names):
         if allowed_zip_names_re.match(name):
             continue
 
-        raise Exception(f"bad file inside {filename}: {name}")
+        raise UnsafePickleError(f"bad file inside {filename}: {name}")
+
+
+def find_data_pkl(filename, names):
+    """returns filename of data.pkl in zip file: '<directory name>/data.pkl'"""
+
+    data_pkl_filenames = [f for f in names if data_pkl_re.match(f)]
+    if len(data_pkl_filenames) == 0:
+        raise UnsafePickleError(f"data.pkl not found in {filename}")
+    if len(data_pkl_filenames) > 1:
+        raise UnsafePickleError(f"Multiple data.pkl found in {filename}")
+
+    return data_pkl_filenames[0]
+
+
+def check_zip(filename):
+    """checks names of files inside a zip file saved by torch; returns False if it's not a zip file"""
+
+    try:
+        with zipfile.ZipFile(filename) as z:
+            check_zip_filenames(filename, z.namelist())
+            find_data_pkl(filename, z.namelist())
+    except zipfile.BadZipfile:
+        return False
+
+    return True
 
 
 def check_pt(filename, extra_handler):
@@ -83,13 +136,7 @@ def check_pt(filename, extra_handler):
         with zipfile.ZipFile(filename) as z:
             check_zip_filenames(filename, z.namelist())
 
-            # find filename of data.pkl in zip file: '<directory name>/data.pkl'
-            data_pkl_filenames = [f for f in z.namelist() if data_pkl_re.match(f)]
-            if len(data_pkl_filenames) == 0:
-                raise Exception(f"data.pkl not found in {filename}")
-            if len(data_pkl_filenames) > 1:
-                raise Exception(f"Multiple data.pkl found in {filename}")
-            with z.open(data_pkl_filenames[0]) as file:
+            with z.open(find_data_pkl(filename, z.namelist())) as file:
                 unpickler = RestrictedUnpickler(file)
                 unpickler.extra_handler = extra_handler
                 unpickler.load()
@@ -130,10 +177,26 @@ def load_with_extra(filename, extra_handler=None, *args, **kwargs):
     definitely unsafe.
     """
 
-    from modules import shared
+    from modules import shared, safe_cache
+
+    res = safe_cache.load(filename, *args, **kwargs)
+    if res is not None:
+        return res
 
+    # a custom pickle module given by the caller can't be combined with the restricted one, so the file is checked separately
+    single_pass = len(args) < 2 and 'pickle_module' not in kwargs
+
+    loaded = False
     try:
-        if not shared.cmd_opts.disable_safe_unpickle:
+        if shared.cmd_opts.disable_safe_unpickle:
+            pass
+        elif single_pass:
+            if isinstance(filename, (str, os.PathLike)):
+                check_zip(filename)
+
+            res = unsafe_torch_load(filename, *args, pickle_module=restricted_pickle_module(extra_handler), **kwargs)
+            loaded = True
+        else:
             check_pt(filename, extra_handler)
 
     except pickle.UnpicklingError:
@@ -144,7 +207,7 @@ def load_with_extra(filename, extra_handler=None, *args, **kwargs):
             exc_info=True,
         )
         return None
-    except Exception:
+    except UnsafePickleError:
         errors.report(
             f"Error verifying pickled file from {filename}\n"
             f"The file may be malicious, so the program is not going to read it.\n"
@@ -153,7 +216,12 @@ def load_with_extra(filename, extra_handler=None, *args, **kwargs):
         )
         return None
 
-    return unsafe_torch_load(filename, *args, **kwargs)
+    if not loaded:
+        res = unsafe_torch_load(filename, *args, **kwargs)
+
+    safe_cache.save(filename, res, *args, **kwargs)
+
+    return res
 
 
 class Extra:
@@ -0,0 +1,151 @@
+import collections
+import hashlib
+import json
+import os
+
+import safetensors
+import torch
+
+from modules import shared, cache, errors
+
+format_version = 1
+
+
+class UnsupportedObject(Exception):
+    pass
+
+
+def cache_path():
+    return os.path.join(cache.cache_dir, "safetensors-twins")
+
+
+def is_enabled():
+    return getattr(shared.opts, "pickle_safetensors_cache", False)
+
+
+def twin_filename(filename):
+    """returns filename of the safetensors twin for a pickled file; the name depends on file's contents, size and modification time"""
+
+    st = os.stat(filename)
+
+    h = hashlib.sha256()
+    with open(filename, "rb") as file:
+        h.update(file.read(0x10000))
+        file.seek(0x100000)
+        h.update(file.read(0x10000))
+
+    h.update(f"{st.st_size}-{st.st_mtime_ns}-{format_version}".encode("utf8"))
+
+    return os.path.join(cache_path(), h.hexdigest()[0:24] + ".safetensors")
+
+
+def map_location_for(filename, args, kwargs):
+    """returns (True, map_location) if torch.load call with these arguments can be served from a twin, or (False, None)"""
+
+    if not is_enabled() or not isinstance(filename, (str, os.PathLike)) or len(args) > 1 or any(x != "map_location" for x in kwargs):
+        return False, None
+
+    map_location = args[0] if args else kwargs.get("map_location")
+    if map_location is not None and not isinstance(map_location, (str, torch.device)):
+        return False, None
+
+    return True, map_location
+
+
+def encode(obj, tensors):
+    """converts an object returned by torch.load into a JSON-compatible structure, moving all tensors into the tensors dict"""
+
+    if isinstance(obj, torch.Tensor):
+        name = str(len(tensors))
+        tensors[name] = obj
+        return {"t": name, "device": str(obj.device), "param": isinstance(obj, torch.nn.Parameter), "requires_grad": obj.requires_grad}
+
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return {"v": obj}
+
+    if type(obj) in (dict, collections.OrderedDict):
+        return {"d": [[encode(k, tensors), encode(v, tensors)] for k, v in obj.items()], "ordered": isinstance(obj, collections.OrderedDict)}
+
+    if type(obj) is list:
+        return {"l": [encode(x, tensors) for x in obj]}
+
+    if type(obj) is tuple:
+        return {"u": [encode(x, tensors) for x in obj]}
+
+    raise UnsupportedObject(type(obj).__name__)
+
+
+def decode(structure, file, map_location):
+    if "t" in structure:
+        tensor = file.get_tensor(structure["t"])
+        device = map_location if map_location is not None else structure["device"]
+        if str(device) != "cpu":
+            tensor = tensor.to(device)
+
+        if structure["param"]:
+            return torch.nn.Parameter(tensor, requires_grad=structure["requires_grad"])
+
+        return tensor
+
+    if "v" in structure:
+        return structure["v"]
+
+    if "d" in structure:
+        items = [(decode(k, file, map_location), decode(v, file, map_location)) for k, v in structure["d"]]
+        return collections.OrderedDict(items) if structure["ordered"] else dict(items)
+
+    if "l" in structure:
+        return [decode(x, file, map_location) for x in structure["l"]]
+
+    return tuple(decode(x, file, map_location) for x in structure["u"])
+
+
+def load(filename, *args, **kwargs):
+    """returns the object saved in filename read from its safetensors twin, or None if there is no twin or it can't be used"""
+
+    usable, map_location = map_location_for(filename, args, kwargs)
+    if not usable:
+        return None
+
+    try:
+        twin = twin_filename(filename)
+        if not os.path.isfile(twin):
+            return None
+
+        with safetensors.safe_open(twin, framework="pt", device="cpu") as file:
+            structure = json.loads(file.metadata()["structure"])
+            return decode(structure, file, map_location)
+    except Exception as e:
+        errors.display(e, f"reading safetensors copy of {filename}")
+        return None
+
+
+def save(filename, obj, *args, **kwargs):
+    """writes the object loaded from filename into a safetensors twin, if the object only consists of tensors, dicts, lists and simple values"""
+
+    usable, _ = map_location_for(filename, args, kwargs)
+    if not usable or obj is None or os.path.splitext(str(filename))[1].lower() == ".safetensors":
+        return
+
+    try:
+        twin = twin_filename(filename)
+        if os.path.isfile(twin):
+            return
+
+        tensors = {}
+        structure = encode(obj, tensors)
+    except UnsupportedObject:
+        return
+
+    from modules import sd_models_converted
+
+    try:
+        os.makedirs(cache_path(), exist_ok=True)
+        metadata = {"source": os.path.abspath(filename), "structure": json.dumps(structure)}
+        sd_models_converted.write_safetensors(twin + ".tmp", tensors, metadata)
+        os.replace(twin + ".tmp", twin)
+    except Exception as e:
+        errors.display(e, f"saving safetensors copy of {filename}")
+
+        if os.path.exists(twin + ".tmp"):
+            os.remove(twin + ".tmp")
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+from modules import cache, errors
+
+subsection = "safetensors-headers"
+
+
+def stat_key(filename):
+    """returns a tuple that changes whenever the file is replaced or modified; used to validate index entries"""
+
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def parse_metadata(raw_metadata, filename):
+    res = {}
+
+    try:
+        for k, v in raw_metadata.items():
+            res[k] = v
+            if isinstance(v, str) and v[0:1] == '{':
+                try:
+                    res[k] = json.loads(v)
+                except Exception:
+                    pass
+    except Exception:
+        errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
+
+    return res
+
+
+def read_header(filename):
+    """
+    Reads the header of a safetensors file.
+
+    Returns a dict with:
+     - metadata: contents of __metadata__, with values that are JSON objects decoded
+     - tensors: tensor name -> [dtype, shape, [begin, end]], offsets relative to data_offset
+     - data_offset: position in file where tensor data starts
+     - model_hash: the old 8-character hash that looks at a small part of the file
+    """
+
+    with open(filename, mode="rb") as file:
+        metadata_len = file.read(8)
+        metadata_len = int.from_bytes(metadata_len, "little")
+        json_start = file.read(2)
+
+        assert metadata_len > 2 and json_start in (b'{"', b"{'"), f"{filename} is not a safetensors file"
+
+        json_data = json_start + file.read(metadata_len - 2)
+
+        file.seek(0x100000)
+        model_hash = hashlib.sha256(file.read(0x10000)).hexdigest()[0:8]
+
+    try:
+        json_obj = json.loads(json_data)
+    except Exception:
+        errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
+        json_obj = {}
+
+    tensors = {}
+    for name, info in json_obj.items():
+        if name == "__metadata__" or not isinstance(info, dict):
+            continue
+
+        tensors[name] = [info.get("dtype"), info.get("shape"), info.get("data_offsets")]
+
+    return {
+        "metadata": parse_metadata(json_obj.get("__metadata__", {}), filename),
+        "tensors": tensors,
+        "data_offset": metadata_len + 8,
+        "model_hash": model_hash,
+    }
+
+
+def get(filename):
+    """
+    Returns header of a safetensors file (see read_header) from the persistent index, reading the file only if
+    it is not in the index yet or if its size, modification time or inode changed since it was indexed.
+    """
+
+    key = os.path.abspath(filename)
+    current_stat = stat_key(filename)
+
+    index = cache.cache(subsection)
+    entry = index.get(key)
+    if entry and entry.get("stat") == current_stat:
+        return entry["value"]
+
+    value = read_header(filename)
+    index[key] = {"stat": current_stat, "value": value}
+
+    return value
+
+
+def metadata(filename):
+    """returns a copy of __metadata__ of a safetensors file from the index"""
+
+    return dict(get(filename)["metadata"])
+
+
+def tensor_shapes(filename):
+    """returns a dict of tensor name -> shape for a safetensors file from the index"""
+
+    return {name: shape for name, (_, shape, _) in get(filename)["tensors"].items()}
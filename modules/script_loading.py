@@ -1,16 +1,47 @@
+import concurrent.futures
 import os
+import importlib.machinery
 import importlib.util
 
 from modules import errors
+from modules.timer import startup_timer
 
 
 loaded_scripts = {}
 
 
-def load_module(path):
+def read_module_code(path):
+    """returns code object for a script file, from its __pycache__ if it is up to date; safe to call from multiple threads"""
+
+    loader = importlib.machinery.SourceFileLoader(os.path.basename(path), path)
+    return loader.get_code(loader.name)
+
+
+def read_modules_code(paths):
+    """starts reading and compiling scripts in background threads; returns a dict of path -> future with the code object"""
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="script_loading")
+    futures = {path: executor.submit(read_module_code, path) for path in paths}
+    executor.shutdown(wait=False)
+
+    return futures
+
+
+def load_module(path, code_future=None):
     module_spec = importlib.util.spec_from_file_location(os.path.basename(path), path)
     module = importlib.util.module_from_spec(module_spec)
-    module_spec.loader.exec_module(module)
+
+    code = None
+    if code_future is not None:
+        try:
+            code = code_future.result()
+        except Exception:
+            code = None  # let the loader report the error
+
+    if code is None:
+        module_spec.loader.exec_module(module)
+    else:
+        exec(code, module.__dict__)
 
     loaded_scripts[path] = module
     return module
@@ -21,15 +52,20 @@ def preload_extensions(extensions_dir, parser, extension_list=None):
         return
 
     extensions = extension_list if extension_list is not None else os.listdir(extensions_dir)
-    for dirname in sorted(extensions):
-        preload_script = os.path.join(extensions_dir, dirname, "preload.py")
-        if not os.path.isfile(preload_script):
-            continue
+    preload_scripts = [(dirname, os.path.join(extensions_dir, dirname, "preload.py")) for dirname in sorted(extensions)]
+    preload_scripts = [(dirname, preload_script) for dirname, preload_script in preload_scripts if os.path.isfile(preload_script)]
 
-        try:
-            module = load_module(preload_script)
-            if hasattr(module, 'preload'):
-                module.preload(parser)
+    code_futures = read_modules_code([preload_script for _, preload_script in preload_scripts])
 
-        except Exception:
-            errors.report(f"Error running preload() for {preload_script}", exc_info=True)
+    with startup_timer.subcategory("preload extensions"):
+        for dirname, preload_script in preload_scripts:
+            try:
+                module = load_module(preload_script, code_futures[preload_script])
+                if hasattr(module, 'preload'):
+                    module.preload(parser)
+
+            except Exception:
+                errors.report(f"Error running preload() for {preload_script}", exc_info=True)
+
+            finally:
+                startup_timer.record(dirname)
@@ -1,3 +1,6 @@
+import contextlib
+import hashlib
+import json
 import os
 import re
 import sys
@@ -7,7 +10,7 @@ from dataclasses import dataclass
 
 import gradio as gr
 
-from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util
+from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util, cache, tracing
 
 topological_sort = util.topological_sort
 
@@ -93,6 +96,11 @@ class Script:
     setup_for_ui_only = False
     """If true, the script setup will only be run in Gradio UI, not in API"""
 
+    deterministic = None
+    """Whether images made with this script depend only on script's arguments and processing parameters. Used by result cache:
+    None means unknown; built-in scripts are trusted, but results of processing with an alwayson script from an extension
+    that does not set this to True are never cached."""
+
     controls = None
     """A list of controls returned by the ui()."""
 
@@ -390,8 +398,62 @@ class ScriptWithDependencies:
     load_after: list
 
 
+def scripts_manifest_key(scriptdirname, extension, include_extensions):
+    """
+    Returns a hash of everything that the result of list_scripts depends on: the list of active extensions, modification
+    times of script directories (which change when files are added, removed or renamed), and contents of metadata.ini files.
+    """
+
+    dirs = [os.path.join(paths.script_path, scriptdirname)]
+    extensions_info = []
+
+    if include_extensions:
+        for ext in extensions.active():
+            dirs.append(os.path.join(ext.path, scriptdirname))
+
+            try:
+                with open(os.path.join(ext.path, extensions.ExtensionMetadata.filename), "rb") as file:
+                    metadata_hash = hashlib.sha256(file.read()).hexdigest()
+            except OSError:
+                metadata_hash = None
+
+            extensions_info.append([ext.canonical_name, ext.path, ext.is_builtin, metadata_hash])
+
+    mtimes = [os.stat(dirpath).st_mtime_ns if os.path.isdir(dirpath) else None for dirpath in dirs]
+
+    data = json.dumps([scriptdirname, extension, extensions_info, dirs, mtimes])
+    return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+
 def list_scripts(scriptdirname, extension, *, include_extensions=True):
+    """
+    Returns a list of ScriptFile for scripts in scriptdirname of webui and extensions, ordered according to dependencies between them.
+    The result is stored in a manifest in cache and reused as long as script directories and extensions' metadata do not change.
+    """
+
+    manifest = cache.cache("scripts-manifest")
+    manifest_name = f"{scriptdirname}/*{extension}" + ("" if include_extensions else " (no extensions)")
+    key = scripts_manifest_key(scriptdirname, extension, include_extensions)
+
+    entry = manifest.get(manifest_name)
+    if entry and entry.get("key") == key:
+        scripts_list = [ScriptFile(*x) for x in entry["scripts"]]
+        warnings = entry["warnings"]
+    else:
+        scripts_list, warnings = discover_scripts(scriptdirname, extension, include_extensions=include_extensions)
+        manifest[manifest_name] = {"key": key, "scripts": [list(x) for x in scripts_list], "warnings": warnings}
+
+    for warning in warnings:
+        errors.report(warning, exc_info=False)
+
+    return scripts_list
+
+
+def discover_scripts(scriptdirname, extension, *, include_extensions=True):
+    """lists and orders scripts for list_scripts without using the manifest; returns a list of ScriptFile and a list of warnings about missing requirements"""
+
     scripts = {}
+    warnings = []
 
     loaded_extensions = {ext.canonical_name: ext for ext in extensions.active()}
     loaded_extensions_scripts = {ext.canonical_name: [] for ext in extensions.active()}
@@ -458,14 +520,14 @@ def list_scripts(scriptdirname, extension, *, include_extensions=True):
     for script_canonical_name, script in scripts.items():
         for required_script in script.requires:
             if required_script not in scripts and required_script not in loaded_extensions:
-                errors.report(f'Script "{script_canonical_name}" requires "{required_script}" to be loaded, but it is not.', exc_info=False)
+                warnings.append(f'Script "{script_canonical_name}" requires "{required_script}" to be loaded, but it is not.')
 
         dependencies[script_canonical_name] = script.load_after
 
     ordered_scripts = topological_sort(dependencies)
     scripts_list = [scripts[script_canonical_name].file for script_canonical_name in ordered_scripts]
 
-    return scripts_list
+    return scripts_list, warnings
 
 
 def list_files_with_name(filename):
@@ -491,6 +553,11 @@ def load_scripts():
     script_callbacks.clear_callbacks()
 
     scripts_list = list_scripts("scripts", ".py") + list_scripts("modules/processing_scripts", ".py", include_extensions=False)
+    timer.startup_timer.record("list scripts")
+
+    # scripts are executed one by one in dependency order because they register callbacks when executed, and the order of
+    # callbacks matters; reading and compiling them does not depend on anything, so it is done in background threads
+    code_futures = script_loading.read_modules_code([scriptfile.path for scriptfile in scripts_list])
 
     syspath = sys.path
 
@@ -512,7 +579,7 @@ def load_scripts():
                 sys.path = [scriptfile.basedir] + sys.path
             current_basedir = scriptfile.basedir
 
-            script_module = script_loading.load_module(scriptfile.path)
+            script_module = script_loading.load_module(scriptfile.path, code_futures[scriptfile.path])
             register_scripts_from_module(script_module)
 
         except Exception:
@@ -521,7 +588,10 @@ def load_scripts():
         finally:
             sys.path = syspath
             current_basedir = paths.script_path
-            timer.startup_timer.record(scriptfile.filename)
+
+            # time for scripts of an extension is added up under the extension's name
+            is_extension_script = scriptfile.basedir != paths.script_path
+            timer.startup_timer.record(os.path.basename(scriptfile.basedir) if is_extension_script else scriptfile.filename)
 
     global scripts_txt2img, scripts_img2img, scripts_postproc
 
@@ -530,6 +600,15 @@ def load_scripts():
     scripts_postproc = scripts_postprocessing.ScriptPostprocessingRunner()
 
 
+def trace_callback(method, script):
+    """records a callback of the script as a span of the current trace; the name is only made when a trace is active"""
+
+    if not tracing.is_active():
+        return contextlib.nullcontext()
+
+    return tracing.span(f"{method}: {os.path.basename(script.filename)}")
+
+
 def wrap_call(func, filename, funcname, *args, default=None, **kwargs):
     try:
         return func(*args, **kwargs)
@@ -705,11 +784,14 @@ class ScriptRunner:
     def prepare_ui(self):
         self.inputs = [None]
 
-    def setup_ui(self):
+    def update_titles(self):
         all_titles = [wrap_call(script.title, script.filename, "title") or script.filename for script in self.scripts]
         self.title_map = {title.lower(): script for title, script in zip(all_titles, self.scripts)}
         self.titles = [wrap_call(script.title, script.filename, "title") or f"{script.filename} [error]" for script in self.selectable_scripts]
 
+    def setup_ui(self):
+        self.update_titles()
+
         self.setup_ui_for_section(None)
 
         dropdown = gr.Dropdown(label="Script", elem_id="script_list", choices=["None"] + self.titles, value="None", type="index")
@@ -765,6 +847,28 @@ class ScriptRunner:
 
         return self.inputs
 
+    def setup_controls_without_ui(self, sections):
+        """
+        creates controls of scripts in the same order as prepare_ui, setup_ui_for_section for every section and setup_ui do,
+        but without groups, the script dropdown and its event listeners; controls are only used for script arguments and their
+        default values
+        """
+
+        self.prepare_ui()
+        self.update_titles()
+
+        for section in [*sections, None]:
+            for script in self.alwayson_scripts:
+                if script.section == section:
+                    self.create_script_ui(script)
+
+        for script in self.selectable_scripts:
+            self.create_script_ui(script)
+
+        self.apply_on_before_component_callbacks()
+
+        return self.inputs
+
     def run(self, p, *args):
         script_index = args[0]
 
@@ -821,7 +925,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_process'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_process(p, *script_args)
+                with trace_callback("before_process", script):
+                    script.before_process(p, *script_args)
             except Exception:
                 errors.report(f"Error running before_process: {script.filename}", exc_info=True)
 
@@ -829,7 +934,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process(p, *script_args)
+                with trace_callback("process", script):
+                    script.process(p, *script_args)
             except Exception:
                 errors.report(f"Error running process: {script.filename}", exc_info=True)
 
@@ -837,7 +943,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process_before_every_sampling'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process_before_every_sampling(p, *script_args, **kwargs)
+                with trace_callback("process_before_every_sampling", script):
+                    script.process_before_every_sampling(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running process_before_every_sampling: {script.filename}", exc_info=True)
 
@@ -845,7 +952,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_process_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_process_batch(p, *script_args, **kwargs)
+                with trace_callback("before_process_batch", script):
+                    script.before_process_batch(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running before_process_batch: {script.filename}", exc_info=True)
 
@@ -853,7 +961,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('after_extra_networks_activate'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.after_extra_networks_activate(p, *script_args, **kwargs)
+                with trace_callback("after_extra_networks_activate", script):
+                    script.after_extra_networks_activate(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running after_extra_networks_activate: {script.filename}", exc_info=True)
 
@@ -861,7 +970,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process_batch(p, *script_args, **kwargs)
+                with trace_callback("process_batch", script):
+                    script.process_batch(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running process_batch: {script.filename}", exc_info=True)
 
@@ -869,7 +979,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess(p, processed, *script_args)
+                with trace_callback("postprocess", script):
+                    script.postprocess(p, processed, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess: {script.filename}", exc_info=True)
 
@@ -877,7 +988,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_batch(p, *script_args, images=images, **kwargs)
+                with trace_callback("postprocess_batch", script):
+                    script.postprocess_batch(p, *script_args, images=images, **kwargs)
             except Exception:
                 errors.report(f"Error running postprocess_batch: {script.filename}", exc_info=True)
 
@@ -885,7 +997,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_batch_list'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_batch_list(p, pp, *script_args, **kwargs)
+                with trace_callback("postprocess_batch_list", script):
+                    script.postprocess_batch_list(p, pp, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running postprocess_batch_list: {script.filename}", exc_info=True)
 
@@ -893,7 +1006,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('post_sample'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.post_sample(p, ps, *script_args)
+                with trace_callback("post_sample", script):
+                    script.post_sample(p, ps, *script_args)
             except Exception:
                 errors.report(f"Error running post_sample: {script.filename}", exc_info=True)
 
@@ -901,7 +1015,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('on_mask_blend'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.on_mask_blend(p, mba, *script_args)
+                with trace_callback("on_mask_blend", script):
+                    script.on_mask_blend(p, mba, *script_args)
             except Exception:
                 errors.report(f"Error running post_sample: {script.filename}", exc_info=True)
 
@@ -909,7 +1024,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_image'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_image(p, pp, *script_args)
+                with trace_callback("postprocess_image", script):
+                    script.postprocess_image(p, pp, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image: {script.filename}", exc_info=True)
 
@@ -917,7 +1033,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_maskoverlay'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_maskoverlay(p, ppmo, *script_args)
+                with trace_callback("postprocess_maskoverlay", script):
+                    script.postprocess_maskoverlay(p, ppmo, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image: {script.filename}", exc_info=True)
 
@@ -925,7 +1042,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_image_after_composite'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_image_after_composite(p, pp, *script_args)
+                with trace_callback("postprocess_image_after_composite", script):
+                    script.postprocess_image_after_composite(p, pp, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image_after_composite: {script.filename}", exc_info=True)
 
@@ -980,7 +1098,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_hr'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_hr(p, *script_args)
+                with trace_callback("before_hr", script):
+                    script.before_hr(p, *script_args)
             except Exception:
                 errors.report(f"Error running before_hr: {script.filename}", exc_info=True)
 
@@ -991,7 +1110,8 @@ class ScriptRunner:
 
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.setup(p, *script_args)
+                with trace_callback("setup", script):
+                    script.setup(p, *script_args)
             except Exception:
                 errors.report(f"Error running setup: {script.filename}", exc_info=True)
 
@@ -1031,6 +1151,30 @@ scripts_postproc: scripts_postprocessing.ScriptPostprocessingRunner = None
 scripts_current: ScriptRunner = None
 
 
+def setup_scripts_without_ui():
+    """
+    Initializes txt2img and img2img scripts and creates their controls without building the rest of the UI; used when running
+    with --nowebui, where API only needs to know which arguments belong to which script and their default values.
+
+    Controls are still gradio components made by scripts' ui(): that is the only place scripts define their arguments. Scripts
+    add event listeners to them, which gradio only allows inside of Blocks, and pass webui's own arguments such as tooltip,
+    which need gradio_extensons.
+    """
+
+    global scripts_current
+
+    from modules import gradio_extensons, shared_items  # noqa: F401
+
+    for runner, is_img2img in [(scripts_txt2img, False), (scripts_img2img, True)]:
+        scripts_current = runner
+        runner.initialize_scripts(is_img2img)
+
+        with gr.Blocks():
+            runner.setup_controls_without_ui(list(shared_items.ui_reorder_categories()))
+
+    scripts_current = None
+
+
 def reload_script_body_only():
     cache = {}
     scripts_txt2img.reload_sources(cache)
@@ -1,3 +1,5 @@
+import time
+
 import ldm.modules.encoders.modules
 import open_clip
 import torch
@@ -118,6 +120,11 @@ class InitializeOnMeta(ReplaceHelper):
     which results in those parameters having no values and taking no memory. model.to() will be broken and
     will need to be repaired by using LoadStateDictOnMeta below when loading params from state dict.
 
+    With all_parameters=True, every other parameter of the model is put on meta device too: norm, embedding and other
+    conv layers are created there, and parameters of other modules are moved there as they are registered. This must
+    only be used if all weights of the model come from the state dict, because weights that modules load by themselves
+    while being created (like CLIP downloaded from huggingface) are lost.
+
     Usage:
     ```
     with sd_disable_initialization.InitializeOnMeta():
@@ -125,6 +132,10 @@ class InitializeOnMeta(ReplaceHelper):
     ```
     """
 
+    def __init__(self, all_parameters=False):
+        super().__init__()
+        self.all_parameters = all_parameters
+
     def __enter__(self):
         if shared.cmd_opts.disable_model_loading_ram_optimization:
             return
@@ -133,21 +144,72 @@ class InitializeOnMeta(ReplaceHelper):
             x["device"] = "meta"
             return x
 
+        def create_on_meta(cls):
+            init = self.replace(cls, '__init__', lambda *args, **kwargs: init(*args, **set_device(kwargs)))
+
+        def move_to_meta(param):
+            if type(param) is torch.nn.Parameter and not param.is_meta:
+                return torch.nn.Parameter(param.to(device="meta"), requires_grad=param.requires_grad)
+
+            return param
+
         linear_init = self.replace(torch.nn.Linear, '__init__', lambda *args, **kwargs: linear_init(*args, **set_device(kwargs)))
         conv2d_init = self.replace(torch.nn.Conv2d, '__init__', lambda *args, **kwargs: conv2d_init(*args, **set_device(kwargs)))
         mha_init = self.replace(torch.nn.MultiheadAttention, '__init__', lambda *args, **kwargs: mha_init(*args, **set_device(kwargs)))
         self.replace(torch.nn.Module, 'to', lambda *args, **kwargs: None)
 
+        if self.all_parameters:
+            for cls in [torch.nn.Conv1d, torch.nn.Conv3d, torch.nn.ConvTranspose2d, torch.nn.LayerNorm, torch.nn.GroupNorm, torch.nn.Embedding]:
+                create_on_meta(cls)
+
+            register_parameter = self.replace(torch.nn.Module, 'register_parameter', lambda module, name, param: register_parameter(module, name, move_to_meta(param)))
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.restore()
 
 
+fill_speed = {}
+
+
+def estimate_fill_time(nbytes, device):
+    """returns an estimate for how long it takes to allocate nbytes of memory on device and fill it; the speed is measured once for each device"""
+
+    if nbytes == 0:
+        return 0
+
+    device = torch.device(device)
+    if device.type == "meta":
+        return 0
+
+    if device not in fill_speed:
+        sample_bytes = 64 * 1024 * 1024
+
+        def synchronize():
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+
+        synchronize()
+        start = time.perf_counter()
+        sample = torch.zeros(sample_bytes // 2, dtype=torch.float16, device=device)
+        synchronize()
+        elapsed = time.perf_counter() - start
+        del sample
+
+        fill_speed[device] = sample_bytes / max(elapsed, 1e-6)
+
+    return nbytes / fill_speed[device]
+
+
 class LoadStateDictOnMeta(ReplaceHelper):
     """
     Context manager that allows to read parameters from state_dict into a model that has some of its parameters in the meta device.
     As those parameters are read from state_dict, they will be deleted from it, so by the end state_dict will be mostly empty, to save memory.
     Meant to be used together with InitializeOnMeta above.
 
+    Tensors from state_dict become parameters of the model as they are, without allocating memory for the parameter and
+    copying the tensor there, if they already are on the right device and have the right dtype. assigned_bytes
+    counts the size of parameters made this way.
+
     Usage:
     ```
     with sd_disable_initialization.LoadStateDictOnMeta(state_dict):
@@ -161,6 +223,10 @@ class LoadStateDictOnMeta(ReplaceHelper):
         self.device = device
         self.weight_dtype_conversion = weight_dtype_conversion or {}
         self.default_dtype = self.weight_dtype_conversion.get('')
+        self.assigned_bytes = 0
+
+        # tensors of a state dict that is kept in RAM cache must not become parameters, or changing the model would change the cache
+        self.copy_kept_tensors = shared.opts.sd_checkpoint_cache > 0
 
     def get_weight_dtype(self, key):
         key_first_term, _ = key.split('.', 1)
@@ -176,7 +242,10 @@ class LoadStateDictOnMeta(ReplaceHelper):
         def load_from_state_dict(original, module, state_dict, prefix, *args, **kwargs):
             used_param_keys = []
 
-            for name, param in module._parameters.items():
+            # norm layers missing some of their weights in the state dict get their default weights, like they would without meta device
+            reset = isinstance(module, (torch.nn.LayerNorm, torch.nn.GroupNorm)) and any(param is not None and param.is_meta and prefix + name not in sd for name, param in module._parameters.items())
+
+            for name, param in list(module._parameters.items()):
                 if param is None:
                     continue
 
@@ -186,10 +255,24 @@ class LoadStateDictOnMeta(ReplaceHelper):
                     state_dict[key] = sd_param.to(dtype=self.get_weight_dtype(key))
                     used_param_keys.append(key)
 
-                if param.is_meta:
+                if not param.is_meta:
+                    continue
+
+                if sd_param is not None and not reset and sd_param.shape == param.shape:
+                    value = state_dict[key].to(device=device)
+                    if value is sd_param and self.copy_kept_tensors:
+                        value = value.clone()
+
+                    # torch's copy_ does nothing when copying a tensor into itself, so the original function won't copy it again
+                    module._parameters[name] = state_dict[key] = torch.nn.parameter.Parameter(value, requires_grad=param.requires_grad)
+                    self.assigned_bytes += value.numel() * value.element_size()
+                else:
                     dtype = sd_param.dtype if sd_param is not None else param.dtype
                     module._parameters[name] = torch.nn.parameter.Parameter(torch.zeros_like(param, device=device, dtype=dtype), requires_grad=param.requires_grad)
 
+            if reset:
+                module.reset_parameters()
+
             for name in module._buffers:
                 key = prefix + name
 
@@ -216,7 +299,10 @@ class LoadStateDictOnMeta(ReplaceHelper):
             """
 
             if state_dict is sd:
-                state_dict = {k: v.to(device="meta", dtype=v.dtype) for k, v in state_dict.items()}
+                if hasattr(state_dict, 'to_meta'):
+                    state_dict = state_dict.to_meta()  # streaming state dict; makes meta tensors without reading weights
+                else:
+                    state_dict = {k: v.to(device="meta", dtype=v.dtype) for k, v in state_dict.items()}
 
             original(module, state_dict, strict=strict)
 
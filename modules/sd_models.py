@@ -1,4 +1,3 @@
-import collections
 import importlib
 import os
 import sys
@@ -12,7 +11,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, sd_models_streaming, sd_models_converted, sd_models_prefetch, safetensors_index, tensor_cache, extra_networks, processing, lowvram, sd_hijack, patches, startup_snapshot, metrics
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -24,7 +23,7 @@ model_path = os.path.abspath(os.path.join(paths.models_path, model_dir))
 checkpoints_list = {}
 checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
-checkpoints_loaded = collections.OrderedDict()
+checkpoints_loaded = tensor_cache.TensorCacheSection("checkpoint", lambda: shared.opts.sd_checkpoint_cache)
 
 
 class ModelType(enum.Enum):
@@ -71,23 +70,22 @@ class CheckpointInfo:
         if name.startswith("\\") or name.startswith("/"):
             name = name[1:]
 
-        def read_metadata():
-            metadata = read_metadata_from_safetensors(filename)
-            self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
-
-            return metadata
-
         self.metadata = {}
+        self.hash = None
+        self.architecture = None
         if self.is_safetensors:
             try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + name, filename, read_metadata)
+                header = safetensors_index.get(filename)
+                self.metadata = dict(header["metadata"])
+                self.modelspec_thumbnail = self.metadata.pop('modelspec.thumbnail', None)
+                self.hash = header["model_hash"]
             except Exception as e:
                 errors.display(e, f"reading metadata for {filename}")
 
         self.name = name
         self.name_for_extra = os.path.splitext(os.path.basename(filename))[0]
         self.model_name = os.path.splitext(name.replace("/", "_").replace("\\", "_"))[0]
-        self.hash = model_hash(filename)
+        self.hash = self.hash or model_hash(filename)
 
         self.sha256 = hashes.sha256_from_cache(self.filename, f"checkpoint/{name}")
         self.shorthash = self.sha256[0:10] if self.sha256 else None
@@ -99,10 +97,35 @@ class CheckpointInfo:
         if self.shorthash:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
-    def register(self):
-        checkpoints_list[self.title] = self
+    def detect_architecture(self):
+        """
+        Returns name of the model's architecture (see sd_models_config.architecture_configs) using only the header of
+        a .safetensors file, or a result cached from an earlier load; returns None if that's not enough to know it.
+        """
+
+        if self.architecture is not None:
+            return self.architecture
+
+        try:
+            if self.is_safetensors:
+                state_dict = read_state_dict_streaming(self.filename, map_location="cpu")
+                self.architecture = sd_models_config.detect_model_architecture(state_dict, self, allow_tensor_reads=False)
+            else:
+                self.architecture = sd_models_config.cached_model_architecture(self.sha256)
+        except Exception as e:
+            errors.display(e, f"detecting architecture of {self.filename}")
+
+        return self.architecture
+
+    def register(self, checkpoints=None, aliases=None):
+        """adds the checkpoint to checkpoints_list and checkpoint_aliases, or to given dicts that will replace them"""
+
+        checkpoints = checkpoints_list if checkpoints is None else checkpoints
+        aliases = checkpoint_aliases if aliases is None else aliases
+
+        checkpoints[self.title] = self
         for id in self.ids:
-            checkpoint_aliases[id] = self
+            aliases[id] = self
 
     def calculate_shorthash(self):
         self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
@@ -151,8 +174,11 @@ def checkpoint_tiles(use_short=False):
 
 
 def list_models():
-    checkpoints_list.clear()
-    checkpoint_aliases.clear()
+    global checkpoints_list, checkpoint_aliases
+
+    # this can run in background while generating; new lists are filled separately and replace old ones when complete
+    checkpoints = {}
+    aliases = {}
 
     cmd_ckpt = shared.cmd_opts.ckpt
     if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
@@ -166,7 +192,7 @@ def list_models():
 
     if os.path.exists(cmd_ckpt):
         checkpoint_info = CheckpointInfo(cmd_ckpt)
-        checkpoint_info.register()
+        checkpoint_info.register(checkpoints, aliases)
 
         shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
     elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
@@ -174,8 +200,15 @@ def list_models():
 
     for filename in model_list:
         checkpoint_info = CheckpointInfo(filename)
-        checkpoint_info.register()
+        checkpoint_info.register(checkpoints, aliases)
+
+        if checkpoint_info.sha256 is None:
+            hashes.queue_background_hashing(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
+
+    checkpoints_list, checkpoint_aliases = checkpoints, aliases
+
 
+startup_snapshot.add_refresh_callback("checkpoints", list_models)
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
 
@@ -282,31 +315,7 @@ def get_state_dict_from_checkpoint(pl_sd):
 
 
 def read_metadata_from_safetensors(filename):
-    import json
-
-    with open(filename, mode="rb") as file:
-        metadata_len = file.read(8)
-        metadata_len = int.from_bytes(metadata_len, "little")
-        json_start = file.read(2)
-
-        assert metadata_len > 2 and json_start in (b'{"', b"{'"), f"{filename} is not a safetensors file"
-
-        res = {}
-
-        try:
-            json_data = json_start + file.read(metadata_len-2)
-            json_obj = json.loads(json_data)
-            for k, v in json_obj.get("__metadata__", {}).items():
-                res[k] = v
-                if isinstance(v, str) and v[0:1] == '{':
-                    try:
-                        res[k] = json.loads(v)
-                    except Exception:
-                        pass
-        except Exception:
-             errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
-
-        return res
+    return safetensors_index.metadata(filename)
 
 
 def read_state_dict(checkpoint_file, print_global_state=False, map_location=None):
@@ -329,16 +338,56 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     return sd
 
 
+def read_state_dict_streaming(checkpoint_file, map_location=None):
+    """Returns a state dict for a .safetensors checkpoint that reads tensors from the file only when they are taken from it; see sd_models_streaming.StreamingStateDict."""
+
+    device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
+
+    turbo_ln_final_shape = safetensors_index.tensor_shapes(checkpoint_file).get('conditioner.embedders.0.model.ln_final.weight')
+    is_sd2_turbo = turbo_ln_final_shape is not None and turbo_ln_final_shape[0] == 1024
+    replacements = checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else checkpoint_dict_replacements_sd1
+
+    return sd_models_streaming.StreamingStateDict(checkpoint_file, device, key_transform=lambda k: transform_checkpoint_dict_key(k, replacements))
+
+
+def cached_tensor_digests(checkpoint_info: CheckpointInfo):
+    """Returns a dict of state dict key -> digest of tensor's contents for a checkpoint if digests were already calculated along with its sha256, or None."""
+
+    if not checkpoint_info.is_safetensors:
+        return None
+
+    digests = hashes.tensor_digests_from_cache(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
+    if digests is None:
+        return None
+
+    keys_map = read_state_dict_streaming(checkpoint_info.filename, map_location="cpu").keys_map
+    return {key: digests[original_key] for key, original_key in keys_map.items() if original_key in digests}
+
+
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
     sd_model_hash = checkpoint_info.calculate_shorthash()
     timer.record("calculate hash")
 
-    if checkpoint_info in checkpoints_loaded:
+    sd_models_prefetch.prefetcher.record_load(checkpoint_info)
+
+    cached = checkpoints_loaded.get(checkpoint_info) if shared.opts.sd_checkpoint_cache > 0 else None
+    if cached is not None:
         # use checkpoint cache
         print(f"Loading weights [{sd_model_hash}] from cache")
-        # move to end as latest
-        checkpoints_loaded.move_to_end(checkpoint_info)
-        return checkpoints_loaded[checkpoint_info]
+        return cached
+
+    converted = sd_models_converted.get_state_dict(checkpoint_info, shared.weight_load_location or devices.get_optimal_device_name())
+    if converted is not None:
+        print(f"Loading weights [{sd_model_hash}] from converted weights cache")
+        timer.record("open weights file")
+        return converted
+
+    if sd_models_streaming.is_enabled(checkpoint_info.filename):
+        print(f"Streaming weights [{sd_model_hash}] from {checkpoint_info.filename}")
+        res = read_state_dict_streaming(checkpoint_info.filename)
+        timer.record("open weights file")
+
+        return res
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     res = read_state_dict(checkpoint_info.filename)
@@ -421,6 +470,8 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if state_dict is None:
         state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
+    loaded_keys = list(state_dict.keys())
+
     set_model_type(model, state_dict)
     set_model_fields(model)
 
@@ -430,19 +481,28 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if model.is_ssd:
         sd_hijack.model_hijack.convert_sdxl_to_ssd(model)
 
-    if shared.opts.sd_checkpoint_cache > 0:
+    is_streaming = isinstance(state_dict, sd_models_streaming.StreamingStateDict)
+
+    if shared.opts.sd_checkpoint_cache > 0 and not is_streaming:
         # cache newly loaded model
-        checkpoints_loaded[checkpoint_info] = state_dict.copy()
+        checkpoints_loaded.put(checkpoint_info, state_dict, cached_tensor_digests(checkpoint_info))
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
 
     model.load_state_dict(state_dict, strict=False)
+
+    if is_streaming:
+        timer.add_throughput("apply weights to model", state_dict.bytes_read)
+
     timer.record("apply weights to model")
 
     if hasattr(model, "after_load_weights"):
         model.after_load_weights(state_dict)
 
+    if is_streaming:
+        state_dict.close()
+
     del state_dict
 
     # Set is_sdxl_inpaint flag.
@@ -493,6 +553,8 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
 
     apply_alpha_schedule_override(model)
 
+    sd_models_converted.save(model, checkpoint_info, loaded_keys, timer)
+
     for module in model.modules():
         if hasattr(module, 'fp16_weight'):
             del module.fp16_weight
@@ -521,8 +583,7 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     timer.record("apply dtype to VAE")
 
     # clean up cache if limit is reached
-    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
-        checkpoints_loaded.popitem(last=False)
+    checkpoints_loaded.evict()
 
     model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
@@ -539,6 +600,95 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     timer.record("load VAE")
 
 
+def load_model_weights_delta(model, checkpoint_info: CheckpointInfo, timer):
+    """
+    Loads weights from checkpoint_info into model that has weights of another checkpoint with the same config, copying only
+    tensors that differ between the two checkpoints. Differing tensors are found by comparing tensor digests, which are
+    calculated together with sha256 and cached.
+
+    Returns False without changing the model if this can't be done for those checkpoints.
+    """
+
+    current_checkpoint_info = model.sd_checkpoint_info
+
+    if not shared.opts.sd_checkpoint_delta_switch or shared.opts.disable_mmap_load_safetensors:
+        return False
+
+    if not current_checkpoint_info.is_safetensors or not checkpoint_info.is_safetensors:
+        return False
+
+    # weights converted to fp8 are not the same as in the checkpoint
+    if devices.fp8 or check_fp8(model):
+        return False
+
+    # weights that have Lora applied to them are not the same as in the checkpoint
+    if any(getattr(module, "network_current_names", ()) for module in model.modules()):
+        return False
+
+    current_digests = hashes.tensor_digests(current_checkpoint_info.filename, f"checkpoint/{current_checkpoint_info.name}")
+    digests = hashes.tensor_digests(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
+    timer.record("calculate tensor digests")
+
+    if current_digests is None or digests is None:
+        return False
+
+    state_dict = read_state_dict_streaming(checkpoint_info.filename, map_location=model_target_device(model))
+
+    checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+    timer.record("find config")
+
+    if checkpoint_config != model.used_config:
+        return False
+
+    current_keys = read_state_dict_streaming(current_checkpoint_info.filename).keys_map
+    if set(current_keys) != set(state_dict.keys_map):
+        return False
+
+    # if an external VAE is loaded, VAE weights in the model are not the same as in the current checkpoint
+    external_vae = sd_vae.loaded_vae_file is not None
+
+    total = len(state_dict)
+    for key, original_key in list(state_dict.keys_map.items()):
+        digest = digests.get(original_key)
+        changed = digest is None or digest != current_digests.get(current_keys[key]) or (external_vae and key.startswith("first_stage_model."))
+        if not changed:
+            del state_dict[key]
+
+    changed_count = len(state_dict)
+    alphas_cumprod = state_dict.pop("alphas_cumprod", None)
+
+    with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(model)):
+        model.load_state_dict(state_dict, strict=False)
+
+    state_dict.close()
+
+    if alphas_cumprod is not None:
+        model.alphas_cumprod_original = alphas_cumprod
+
+    apply_alpha_schedule_override(model)
+
+    timer.add_throughput("apply changed weights", state_dict.bytes_read)
+    timer.record("apply changed weights")
+
+    print(f"Loaded {changed_count} out of {total} tensors that differ from {current_checkpoint_info.title} ({state_dict.bytes_read / 1024 ** 2:.1f} MB)")
+
+    if not SkipWritingToConfig.skip:
+        shared.opts.data["sd_model_checkpoint"] = checkpoint_info.title
+
+    model.sd_model_hash = checkpoint_info.calculate_shorthash()
+    model.sd_model_checkpoint = checkpoint_info.filename
+    model.sd_checkpoint_info = checkpoint_info
+    shared.opts.data["sd_checkpoint_hash"] = checkpoint_info.sha256
+
+    sd_vae.delete_base_vae()
+    sd_vae.clear_loaded_vae()
+    vae_file, vae_source = sd_vae.resolve_vae(checkpoint_info.filename).tuple()
+    sd_vae.load_vae(model, vae_file, vae_source)
+    timer.record("load VAE")
+
+    return True
+
+
 def enable_midas_autodownload():
     """
     Gives the ldm.modules.midas.api.load_model function automatic downloading.
@@ -787,6 +937,8 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     from modules import sd_hijack
     checkpoint_info = checkpoint_info or select_checkpoint()
 
+    metrics.model_loads.inc()
+
     timer = Timer()
 
     if model_data.sd_model:
@@ -816,7 +968,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     sd_model = None
     try:
         with sd_disable_initialization.DisableInitialization(disable_clip=clip_is_included_into_sd or shared.cmd_opts.do_not_download_clip):
-            with sd_disable_initialization.InitializeOnMeta():
+            with sd_disable_initialization.InitializeOnMeta(all_parameters=clip_is_included_into_sd or shared.cmd_opts.do_not_download_clip):
                 sd_model = instantiate_from_config(sd_config.model, state_dict)
 
     except Exception as e:
@@ -841,11 +993,18 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
             '': torch.float16,
         }
 
-    with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model), weight_dtype_conversion=weight_dtype_conversion):
+        # with --upcast-sampling, depth model weights are kept in float32
+        if shared.cmd_opts.upcast_sampling:
+            weight_dtype_conversion['depth_model'] = None
+
+    load_on_meta = sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model), weight_dtype_conversion=weight_dtype_conversion)
+    with load_on_meta:
         load_model_weights(sd_model, checkpoint_info, state_dict, timer)
 
     timer.record("load weights from state dict")
 
+    timer.add_saved_time("meta device construction", sd_disable_initialization.estimate_fill_time(load_on_meta.assigned_bytes, model_target_device(sd_model)))
+
     send_model_to_device(sd_model)
     timer.record("move model to device")
 
@@ -955,33 +1114,54 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
         elif sd_model.sd_model_checkpoint == checkpoint_info.filename and not forced_reload:
             return sd_model
 
+    if current_checkpoint_info is None or current_checkpoint_info.filename != checkpoint_info.filename:
+        metrics.model_switches.inc()
+
     sd_model = reuse_model_from_already_loaded(sd_model, checkpoint_info, timer)
     if not forced_reload and sd_model is not None and sd_model.sd_checkpoint_info.filename == checkpoint_info.filename:
         return sd_model
 
+    loaded_delta = False
     if sd_model is not None:
         sd_unet.apply_unet("None")
-        send_model_to_cpu(sd_model)
         sd_hijack.model_hijack.undo_hijack(sd_model)
 
-    state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
+        if not forced_reload:
+            try:
+                loaded_delta = load_model_weights_delta(sd_model, checkpoint_info, timer)
+            except Exception as e:
+                errors.display(e, f"loading changed weights from {checkpoint_info.filename}; will load all weights")
 
-    checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+        if not loaded_delta:
+            send_model_to_cpu(sd_model)
 
-    timer.record("find config")
+    if not loaded_delta:
+        state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
-    if sd_model is None or checkpoint_config != sd_model.used_config:
-        if sd_model is not None:
-            send_model_to_trash(sd_model)
+        checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
 
-        load_model(checkpoint_info, already_loaded_state_dict=state_dict)
-        return model_data.sd_model
+        timer.record("find config")
+
+        if sd_model is None or checkpoint_config != sd_model.used_config:
+            if sd_model is not None:
+                send_model_to_trash(sd_model)
+
+            load_model(checkpoint_info, already_loaded_state_dict=state_dict)
+            return model_data.sd_model
+
+    def load_weights(info, state_dict):
+        if isinstance(state_dict, sd_models_streaming.StreamingStateDict):
+            with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model)):
+                load_model_weights(sd_model, info, state_dict, timer)
+        else:
+            load_model_weights(sd_model, info, state_dict, timer)
 
     try:
-        load_model_weights(sd_model, checkpoint_info, state_dict, timer)
+        if not loaded_delta:
+            load_weights(checkpoint_info, state_dict)
     except Exception:
         print("Failed to load checkpoint, restoring previous")
-        load_model_weights(sd_model, current_checkpoint_info, None, timer)
+        load_weights(current_checkpoint_info, get_checkpoint_state_dict(current_checkpoint_info, timer))
         raise
     finally:
         sd_hijack.model_hijack.hijack(sd_model)
@@ -2,7 +2,7 @@ import os
 
 import torch
 
-from modules import shared, paths, sd_disable_initialization, devices
+from modules import shared, paths, sd_disable_initialization, devices, cache
 
 sd_configs_path = shared.sd_configs_path
 sd_repo_configs_path = os.path.join(paths.paths['Stable Diffusion'], "configs", "stable-diffusion")
@@ -25,6 +25,37 @@ config_alt_diffusion = os.path.join(sd_configs_path, "alt-diffusion-inference.ya
 config_alt_diffusion_m18 = os.path.join(sd_configs_path, "alt-diffusion-m18-inference.yaml")
 config_sd3 = os.path.join(sd_configs_path, "sd3-inference.yaml")
 
+architecture_configs = {
+    "SD1": config_default,
+    "SD1 inpainting": config_inpainting,
+    "SD1 instruct-pix2pix": config_instruct_pix2pix,
+    "SD2": config_sd2,
+    "SD2-v": config_sd2v,
+    "SD2 inpainting": config_sd2_inpainting,
+    "SD2 depth": config_depth_model,
+    "SD2 unCLIP-L": config_unclip,
+    "SD2 unCLIP-H": config_unopenclip,
+    "SDXL": config_sdxl,
+    "SSD-1B": config_sdxl,
+    "SDXL refiner": config_sdxl_refiner,
+    "SDXL inpainting": config_sdxl_inpainting,
+    "SD3": config_sd3,
+    "AltDiffusion": config_alt_diffusion,
+    "AltDiffusion m18": config_alt_diffusion_m18,
+}
+
+
+def tensor_shape(state_dict, key):
+    """returns shape of a tensor in state_dict, or None if it's not there; for a streaming state dict, the shape comes from file's header without reading the tensor"""
+
+    if key not in state_dict:
+        return None
+
+    if hasattr(state_dict, 'shape'):
+        return list(state_dict.shape(key))
+
+    return list(state_dict[key].shape)
+
 
 def is_using_v_parameterization_for_sd2(state_dict):
     """
@@ -56,7 +87,8 @@ def is_using_v_parameterization_for_sd2(state_dict):
         unet.eval()
 
     with torch.no_grad():
-        unet_sd = {k.replace("model.diffusion_model.", ""): v for k, v in state_dict.items() if "model.diffusion_model." in k}
+        # only unet tensors are taken from state_dict, so a streaming state dict reads nothing else from the file
+        unet_sd = {k.replace("model.diffusion_model.", ""): state_dict[k] for k in state_dict.keys() if "model.diffusion_model." in k}
         unet.load_state_dict(unet_sd, strict=True)
         unet.to(device=device, dtype=devices.dtype_unet)
 
@@ -69,49 +101,96 @@ def is_using_v_parameterization_for_sd2(state_dict):
     return out < -1
 
 
-def guess_model_config_from_state_dict(sd, filename):
-    sd2_cond_proj_weight = sd.get('cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight', None)
-    diffusion_model_input = sd.get('model.diffusion_model.input_blocks.0.0.weight', None)
-    sd2_variations_weight = sd.get('embedder.model.ln_final.weight', None)
+def guess_model_architecture_from_state_dict(sd, allow_tensor_reads=True):
+    """
+    Returns name of model's architecture (a key of architecture_configs) judging by names and shapes of tensors in state dict.
+    Only SD2 and SD2-v can't be told apart without running the model; for them, if allow_tensor_reads is False, returns None.
+    """
+
+    sd2_cond_proj_weight = tensor_shape(sd, 'cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight')
+    diffusion_model_input = tensor_shape(sd, 'model.diffusion_model.input_blocks.0.0.weight')
+    sd2_variations_weight = tensor_shape(sd, 'embedder.model.ln_final.weight')
 
     if "model.diffusion_model.x_embedder.proj.weight" in sd:
-        return config_sd3
+        return "SD3"
 
-    if sd.get('conditioner.embedders.1.model.ln_final.weight', None) is not None:
-        if diffusion_model_input.shape[1] == 9:
-            return config_sdxl_inpainting
+    if 'conditioner.embedders.1.model.ln_final.weight' in sd:
+        if diffusion_model_input[1] == 9:
+            return "SDXL inpainting"
+        elif 'model.diffusion_model.middle_block.1.transformer_blocks.0.attn1.to_q.weight' not in sd:
+            return "SSD-1B"
         else:
-            return config_sdxl
-
-    if sd.get('conditioner.embedders.0.model.ln_final.weight', None) is not None:
-        return config_sdxl_refiner
-    elif sd.get('depth_model.model.pretrained.act_postprocess3.0.project.0.bias', None) is not None:
-        return config_depth_model
-    elif sd2_variations_weight is not None and sd2_variations_weight.shape[0] == 768:
-        return config_unclip
-    elif sd2_variations_weight is not None and sd2_variations_weight.shape[0] == 1024:
-        return config_unopenclip
-
-    if sd2_cond_proj_weight is not None and sd2_cond_proj_weight.shape[1] == 1024:
-        if diffusion_model_input.shape[1] == 9:
-            return config_sd2_inpainting
+            return "SDXL"
+
+    if 'conditioner.embedders.0.model.ln_final.weight' in sd:
+        return "SDXL refiner"
+    elif 'depth_model.model.pretrained.act_postprocess3.0.project.0.bias' in sd:
+        return "SD2 depth"
+    elif sd2_variations_weight is not None and sd2_variations_weight[0] == 768:
+        return "SD2 unCLIP-L"
+    elif sd2_variations_weight is not None and sd2_variations_weight[0] == 1024:
+        return "SD2 unCLIP-H"
+
+    if sd2_cond_proj_weight is not None and sd2_cond_proj_weight[1] == 1024:
+        if diffusion_model_input[1] == 9:
+            return "SD2 inpainting"
+        elif not allow_tensor_reads:
+            return None
         elif is_using_v_parameterization_for_sd2(sd):
-            return config_sd2v
+            return "SD2-v"
         else:
-            return config_sd2
+            return "SD2"
 
     if diffusion_model_input is not None:
-        if diffusion_model_input.shape[1] == 9:
-            return config_inpainting
-        if diffusion_model_input.shape[1] == 8:
-            return config_instruct_pix2pix
+        if diffusion_model_input[1] == 9:
+            return "SD1 inpainting"
+        if diffusion_model_input[1] == 8:
+            return "SD1 instruct-pix2pix"
+
+    if 'cond_stage_model.roberta.embeddings.word_embeddings.weight' in sd:
+        if tensor_shape(sd, 'cond_stage_model.transformation.weight')[0] == 1024:
+            return "AltDiffusion m18"
+        return "AltDiffusion"
+
+    return "SD1"
+
+
+def guess_model_config_from_state_dict(sd, filename):
+    return architecture_configs[guess_model_architecture_from_state_dict(sd)]
+
+
+def detect_model_architecture(state_dict, info, allow_tensor_reads=True):
+    """
+    Returns name of architecture of the checkpoint described by info, using guess_model_architecture_from_state_dict.
+    state_dict can be a streaming state dict, in which case only the header of the file is used, unless the model has to be run.
+    The result is cached by checkpoint's sha256, if it is known.
+    """
+
+    sha256 = getattr(info, "sha256", None)
+
+    architecture = cached_model_architecture(sha256)
+    if architecture is not None:
+        return architecture
 
-    if sd.get('cond_stage_model.roberta.embeddings.word_embeddings.weight', None) is not None:
-        if sd.get('cond_stage_model.transformation.weight').size()[0] == 1024:
-            return config_alt_diffusion_m18
-        return config_alt_diffusion
+    architecture = guess_model_architecture_from_state_dict(state_dict, allow_tensor_reads=allow_tensor_reads)
 
-    return config_default
+    if sha256 and architecture is not None:
+        cache.cache("model-architectures")[sha256] = {"architecture": architecture}
+
+    return architecture
+
+
+def cached_model_architecture(sha256):
+    """returns architecture for the checkpoint with the given sha256 saved by detect_model_architecture, or None"""
+
+    if not sha256:
+        return None
+
+    entry = cache.cache("model-architectures").get(sha256)
+    if entry is None or entry.get("architecture") not in architecture_configs:
+        return None
+
+    return entry["architecture"]
 
 
 def find_checkpoint_config(state_dict, info):
@@ -122,7 +201,11 @@ def find_checkpoint_config(state_dict, info):
     if config is not None:
         return config
 
-    return guess_model_config_from_state_dict(state_dict, info.filename)
+    config = getattr(state_dict, "config", None)
+    if config is not None:
+        return config
+
+    return architecture_configs[detect_model_architecture(state_dict, info)]
 
 
 def find_checkpoint_config_near_filename(info):
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+
+import torch
+
+from modules import shared, cache, errors, sd_models_streaming
+
+format_version = 1
+
+
+def cache_path():
+    return os.path.join(cache.cache_dir, "converted-weights")
+
+
+def conversion_flags():
+    """settings that change the weights stored in the cache; entries made with other values of those are never used"""
+
+    return {
+        "version": format_version,
+        "no_half": bool(shared.cmd_opts.no_half),
+        "no_half_vae": bool(shared.cmd_opts.no_half_vae),
+        "upcast_sampling": bool(shared.cmd_opts.upcast_sampling),
+    }
+
+
+def entry_name(checkpoint_info):
+    if checkpoint_info.sha256 is None:
+        return None
+
+    flags_hash = hashlib.sha256(json.dumps(conversion_flags(), sort_keys=True).encode("utf8")).hexdigest()[0:8]
+    return f"{checkpoint_info.sha256[0:16]}-{flags_hash}"
+
+
+def is_enabled():
+    return shared.opts.sd_converted_cache_size_mb > 0 and not shared.cmd_opts.no_hashing
+
+
+def get_state_dict(checkpoint_info, map_location):
+    """Returns a streaming state dict for the checkpoint from the cache of converted weights, or None if there is no valid entry for it."""
+
+    if not is_enabled():
+        return None
+
+    name = entry_name(checkpoint_info)
+    if name is None:
+        return None
+
+    weights_file = os.path.join(cache_path(), name + ".safetensors")
+    sidecar_file = os.path.join(cache_path(), name + ".json")
+    if not os.path.isfile(weights_file) or not os.path.isfile(sidecar_file):
+        return None
+
+    try:
+        with open(sidecar_file, "r", encoding="utf8") as file:
+            sidecar = json.load(file)
+
+        if sidecar.get("sha256") != checkpoint_info.sha256 or sidecar.get("flags") != conversion_flags() or not os.path.isfile(sidecar.get("config", "")):
+            return None
+
+        state_dict = sd_models_streaming.StreamingStateDict(weights_file, map_location)
+        state_dict.config = sidecar["config"]
+    except Exception as e:
+        errors.display(e, f"reading converted weights for {checkpoint_info.filename}")
+        return None
+
+    # last use time for eviction
+    os.utime(sidecar_file)
+
+    return state_dict
+
+
+def write_safetensors(filename, tensors, metadata=None):
+    """writes tensors into a safetensors file one by one, so that there is never more than one tensor copied to RAM"""
+
+    dtype_names = {dtype: name for name, dtype in sd_models_streaming.dtypes.items()}
+
+    header = {}
+    if metadata:
+        header["__metadata__"] = metadata
+
+    offset = 0
+    for key, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        header[key] = {"dtype": dtype_names[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size]}
+        offset += size
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode("utf8")
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    with open(filename, "wb") as file:
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+
+        for tensor in tensors.values():
+            data = tensor.detach().contiguous().cpu().reshape(-1)
+            file.write(data.view(torch.uint8).numpy())
+
+
+def entries():
+    """returns a list of (name, size in bytes, last use time) for all entries in the cache"""
+
+    path = cache_path()
+    if not os.path.isdir(path):
+        return []
+
+    res = []
+    for fn in os.listdir(path):
+        name, ext = os.path.splitext(fn)
+        if ext != ".json":
+            continue
+
+        weights_file = os.path.join(path, name + ".safetensors")
+        size = os.path.getsize(weights_file) if os.path.isfile(weights_file) else 0
+        res.append((name, size, os.path.getmtime(os.path.join(path, fn))))
+
+    return res
+
+
+def remove_entry(name):
+    for ext in [".json", ".safetensors"]:
+        try:
+            os.remove(os.path.join(cache_path(), name + ext))
+        except FileNotFoundError:
+            pass
+
+
+def save(model, checkpoint_info, keys, timer):
+    """
+    Writes weights of the model that were loaded from the checkpoint (keys) into the cache of converted weights, so that next
+    time the checkpoint can be loaded without unpickling, renaming keys, converting dtypes or detecting its config.
+
+    Must be called after weights are converted to their final dtype, but before they are cast to fp8 or modified in any other way.
+    Least recently used entries are removed if the cache gets over the size set in settings.
+    """
+
+    if not is_enabled():
+        return
+
+    name = entry_name(checkpoint_info)
+    if name is None or os.path.isfile(os.path.join(cache_path(), name + ".json")):
+        return
+
+    model_state_dict = model.state_dict()
+    tensors = {key: model_state_dict[key] for key in keys if key in model_state_dict}
+
+    # the schedule in the model may have overrides from settings applied to it
+    if "alphas_cumprod" in tensors and getattr(model, "alphas_cumprod_original", None) is not None:
+        tensors["alphas_cumprod"] = model.alphas_cumprod_original
+
+    size = sum(tensor.numel() * tensor.element_size() for tensor in tensors.values())
+    budget = shared.opts.sd_converted_cache_size_mb * 1024 * 1024
+    if size > budget:
+        return
+
+    existing = sorted(entries(), key=lambda x: x[2])
+    total = sum(x[1] for x in existing)
+    while existing and total + size > budget:
+        old_name, old_size, _ = existing.pop(0)
+        remove_entry(old_name)
+        total -= old_size
+
+    os.makedirs(cache_path(), exist_ok=True)
+
+    weights_file = os.path.join(cache_path(), name + ".safetensors")
+    sidecar_file = os.path.join(cache_path(), name + ".json")
+
+    try:
+        write_safetensors(weights_file + ".tmp", tensors)
+        os.replace(weights_file + ".tmp", weights_file)
+
+        sidecar = {
+            "sha256": checkpoint_info.sha256,
+            "source": checkpoint_info.filename,
+            "config": model.used_config,
+            "model_type": model.model_type.name,
+            "flags": conversion_flags(),
+        }
+
+        with open(sidecar_file + ".tmp", "w", encoding="utf8") as file:
+            json.dump(sidecar, file, indent=4)
+        os.replace(sidecar_file + ".tmp", sidecar_file)
+    except Exception as e:
+        errors.display(e, f"saving converted weights for {checkpoint_info.filename}")
+        remove_entry(name)
+        return
+
+    timer.record("save converted weights")
@@ -0,0 +1,228 @@
+import collections
+import os
+import threading
+
+from modules import shared, errors
+
+chunk_size = 16 * 1024 * 1024
+
+
+class CheckpointPrefetcher:
+    """
+    Reads checkpoints that are going to be loaded soon in a background thread, while the current model is working.
+
+    Sources (X/Y/Z plot, queued API requests) tell the prefetcher which checkpoints they are going to use with expect().
+    Checkpoints are warmed in the order in which sources were added, either by reading the file into the OS page cache,
+    or by loading it into the RAM checkpoint cache, as long as the total size of warmed checkpoints that were not used
+    yet is within the budget set in settings. Every checkpoint load is counted as a hit if the checkpoint was warmed
+    before it was needed, or a miss otherwise; the counts are kept for each job.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sources = collections.OrderedDict()
+        self.warmed = {}
+        self.thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_prefetched = 0
+        self.jobs = collections.OrderedDict()
+
+    def mode(self):
+        mode = shared.opts.sd_checkpoint_prefetch
+        if mode == "RAM cache" and shared.opts.sd_checkpoint_cache <= 0:
+            return "Page cache"
+
+        return mode
+
+    def is_enabled(self):
+        return self.mode() != "Disabled"
+
+    def expect(self, source, checkpoints):
+        """records that source is going to load checkpoints (a list of CheckpointInfo) in the given order"""
+
+        checkpoints = [x for x in checkpoints if x is not None]
+
+        from modules import hashes
+
+        # checkpoints that are about to be loaded are hashed before others that are waiting in background
+        for checkpoint_info in checkpoints:
+            if checkpoint_info.sha256 is None:
+                hashes.queue_background_hashing(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}", priority=hashes.PRIORITY_HIGH)
+
+        if not checkpoints or not self.is_enabled():
+            return
+
+        with self.condition:
+            self.sources[source] = checkpoints
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, name="checkpoint-prefetch", daemon=True)
+                self.thread.start()
+
+            self.condition.notify()
+
+    def forget(self, source):
+        with self.condition:
+            self.sources.pop(source, None)
+
+            pending = {x.filename for x in self.pending()}
+            for filename in [x for x in self.warmed if x not in pending]:
+                del self.warmed[filename]
+
+    def pending(self):
+        """returns checkpoints that are expected to be loaded, without duplicates, in order"""
+
+        res = {}
+        with self.condition:
+            for checkpoints in self.sources.values():
+                for checkpoint_info in checkpoints:
+                    res.setdefault(checkpoint_info.filename, checkpoint_info)
+
+        return list(res.values())
+
+    def is_pending(self, checkpoint_info):
+        return any(x.filename == checkpoint_info.filename for x in self.pending())
+
+    def next_checkpoint(self):
+        """returns the first expected checkpoint that is not warmed yet and fits into the budget, or None"""
+
+        from modules import sd_models
+
+        budget = int(shared.opts.sd_checkpoint_prefetch_budget_mb) * 1024 * 1024
+        used = sum(self.warmed.values())
+        current = getattr(sd_models.model_data.sd_model, 'sd_checkpoint_info', None)
+
+        for checkpoint_info in self.pending():
+            if checkpoint_info.filename in self.warmed or current is not None and current.filename == checkpoint_info.filename:
+                continue
+
+            if self.mode() == "RAM cache" and checkpoint_info in sd_models.checkpoints_loaded:
+                continue
+
+            if used + os.path.getsize(checkpoint_info.filename) > budget:
+                return None
+
+            return checkpoint_info
+
+        return None
+
+    def worker(self):
+        while True:
+            with self.condition:
+                checkpoint_info = self.next_checkpoint()
+                while checkpoint_info is None:
+                    if not self.condition.wait(timeout=60) and self.next_checkpoint() is None:
+                        self.thread = None
+                        return
+
+                    checkpoint_info = self.next_checkpoint()
+
+            try:
+                nbytes = self.warm(checkpoint_info)
+            except Exception as e:
+                errors.display(e, f"prefetching checkpoint {checkpoint_info.filename}")
+
+                with self.condition:
+                    self.forget_checkpoint(checkpoint_info)
+
+                continue
+
+            if nbytes is None:
+                continue
+
+            with self.condition:
+                self.warmed[checkpoint_info.filename] = nbytes
+                self.bytes_prefetched += nbytes
+
+    def warm(self, checkpoint_info):
+        """reads the checkpoint; returns the number of bytes read, or None if it stopped being expected while it was read"""
+
+        if self.mode() == "RAM cache":
+            from modules import sd_models
+
+            state_dict = sd_models.read_state_dict(checkpoint_info.filename)
+            if not self.is_pending(checkpoint_info):
+                return None
+
+            sd_models.checkpoints_loaded.put(checkpoint_info, state_dict, sd_models.cached_tensor_digests(checkpoint_info))
+            return os.path.getsize(checkpoint_info.filename)
+
+        nbytes = 0
+        buffer = bytearray(chunk_size)
+        with open(checkpoint_info.filename, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+            while True:
+                n = file.readinto(buffer)
+                if not n:
+                    break
+
+                nbytes += n
+
+                if not self.is_pending(checkpoint_info):
+                    return None
+
+        return nbytes
+
+    def forget_checkpoint(self, checkpoint_info):
+        """removes the first expected occurrence of the checkpoint from every source"""
+
+        for checkpoints in self.sources.values():
+            for i, x in enumerate(checkpoints):
+                if x.filename == checkpoint_info.filename:
+                    del checkpoints[i]
+                    break
+
+    def record_load(self, checkpoint_info):
+        """called when a checkpoint's weights are about to be loaded; counts a prefetch hit or miss for the current job"""
+
+        if not self.is_enabled():
+            return
+
+        job = current_job()
+
+        with self.condition:
+            hit = self.warmed.pop(checkpoint_info.filename, None) is not None
+            self.forget_checkpoint(checkpoint_info)
+
+            stats = self.jobs.setdefault(job, {"hits": 0, "misses": 0})
+            self.jobs.move_to_end(job)
+            while len(self.jobs) > 16:
+                self.jobs.popitem(last=False)
+
+            if hit:
+                self.hits += 1
+                stats["hits"] += 1
+            else:
+                self.misses += 1
+                stats["misses"] += 1
+
+            self.condition.notify()
+
+    def job_stats(self, job=None):
+        with self.condition:
+            return dict(self.jobs.get(job or current_job(), {"hits": 0, "misses": 0}))
+
+    def stats(self):
+        with self.condition:
+            return {
+                "mode": self.mode(),
+                "pending": [x.title for x in self.pending()],
+                "warmed": list(self.warmed),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_prefetched": self.bytes_prefetched,
+                "jobs": {job: dict(stats) for job, stats in self.jobs.items()},
+            }
+
+
+def current_job():
+    from modules import progress
+
+    return progress.current_task or shared.state.job or "unknown"
+
+
+prefetcher = CheckpointPrefetcher()
@@ -0,0 +1,131 @@
+import os
+import typing
+
+import safetensors
+import torch
+
+from modules import shared, safetensors_index
+
+dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+if hasattr(torch, "float8_e4m3fn"):
+    dtypes["F8_E4M3"] = torch.float8_e4m3fn
+    dtypes["F8_E5M2"] = torch.float8_e5m2
+
+
+class StreamingStateDict(typing.Mapping):
+    """
+    A read-only state dict for a .safetensors checkpoint that reads tensors from the memory-mapped file one at a time,
+    when they are requested, instead of reading the whole file into memory.
+
+    Keys are already transformed the same way get_state_dict_from_checkpoint does it. pop() reads the tensor and forgets the key,
+    so each tensor is read once, and, once it's copied into the model, the memory it used can be freed.
+
+    Meant to be used with sd_disable_initialization.LoadStateDictOnMeta, which takes tensors from the state dict one by one.
+    Keys and shapes come from the header index, so the file is only opened when the first tensor is read.
+    """
+
+    def __init__(self, filename, device, key_transform=None):
+        self.filename = filename
+        self.device = device
+        self.opened_file = None
+        self.header = safetensors_index.get(filename)
+        self.bytes_read = 0
+        self.config = None  # path to model config, if it's known without looking at weights
+
+        key_transform = key_transform or (lambda k: k)
+        self.keys_map = {}
+        for key in self.header["tensors"]:
+            new_key = key_transform(key)
+            if new_key is not None:
+                self.keys_map[new_key] = key
+
+    @property
+    def file(self):
+        if self.opened_file is None:
+            self.opened_file = safetensors.safe_open(self.filename, framework="pt", device=str(self.device))
+
+        return self.opened_file
+
+    def close(self):
+        """closes the file if it was opened; called once tensors have been copied into the model"""
+
+        if self.opened_file is not None:
+            self.opened_file.__exit__(None, None, None)
+            self.opened_file = None
+
+    def __len__(self):
+        return len(self.keys_map)
+
+    def __iter__(self):
+        return iter(list(self.keys_map))
+
+    def __contains__(self, key):
+        return key in self.keys_map
+
+    def __getitem__(self, key):
+        original_key = self.keys_map[key]
+        tensor = self.file.get_tensor(original_key)
+        self.bytes_read += tensor.numel() * tensor.element_size()
+
+        return tensor
+
+    def __delitem__(self, key):
+        del self.keys_map[key]
+
+    def pop(self, key, *default):
+        if key not in self.keys_map:
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+        tensor = self[key]
+        del self.keys_map[key]
+
+        return tensor
+
+    def shape(self, key):
+        """returns shape of the tensor without reading it"""
+
+        _, shape, _ = self.header["tensors"][self.keys_map[key]]
+        return shape
+
+    def to_meta(self):
+        """returns a regular dict with all remaining tensors on meta device, without reading any of them"""
+
+        res = {}
+        for key, original_key in self.keys_map.items():
+            dtype, shape, _ = self.header["tensors"][original_key]
+            res[key] = torch.empty(shape, dtype=dtypes.get(dtype, torch.float32), device="meta")
+
+        return res
+
+
+def is_enabled(checkpoint_file):
+    """returns True if the checkpoint can be loaded tensor by tensor with current settings"""
+
+    if os.path.splitext(checkpoint_file)[1].lower() != ".safetensors":
+        return False
+
+    if not shared.opts.sd_checkpoint_streaming_load:
+        return False
+
+    if shared.cmd_opts.disable_model_loading_ram_optimization or shared.opts.disable_mmap_load_safetensors:
+        return False
+
+    # checkpoint cache needs a complete copy of the state dict
+    if shared.opts.sd_checkpoint_cache > 0:
+        return False
+
+    return True
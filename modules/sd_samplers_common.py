@@ -1,9 +1,10 @@
 import inspect
+import time
 from collections import namedtuple
 import numpy as np
 import torch
 from PIL import Image
-from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models
+from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models, metrics, tracing
 from modules.shared import opts, state
 import k_diffusion.sampling
 
@@ -252,10 +253,17 @@ class Sampler:
         self.model_wrap_cfg = None
         self.sampler_extra_args = None
         self.options = {}
+        self.last_step_time = None
 
     def callback_state(self, d):
         step = d['i']
 
+        now = time.perf_counter()
+        if self.last_step_time is not None:
+            metrics.sampling_step.observe(now - self.last_step_time)
+            tracing.record("sampling step", self.last_step_time, now, step=step)
+        self.last_step_time = now
+
         if self.stop_at is not None and step > self.stop_at:
             raise InterruptedException
 
@@ -263,6 +271,7 @@ class Sampler:
         shared.total_tqdm.update()
 
     def launch_sampling(self, steps, func):
+        self.last_step_time = time.perf_counter()
         self.model_wrap_cfg.steps = steps
         self.model_wrap_cfg.total_steps = self.config.total_steps(steps)
         state.sampling_steps = steps
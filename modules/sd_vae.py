@@ -1,10 +1,8 @@
 import os
-import collections
 from dataclasses import dataclass
 
-from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes
+from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes, tensor_cache, startup_snapshot
 
-import glob
 from copy import deepcopy
 
 
@@ -17,7 +15,7 @@ base_vae = None
 loaded_vae_file = None
 checkpoint_info = None
 
-checkpoints_loaded = collections.OrderedDict()
+checkpoints_loaded = tensor_cache.TensorCacheSection("vae", lambda: shared.opts.sd_vae_checkpoint_cache + 1)  # we need to count the current model
 
 
 def get_loaded_vae_name():
@@ -70,40 +68,38 @@ def get_filename(filepath):
 
 
 def refresh_vae_list():
-    vae_dict.clear()
-
-    paths = [
-        os.path.join(sd_models.model_path, '**/*.vae.ckpt'),
-        os.path.join(sd_models.model_path, '**/*.vae.pt'),
-        os.path.join(sd_models.model_path, '**/*.vae.safetensors'),
-        os.path.join(vae_path, '**/*.ckpt'),
-        os.path.join(vae_path, '**/*.pt'),
-        os.path.join(vae_path, '**/*.safetensors'),
+    global vae_dict
+
+    vae_suffixes = ['.vae.ckpt', '.vae.pt', '.vae.safetensors']
+    all_suffixes = ['.ckpt', '.pt', '.safetensors']
+
+    searches = [
+        (sd_models.model_path, vae_suffixes),
+        (vae_path, all_suffixes),
     ]
 
     if shared.cmd_opts.ckpt_dir is not None and os.path.isdir(shared.cmd_opts.ckpt_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.ckpt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.pt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.safetensors'),
-        ]
+        searches.append((shared.cmd_opts.ckpt_dir, vae_suffixes))
 
     if shared.cmd_opts.vae_dir is not None and os.path.isdir(shared.cmd_opts.vae_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.ckpt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.pt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.safetensors'),
-        ]
+        searches.append((shared.cmd_opts.vae_dir, all_suffixes))
 
     candidates = []
-    for path in paths:
-        candidates += glob.iglob(path, recursive=True)
+    for dirpath, suffixes in searches:
+        for filepath in shared.walk_files(dirpath, allowed_extensions=all_suffixes, use_snapshot=True):
+            if any(filepath.lower().endswith(suffix) for suffix in suffixes):
+                candidates.append(filepath)
 
+    found = {}
     for filepath in candidates:
         name = get_filename(filepath)
-        vae_dict[name] = filepath
+        found[name] = filepath
+
+    # this can run in background while generating, so the list in use is replaced rather than changed
+    vae_dict = dict(sorted(found.items(), key=lambda item: shared.natural_sort_key(item[0])))
+
 
-    vae_dict.update(dict(sorted(vae_dict.items(), key=lambda item: shared.natural_sort_key(item[0]))))
+startup_snapshot.add_refresh_callback("VAE", refresh_vae_list)
 
 
 def find_vae_near_checkpoint(checkpoint_file):
@@ -198,11 +194,12 @@ def load_vae(model, vae_file=None, vae_source="from unknown source"):
     cache_enabled = shared.opts.sd_vae_checkpoint_cache > 0
 
     if vae_file:
-        if cache_enabled and vae_file in checkpoints_loaded:
+        cached = checkpoints_loaded.get(vae_file) if cache_enabled else None
+        if cached is not None:
             # use vae checkpoint cache
             print(f"Loading VAE weights {vae_source}: cached {get_filename(vae_file)}")
             store_base_vae(model)
-            _load_vae_dict(model, checkpoints_loaded[vae_file])
+            _load_vae_dict(model, cached)
         else:
             assert os.path.isfile(vae_file), f"VAE {vae_source} doesn't exist: {vae_file}"
             print(f"Loading VAE weights {vae_source}: {vae_file}")
@@ -213,12 +210,11 @@ def load_vae(model, vae_file=None, vae_source="from unknown source"):
 
             if cache_enabled:
                 # cache newly loaded vae
-                checkpoints_loaded[vae_file] = vae_dict_1.copy()
+                checkpoints_loaded[vae_file] = vae_dict_1
 
         # clean up cache if limit is reached
         if cache_enabled:
-            while len(checkpoints_loaded) > shared.opts.sd_vae_checkpoint_cache + 1: # we need to count the current model
-                checkpoints_loaded.popitem(last=False)  # LRU
+            checkpoints_loaded.evict()
 
         # If vae used is not in dict, update it
         # It will be removed on refresh though
@@ -125,9 +125,17 @@ options_templates.update(options_section(('system', "System", "system"), {
     "enable_upscale_progressbar": OptionInfo(True, "Show a progress bar in the console for tiled upscaling."),
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
+    "startup_snapshot": OptionInfo(True, "Use listings of model directories saved on exit at next startup").info("lists of checkpoints, VAEs, upscalers, Loras and embeddings are available without scanning directories; they are checked in background after startup and refreshed if anything has changed"),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
+    "hashing_threads": OptionInfo(2, "Number of threads for calculating hashes of model files", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}),
+    "hashing_background": OptionInfo(False, "Calculate hashes of all checkpoints and Loras in background after listing them").info("hashes for a model that is about to be loaded are always calculated first"),
+    "cache_pin_checkpoint_hashes": OptionInfo(True, "Pin hashes of checkpoints in cache").info("pinned entries are never removed when the cache gets too big; more entries can be pinned with python -m modules.cache_maintenance pin"),
+    "result_cache": OptionInfo(False, "Cache generation results").info("repeated generations with same parameters, fixed seed, models and script arguments return stored images without sampling; not used when images are saved to disk, or with extension scripts not marked as deterministic"),
+    "result_cache_size_mb": OptionInfo(2048, "Disk space for cached generation results (MB)", gr.Number, {"precision": 0}).info("least recently used results are removed first"),
+    "task_results_hours": OptionInfo(0, "Keep results of finished tasks on disk for (hours)", gr.Number, {"precision": 0}).info("0 = disable; lets the restore progress button and /sdapi/v1/results get images after a page reload, lost connection or restart"),
+    "task_results_size_mb": OptionInfo(1024, "Disk space for results of finished tasks (MB)", gr.Number, {"precision": 0}).info("oldest results are removed first; images that were saved to the output directory only take space for their path"),
 }))
 
 options_templates.update(options_section(('profiler', "Profiler", "system"), {
@@ -150,6 +158,15 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_jobs_max_per_client": OptionInfo(8, "Maximum number of unfinished asynchronous jobs per client", gr.Number, {"precision": 0}, restrict_api=True).info("0 = unlimited; clients are told by API user with --api-auth, or by IP address"),
+    "api_jobs_keep_results": OptionInfo(64, "Number of finished asynchronous jobs to keep results for", gr.Number, {"precision": 0}, restrict_api=True),
+    "api_coalesce_max_batch": OptionInfo(1, "Maximum batch size for coalesced txt2img requests", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}, restrict_api=True).info("1 = disabled; single-image txt2img requests that differ only in prompt and seed are generated together in one batch"),
+    "api_coalesce_max_wait": OptionInfo(50, "Time to wait for more requests to coalesce with (ms)", gr.Number, {"precision": 0}, restrict_api=True),
+    "api_image_store_mb": OptionInfo(256, "Memory for images returned as URLs (MB)", gr.Number, {"precision": 0}, restrict_api=True).info("for requests with response_format set to urls; oldest images are dropped first"),
+    "api_admission_max_queue": OptionInfo(0, "Maximum number of txt2img and img2img requests waiting in queue", gr.Number, {"precision": 0}, restrict_api=True).info("0 = unlimited; further requests are rejected with 429 Too Many Requests and a Retry-After header"),
+    "api_admission_max_wait": OptionInfo(0, "Maximum estimated wait for txt2img and img2img requests (s)", gr.Number, {"precision": 0}, restrict_api=True).info("0 = unlimited; estimated from how long earlier generations with same checkpoint type, resolution, sampler and steps took"),
+    "api_admission_max_per_client": OptionInfo(0, "Maximum number of unfinished txt2img and img2img requests per client", gr.Number, {"precision": 0}, restrict_api=True).info("0 = unlimited; clients are told by API user with --api-auth, or by IP address"),
+    "api_traces_keep": OptionInfo(32, "Number of generation traces to keep", gr.Number, {"precision": 0}, restrict_api=True).info("0 = disable tracing; timings of steps of the last tasks, available through /sdapi/v1/traces"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -172,6 +189,12 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
     "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_tensor_cache_budget_mb": OptionInfo(0, "RAM budget for cached checkpoints and VAEs (MB)", gr.Number, {"precision": 0}).info("0 = only limit by number of cached models; tensors that are the same in multiple cached models are stored once"),
+    "sd_tensor_cache_policy": OptionInfo("LRU", "Eviction policy for cached checkpoints and VAEs", gr.Radio, {"choices": ["LRU", "LFU"]}).info("LRU = evict least recently used; LFU = evict least frequently used"),
+    "sd_checkpoint_delta_switch": OptionInfo(False, "When switching between checkpoints with the same architecture, only load tensors that differ").info("uses per-tensor digests calculated along with sha256; speeds up switching between models merged or fine-tuned from the same base; .safetensors only"),
+    "sd_checkpoint_streaming_load": OptionInfo(False, "Stream .safetensors checkpoint weights into the model one tensor at a time").info("lowers peak RAM use when loading a checkpoint; not used when checkpoints are cached in RAM or with --disable-model-loading-ram-optimization"),
+    "sd_checkpoint_prefetch": OptionInfo("Disabled", "Prefetch checkpoints that are going to be used next", gr.Radio, {"choices": ["Disabled", "Page cache", "RAM cache"]}).info("for X/Y/Z plot and queued API requests; Page cache = read the file in background so that loading does not wait for the disk; RAM cache = load into checkpoint cache, needs Checkpoints to cache in RAM above 0"),
+    "sd_checkpoint_prefetch_budget_mb": OptionInfo(8192, "Memory budget for prefetched checkpoints (MB)", gr.Number, {"precision": 0}).info("checkpoints are not prefetched if prefetched checkpoints that were not used yet would take more than this"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -242,6 +265,8 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
+    "sd_converted_cache_size_mb": OptionInfo(0, "Disk space for cache of converted checkpoint weights (MB)", gr.Number, {"precision": 0}).info("0 = disable; stores weights of loaded checkpoints already renamed and converted to the dtype they are used in, so that next load can skip that work; requires hashing"),
+    "pickle_safetensors_cache": OptionInfo(False, "Keep safetensors copies of loaded .ckpt and .pt files in cache directory").info("later loads read the copy without unpickling; uses as much disk space as the original files; only for files that contain nothing but tensors, dicts, lists and simple values"),
 }))
 
 options_templates.update(options_section(('compatibility', "Compatibility", "sd"), {
@@ -3,7 +3,7 @@ import logging
 import threading
 import time
 
-from modules import errors, shared, devices
+from modules import errors, shared, devices, metrics
 from typing import Optional
 
 log = logging.getLogger(__name__)
@@ -78,6 +78,7 @@ class State:
 
     def interrupt(self):
         self.interrupted = True
+        metrics.interrupts.inc()
         log.info("Received interrupt request")
 
     def stop_generating(self):
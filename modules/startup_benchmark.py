@@ -0,0 +1,113 @@
+"""
+Startup benchmark mode, enabled with --startup-benchmark [filename].
+
+Measures how long importing every module takes, like python's -X importtime, and after startup writes that together with
+startup_timer records into a JSON file and exits, so that startup time can be compared between releases.
+"""
+
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+from modules.timer import startup_timer
+
+
+class ImportTimer:
+    """
+    A meta path finder that does not find anything itself; it asks other finders for the module spec and wraps exec_module of
+    the loader to measure how long executing the module took, both with and without the modules that it imported in turn.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.stack = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self.local, "searching", False):
+            return None
+
+        self.local.searching = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.local.searching = False
+
+        loader = spec.loader
+        if loader is None or isinstance(loader, type) or not hasattr(loader, "exec_module") or getattr(loader, "import_timer_wrapped", False):
+            return spec
+
+        try:
+            loader.exec_module = self.wrap(loader.exec_module)
+            loader.import_timer_wrapped = True
+        except (AttributeError, TypeError):
+            pass
+
+        return spec
+
+    def wrap(self, exec_module):
+        def timed_exec_module(module):
+            if threading.current_thread() is not threading.main_thread():
+                return exec_module(module)
+
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return exec_module(module)
+            finally:
+                cumulative = time.perf_counter() - start
+                children = self.stack.pop()
+                if self.stack:
+                    self.stack[-1] += cumulative
+
+                with self.lock:
+                    self.records.append({"module": module.__name__, "self": cumulative - children, "cumulative": cumulative, "depth": len(self.stack)})
+
+        return timed_exec_module
+
+
+import_timer = None
+
+
+def install():
+    global import_timer
+
+    if import_timer is None:
+        import_timer = ImportTimer()
+        sys.meta_path.insert(0, import_timer)
+
+
+def report():
+    imports = sorted(import_timer.records if import_timer else [], key=lambda x: x["cumulative"], reverse=True)
+
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": sys.argv[1:],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "startup": startup_timer.dump(),
+        "imports_total": sum(x["self"] for x in imports),
+        "imports": imports,
+        "modules_loaded": sorted(sys.modules),
+    }
+
+
+def write(filename):
+    """writes the benchmark report into filename; the caller is expected to stop instead of starting the server after this"""
+
+    with open(filename, "w", encoding="utf8") as file:
+        json.dump(report(), file, indent=4)
+
+    print(f"Startup benchmark saved to {os.path.abspath(filename)}")
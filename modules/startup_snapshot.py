@@ -0,0 +1,168 @@
+"""
+Startup snapshot of directory listings that model registries are built from.
+
+Checkpoints, VAEs, upscalers, Loras and embeddings are found by walking their directories. When the program exits, the
+listings made during the run are saved together with modification times of every listed directory. On next start, the
+saved listings are used instead of walking the directories, so registries are filled without waiting for the disk;
+after startup, modification times are checked in background, and if any directory has changed, registries are rebuilt
+from fresh listings.
+"""
+
+import atexit
+import json
+import os
+import threading
+
+from modules import cache, errors
+
+format_version = 1
+
+walks = {}
+"""path -> result of os.walk for directories listed during this run"""
+
+directory_mtimes = {}
+"""path -> dict of directory -> mtime_ns for every directory in walks[path], taken right after listing"""
+
+restored = {}
+"""path -> (walk, directory mtimes) from the snapshot; used instead of listing directories until revalidate runs"""
+
+refresh_callbacks = {}
+"""name -> function that rebuilds a registry; called after startup if listings in the snapshot turn out to be outdated"""
+
+lock = threading.Lock()
+enabled = False
+
+
+def snapshot_filename():
+    return os.path.join(cache.cache_dir, "startup-snapshot.json")
+
+
+def stat_directories(path, walk_result):
+    res = {path: mtime_ns(path)}
+    for root, _, _ in walk_result:
+        res[root] = mtime_ns(root)
+
+    return res
+
+
+def mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def walk(path):
+    """returns list(os.walk(path, followlinks=True)), taken from the snapshot if it was restored and not yet revalidated"""
+
+    key = os.path.abspath(path)
+
+    with lock:
+        entry = restored.get(key)
+        if entry is not None:
+            walks[key], directory_mtimes[key] = entry
+            return list(entry[0])
+
+    res = [(root, dirs, files) for root, dirs, files in os.walk(path, followlinks=True)]
+
+    if enabled:
+        mtimes = stat_directories(key, res)
+        with lock:
+            walks[key] = res
+            directory_mtimes[key] = mtimes
+
+    return res
+
+
+def add_refresh_callback(name, func):
+    """registers a function that rebuilds a registry from directory listings; it is called if the snapshot turns out to be outdated"""
+
+    refresh_callbacks[name] = func
+
+
+def load():
+    """reads the snapshot saved on previous exit; listings from it are used until revalidate is called"""
+
+    global enabled
+
+    from modules import shared
+
+    enabled = shared.opts.startup_snapshot
+    if not enabled:
+        return
+
+    atexit.register(save)
+
+    try:
+        with open(snapshot_filename(), "r", encoding="utf8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        errors.display(e, "reading startup snapshot")
+        return
+
+    if data.get("version") != format_version:
+        return
+
+    with lock:
+        for path, entry in data["walks"].items():
+            restored[path] = ([tuple(x) for x in entry["walk"]], entry["mtimes"])
+
+
+def save():
+    if not enabled:
+        return
+
+    with lock:
+        data = {
+            "version": format_version,
+            "walks": {path: {"walk": walks[path], "mtimes": directory_mtimes[path]} for path in walks},
+        }
+
+    try:
+        os.makedirs(cache.cache_dir, exist_ok=True)
+        with open(snapshot_filename() + ".tmp", "w", encoding="utf8") as file:
+            json.dump(data, file)
+        os.replace(snapshot_filename() + ".tmp", snapshot_filename())
+    except Exception as e:
+        errors.display(e, "saving startup snapshot")
+
+
+def outdated_paths(entries):
+    return [path for path, (_, mtimes) in entries.items() if any(mtime_ns(directory) != mtime for directory, mtime in mtimes.items())]
+
+
+def revalidate():
+    """stops using the snapshot; if any of directories in it have changed since it was saved, rebuilds registries from fresh listings"""
+
+    with lock:
+        entries = dict(restored)
+
+    outdated = outdated_paths(entries)
+
+    with lock:
+        restored.clear()
+
+        # listings that were not refreshed by callbacks below are made again when they are needed next time
+        for path in outdated:
+            walks.pop(path, None)
+            directory_mtimes.pop(path, None)
+
+    if not outdated:
+        return
+
+    print(f"Startup snapshot is outdated for {len(outdated)} directories; refreshing lists of models")
+
+    for name, func in list(refresh_callbacks.items()):
+        try:
+            func()
+        except Exception as e:
+            errors.display(e, f"refreshing {name} after startup snapshot")
+
+
+def revalidate_in_background():
+    if not restored:
+        return
+
+    threading.Thread(target=revalidate, name="startup snapshot revalidation", daemon=True).start()
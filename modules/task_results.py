@@ -0,0 +1,136 @@
+"""
+Durable store of generation results by task id.
+
+Images and generation info of every finished txt2img and img2img task are written to disk in background, so that they
+are not lost when the client loses its connection during a long generation: the UI gets them back with the restore
+progress button after a page reload or a restart of the server, and API clients fetch them from
+/sdapi/v1/results/{task_id}. Images that were saved to the output directory are stored as paths to those files, others
+as PNG. Results are only kept when enabled in settings, and expire after the time set there; the oldest ones are removed
+first when the store exceeds its size limit.
+"""
+
+import concurrent.futures
+import functools
+import os
+import threading
+import time
+
+import diskcache
+from PIL import Image
+
+from modules import cache, errors, result_cache
+from modules.shared import opts
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="task results")
+
+lock = threading.Lock()
+disk = None
+pending = {}  # task id -> future of the write that's still in progress
+
+write_timeout = 10
+"""longest time get waits for results of a task that are still being written, in seconds"""
+
+
+def open_disk():
+    global disk
+
+    size_limit = int(opts.task_results_size_mb) * 1024 * 1024
+
+    with lock:
+        if disk is None:
+            disk = diskcache.Cache(os.path.join(cache.cache_dir, cache.task_results_dirname), size_limit=size_limit, eviction_policy="least-recently-stored", disk_min_file_size=2**18)
+        elif disk.size_limit != size_limit:
+            disk.reset('size_limit', size_limit)
+
+    return disk
+
+
+def encode_image(image):
+    saved_as = getattr(image, "already_saved_as", None)
+    if saved_as and os.path.isfile(saved_as):
+        return {"path": os.path.abspath(saved_as)}  # relative paths of outputs would be wrong for a process started elsewhere
+
+    return {"png": result_cache.encode_image(image)}
+
+
+def write(task_id, value):
+    try:
+        value["images"] = [encode_image(image) for image in value["images"]]
+        open_disk().set(task_id, value, expire=opts.task_results_hours * 3600)
+    except Exception as e:
+        errors.display(e, f"storing results of {task_id}")
+
+
+def forget(task_id, future):
+    with lock:
+        if pending.get(task_id) is future:
+            del pending[task_id]
+
+
+def store(task_id, images, info, html_info=None, html_comments=None):
+    """starts writing results of the task to disk in background; info is generation info json, html ones are for restoring UI"""
+
+    if not task_id or opts.task_results_hours <= 0:
+        return
+
+    value = {
+        "images": [image for image in images if isinstance(image, Image.Image)],
+        "info": info,
+        "html_info": html_info,
+        "html_comments": html_comments,
+        "created": time.time(),
+    }
+
+    with lock:
+        future = executor.submit(write, task_id, value)
+        pending[task_id] = future
+
+    future.add_done_callback(functools.partial(forget, task_id))
+
+
+def get(task_id):
+    """returns stored results of the task as a dict with images, info, html_info, html_comments and created, or None; images are dicts with either png bytes or path"""
+
+    with lock:
+        future = pending.get(task_id)
+
+    if future is not None:
+        done, _ = concurrent.futures.wait([future], timeout=write_timeout)
+        if not done:
+            print(f"Results of {task_id} are still being written after {write_timeout} seconds")
+            return None
+
+    try:
+        return open_disk().get(task_id)
+    except Exception as e:
+        errors.display(e, f"reading results of {task_id}")
+        return None
+
+
+def image_bytes(image):
+    """returns bytes of a stored image, or None if it was stored as a path to a file that no longer exists"""
+
+    if "png" in image:
+        return image["png"]
+
+    if not os.path.isfile(image["path"]):
+        return None
+
+    with open(image["path"], "rb") as file:
+        return file.read()
+
+
+def load_image(image):
+    """returns a stored image as PIL image, or None if it was stored as a path to a file that no longer exists"""
+
+    if "png" in image:
+        return result_cache.decode_image(image["png"])
+
+    if not os.path.isfile(image["path"]):
+        return None
+
+    with Image.open(image["path"]) as file:
+        res = file.copy()
+
+    res.already_saved_as = image["path"]
+    return res
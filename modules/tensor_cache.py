@@ -0,0 +1,208 @@
+import collections
+import threading
+
+import torch
+
+from modules import shared
+
+
+def tensor_key(tensor, digest=None):
+    """
+    returns a key under which the tensor is stored; with a digest of its contents, equal tensors from different state dicts
+    get the same key; without one, only the very same tensor does, which is told by its storage
+    """
+
+    if digest is not None:
+        return f"{digest}:{tensor.dtype}:{tuple(tensor.shape)}"
+
+    return f"storage:{tensor.data_ptr()}:{tensor.dtype}:{tuple(tensor.shape)}:{tensor.stride()}"
+
+
+class CacheEntry:
+    def __init__(self, section, tensor_keys, nbytes):
+        self.section = section
+        self.tensor_keys = tensor_keys
+        self.nbytes = nbytes
+        self.uses = 0
+
+
+class TensorCache:
+    """
+    Keeps state dicts of recently used checkpoints and VAEs in RAM.
+
+    Tensors are stored by digests of their contents when the caller has them (per-tensor digests are calculated along with
+    sha256 of a checkpoint and cached), so a tensor that is the same in multiple state dicts (for example, the text encoder
+    or the VAE of models fine-tuned from the same base) is stored once. Contents are never hashed here, as that would take
+    as long as reading the whole checkpoint again. When the total size of stored tensors is above the budget
+    set in settings, or a section has more entries than its limit, entries are evicted using the policy from settings:
+    LRU evicts the entry that was used least recently, LFU evicts the entry that was used least often.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = collections.OrderedDict()
+        self.tensors = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.deduplicated_bytes = 0
+
+    def budget(self):
+        return int(shared.opts.sd_tensor_cache_budget_mb) * 1024 * 1024
+
+    def total_bytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor, _ in self.tensors.values())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry.uses += 1
+            self.entries.move_to_end(key)
+
+            return {name: self.tensors[digest][0] for name, digest in entry.tensor_keys.items()}
+
+    def put(self, key, section, state_dict, max_entries, digests=None):
+        """
+        adds state dict into the cache under key and evicts entries over limits; section's entry count is limited by max_entries;
+        digests, if given, is a dict of tensor name -> digest of its contents
+        """
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+
+            tensor_keys = {}
+            nbytes = 0
+            for name, tensor in state_dict.items():
+                if not isinstance(tensor, torch.Tensor):
+                    continue
+
+                digest = tensor_key(tensor, digests.get(name) if digests else None)
+                size = tensor.numel() * tensor.element_size()
+                nbytes += size
+
+                stored = self.tensors.get(digest)
+                if stored is None:
+                    self.tensors[digest] = [tensor, 1]
+                else:
+                    stored[1] += 1
+                    self.deduplicated_bytes += size
+
+                tensor_keys[name] = digest
+
+            self.entries[key] = CacheEntry(section, tensor_keys, nbytes)
+
+            self.evict(section, max_entries, keep=key)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+
+            for digest in entry.tensor_keys.values():
+                stored = self.tensors[digest]
+                stored[1] -= 1
+                if stored[1] == 0:
+                    del self.tensors[digest]
+
+    def select_victim(self, section=None, keep=None):
+        candidates = [(key, entry) for key, entry in self.entries.items() if (section is None or entry.section == section) and key != keep]
+        if not candidates:
+            return keep
+
+        if shared.opts.sd_tensor_cache_policy == "LFU":
+            # min() returns the first of equally used entries, which is the least recently used one
+            return min(candidates, key=lambda x: x[1].uses)[0]
+
+        return candidates[0][0]
+
+    def evict(self, section, max_entries, keep=None):
+        """evicts entries until limits are satisfied; the entry for keep, if given, is only evicted if it alone is over the budget"""
+
+        with self.lock:
+            while sum(1 for entry in self.entries.values() if entry.section == section) > max_entries:
+                self.pop(self.select_victim(section, keep))
+                self.evictions += 1
+
+            budget = self.budget()
+            while budget > 0 and self.entries and self.total_bytes() > budget:
+                self.pop(self.select_victim(keep=keep))
+                self.evictions += 1
+
+    def clear(self, section=None):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if section is None or entry.section == section]:
+                self.pop(key)
+
+    def keys(self, section):
+        with self.lock:
+            return [key for key, entry in self.entries.items() if entry.section == section]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "tensors": len(self.tensors),
+                "bytes": self.total_bytes(),
+                "budget": self.budget(),
+                "deduplicated_bytes": self.deduplicated_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "policy": shared.opts.sd_tensor_cache_policy,
+            }
+
+
+class TensorCacheSection:
+    """dict-like view into the shared tensor cache for one kind of state dicts, used by sd_models and sd_vae"""
+
+    def __init__(self, section, max_entries):
+        self.section = section
+        self.max_entries = max_entries
+
+    def get(self, key, default=None):
+        res = tensor_cache.get(key)
+        return default if res is None else res
+
+    def __contains__(self, key):
+        return key in tensor_cache.keys(self.section)
+
+    def __getitem__(self, key):
+        res = tensor_cache.get(key)
+        if res is None:
+            raise KeyError(key)
+
+        return res
+
+    def __setitem__(self, key, state_dict):
+        self.put(key, state_dict)
+
+    def put(self, key, state_dict, digests=None):
+        tensor_cache.put(key, self.section, state_dict, self.max_entries(), digests)
+
+    def __delitem__(self, key):
+        tensor_cache.pop(key)
+
+    def __len__(self):
+        return len(tensor_cache.keys(self.section))
+
+    def keys(self):
+        return tensor_cache.keys(self.section)
+
+    def clear(self):
+        tensor_cache.clear(self.section)
+
+    def evict(self):
+        """evicts entries that are over the limits, for example after the limits were changed in settings"""
+        tensor_cache.evict(self.section, self.max_entries())
+
+
+tensor_cache = TensorCache()
@@ -12,7 +12,7 @@ import safetensors.torch
 import numpy as np
 from PIL import Image, PngImagePlugin
 
-from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes
+from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes, safetensors_index, startup_snapshot
 import modules.textual_inversion.dataset
 from modules.textual_inversion.learn_schedule import LearnRateScheduler
 
@@ -177,6 +177,11 @@ class EmbeddingDatabase:
         elif ext in ['.BIN', '.PT']:
             data = torch.load(path, map_location="cpu")
         elif ext in ['.SAFETENSORS']:
+            embedding = self.embedding_from_safetensors_header(path, name)
+            if embedding is not None and self.expected_shape != -1 and self.expected_shape != embedding.shape:
+                self.skipped_embeddings[name] = embedding
+                return
+
             data = safetensors.torch.load_file(path, device="cpu")
         else:
             return
@@ -192,11 +197,40 @@ class EmbeddingDatabase:
             print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
 
 
+    def embedding_from_safetensors_header(self, path, name):
+        """creates an Embedding without weights using tensor shapes from the safetensors header index, so that an embedding for another architecture can be skipped without reading it"""
+
+        try:
+            shapes = safetensors_index.tensor_shapes(path)
+        except Exception:
+            return None
+
+        if 'clip_g' in shapes and 'clip_l' in shapes:  # SDXL embedding
+            shape = shapes['clip_g'][-1] + shapes['clip_l'][-1]
+            vectors = shapes['clip_g'][0]
+        elif len(shapes) == 1:  # diffuser concepts
+            emb_shape = next(iter(shapes.values()))
+            if not emb_shape:
+                return None
+
+            shape = emb_shape[-1]
+            vectors = emb_shape[0] if len(emb_shape) > 1 else 1
+        else:
+            return None
+
+        embedding = Embedding(None, name)
+        embedding.vectors = vectors
+        embedding.shape = shape
+        embedding.filename = path
+        embedding.set_hash(hashes.sha256_from_cache(path, "textual_inversion/" + name) or '')
+
+        return embedding
+
     def load_from_dir(self, embdir):
         if not os.path.isdir(embdir.path):
             return
 
-        for root, _, fns in os.walk(embdir.path, followlinks=True):
+        for root, _, fns in startup_snapshot.walk(embdir.path):
             for fn in fns:
                 try:
                     fullfn = os.path.join(root, fn)
@@ -256,6 +290,21 @@ class EmbeddingDatabase:
         return None, None
 
 
+def reload_embeddings_after_snapshot():
+    # without a loaded model there is nothing to reload: embeddings are listed afresh when the model is loaded
+    if sd_models.model_data.sd_model is None:
+        return
+
+    from modules.call_queue import queue_lock
+
+    # the database is changed in place and read while generating; generation holds queue_lock and reloads it the same way
+    with queue_lock:
+        sd_hijack.model_hijack.embedding_db.load_textual_inversion_embeddings(force_reload=True)
+
+
+startup_snapshot.add_refresh_callback("embeddings", reload_embeddings_after_snapshot)
+
+
 def create_embedding(name, num_vectors_per_token, overwrite_old, init_text='*'):
     cond_model = shared.sd_model.cond_stage_model
 
@@ -33,6 +33,8 @@ class Timer:
         self.base_category = ''
         self.print_log = print_log
         self.subcategory_level = 0
+        self.throughput = {}
+        self.saved = {}
 
     def elapsed(self):
         end = time.time()
@@ -56,6 +58,33 @@ class Timer:
         if self.print_log and not disable_log:
             print(f"{'  ' * self.subcategory_level}{category}: done in {e + extra_time:.3f}s")
 
+    def add_throughput(self, category, nbytes):
+        """records that nbytes bytes were processed during the category; summary will show processing speed for it"""
+
+        category = self.base_category + category
+
+        if category not in self.throughput:
+            self.throughput[category] = 0
+
+        self.throughput[category] += nbytes
+
+    def add_saved_time(self, reason, amount):
+        """records an estimate of time that was not spent thanks to an optimization; summary will list it after the records"""
+
+        if reason not in self.saved:
+            self.saved[reason] = 0
+
+        self.saved[reason] += amount
+
+    def format_record(self, category, time_taken):
+        res = f"{category}: {time_taken:.1f}s"
+
+        nbytes = self.throughput.get(category)
+        if nbytes and time_taken > 0:
+            res += f" at {nbytes / time_taken / 1024 ** 2:.0f} MB/s"
+
+        return res
+
     def subcategory(self, name):
         self.elapsed()
 
@@ -66,17 +95,21 @@ class Timer:
         res = f"{self.total:.1f}s"
 
         additions = [(category, time_taken) for category, time_taken in self.records.items() if time_taken >= 0.1 and '/' not in category]
-        if not additions:
+        savings = [(reason, amount) for reason, amount in self.saved.items() if amount >= 0.1]
+        if not additions and not savings:
             return res
 
         res += " ("
-        res += ", ".join([f"{category}: {time_taken:.1f}s" for category, time_taken in additions])
+        res += ", ".join([self.format_record(category, time_taken) for category, time_taken in additions])
+        if savings:
+            res += "; " if additions else ""
+            res += ", ".join([f"saved ~{amount:.1f}s by {reason}" for reason, amount in savings])
         res += ")"
 
         return res
 
     def dump(self):
-        return {'total': self.total, 'records': self.records}
+        return {'total': self.total, 'records': self.records, 'throughput': self.throughput, 'saved': self.saved}
 
     def reset(self):
         self.__init__()
@@ -84,6 +117,7 @@ class Timer:
 
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument("--log-startup", action='store_true', help="print a detailed log of what's happening at startup")
+parser.add_argument("--startup-benchmark", type=str, nargs='?', const="startup-benchmark.json", default=None, help="measure startup and import times, save them to a JSON file and exit")
 args = parser.parse_known_args()[0]
 
 startup_timer = Timer(print_log=args.log_startup)
@@ -0,0 +1,203 @@
+"""
+Low-overhead tracing of generation tasks.
+
+A trace starts when a task starts (progress.start_task) and finishes with it; the API keeps traces of its tasks open with
+hold() until the response is encoded. The trace is current only in the context of the thread that runs the task, so work done by other
+threads at the same time, like saving images from the UI, does not end up in it. While a trace is current, code wrapped in
+span() records its name, thread, start and duration into it. Work that the task hands to other threads, like encoding
+images for the API, is wrapped with bind() to record into the same trace. When no trace is current, span() only checks
+that and does nothing else.
+
+Traces of the last tasks are kept in memory, as many as set in settings. The API returns them by task id, either as a
+list of spans or in Chrome trace event format for chrome://tracing and Perfetto.
+"""
+
+import collections
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from modules import shared
+
+lock = threading.Lock()
+traces = collections.OrderedDict()
+current = contextvars.ContextVar("current trace", default=None)
+held = set()
+
+
+class Trace:
+    def __init__(self, task_id, queued_at=None, coalesced=()):
+        self.task_id = task_id
+        self.coalesced = list(coalesced)
+        self.unfinished = {task_id, *coalesced}
+        self.queued_at = queued_at
+        self.started = time.time()
+        self.finished = None
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, start, end, args=None):
+        """adds a span; start and end are values of time.perf_counter()"""
+
+        thread = threading.current_thread()
+        self.spans.append((name, start - self.origin, end - start, thread.ident, thread.name, args))
+
+    def info(self, include_spans=True):
+        res = {
+            "task_id": self.task_id,
+            "coalesced": self.coalesced,
+            "started": self.started,
+            "finished": self.finished,
+            "queue_wait": self.started - self.queued_at if self.queued_at is not None else None,
+            "duration": self.finished - self.started if self.finished is not None else None,
+            "span_count": len(self.spans),
+        }
+
+        if include_spans:
+            res["spans"] = [
+                {"name": name, "start": start, "duration": duration, "thread": thread_name, "args": args}
+                for name, start, duration, _, thread_name, args in sorted(self.spans, key=lambda x: x[1])
+            ]
+
+        return res
+
+    def chrome_trace(self):
+        """returns the trace as a dict in Chrome trace event format"""
+
+        pid = os.getpid()
+        threads = {thread_id: thread_name for _, _, _, thread_id, thread_name, _ in self.spans}
+
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": thread_name}} for thread_id, thread_name in threads.items()]
+        events += [
+            {"name": name, "cat": "generation", "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": thread_id, "args": args or {}}
+            for name, start, duration, thread_id, _, args in self.spans
+        ]
+
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"task_id": self.task_id, "started": self.started}}
+
+
+def begin(task_id, queued_at=None, coalesced=()):
+    """
+    starts a trace for the task and makes it current; does nothing if tracing is disabled in settings. Tasks in coalesced
+    are generated in one batch with this one; they share the trace, and it finishes when all of them do.
+    """
+
+    limit = shared.opts.api_traces_keep
+    if not task_id or limit <= 0:
+        current.set(None)
+        return
+
+    trace = Trace(task_id, queued_at, coalesced)
+
+    with lock:
+        for x in (task_id, *coalesced):
+            traces[x] = trace
+            traces.move_to_end(x)
+
+        while len(traces) > limit:
+            traces.popitem(last=False)
+
+    current.set(trace)
+
+
+def attach(task_id):
+    """makes the trace of the task current in this thread; for tasks whose trace was begun by another thread, like coalesced requests"""
+
+    current.set(get(task_id))
+
+
+def finish(task_id):
+    with lock:
+        if task_id in held:
+            return
+
+    trace = current.get()
+    if trace is not None and task_id in trace.unfinished:
+        current.set(None)
+    else:
+        trace = get(task_id)
+
+    if trace is None or task_id not in trace.unfinished:
+        return
+
+    trace.unfinished.discard(task_id)
+    if trace.unfinished:
+        return
+
+    trace.add("task", trace.origin, time.perf_counter(), {"task_id": trace.task_id})
+    trace.finished = time.time()
+
+
+@contextlib.contextmanager
+def hold(task_id):
+    """keeps the trace of the task open until the with block ends, even if the task finishes earlier; the trace is finished on exit unless there was an error"""
+
+    with lock:
+        held.add(task_id)
+
+    try:
+        yield
+    finally:
+        with lock:
+            held.discard(task_id)
+
+    finish(task_id)
+
+
+def is_active():
+    return current.get() is not None
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """records the with block as a span of the current trace; can also be used as a decorator"""
+
+    trace = current.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter(), args or None)
+
+
+def record(name, start, end, **args):
+    """records a span that was measured by the caller, with start and end from time.perf_counter()"""
+
+    trace = current.get()
+    if trace is not None:
+        trace.add(name, start, end, args or None)
+
+
+def bind(func):
+    """returns a function that runs func with the trace that is current now; for work handed to other threads"""
+
+    trace = current.get()
+    if trace is None:
+        return func
+
+    def run(*args, **kwargs):
+        token = current.set(trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current.reset(token)
+
+    return run
+
+
+def get(task_id):
+    with lock:
+        return traces.get(task_id)
+
+
+def list_traces():
+    with lock:
+        unique = {id(trace): trace for trace in reversed(traces.values())}
+
+    return [trace.info(include_spans=False) for trace in unique.values()]
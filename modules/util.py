@@ -28,14 +28,23 @@ def html(filename):
         return ""
 
 
-def walk_files(path, allowed_extensions=None):
+def walk_files(path, allowed_extensions=None, *, use_snapshot=False):
+    """
+    Yields paths to files in path and its subdirectories, sorted naturally.
+    use_snapshot is for listing model directories: the listing may come from the startup snapshot, see modules.startup_snapshot.
+    """
+
     if not os.path.exists(path):
         return
 
     if allowed_extensions is not None:
         allowed_extensions = set(allowed_extensions)
 
-    items = list(os.walk(path, followlinks=True))
+    if use_snapshot:
+        from modules import startup_snapshot
+        items = startup_snapshot.walk(path)
+    else:
+        items = list(os.walk(path, followlinks=True))
     items = sorted(items, key=lambda x: natural_sort_key(x[0]))
 
     for root, _, files in items:
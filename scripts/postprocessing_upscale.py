@@ -6,8 +6,7 @@ import numpy as np
 from modules import scripts_postprocessing, shared
 import gradio as gr
 
-from modules.ui_components import FormRow, ToolButton, InputAccordion
-from modules.ui import switch_values_symbol
+from modules.ui_components import FormRow, ToolButton, InputAccordion, switch_values_symbol
 
 upscale_cache = {}
 
@@ -11,7 +11,7 @@ import numpy as np
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors
+from modules import images, sd_samplers, processing, sd_models, sd_models_prefetch, sd_vae, sd_schedulers, errors
 from modules.processing import process_images, Processed, StableDiffusionProcessingTxt2Img
 from modules.shared import opts, state
 import modules.shared as shared
@@ -765,23 +765,47 @@ class Script(scripts.Script):
 
             return res
 
+        # let the prefetcher read checkpoints from the checkpoint axis in the order cells will use them
+        axes = {'x': (x_opt, xs), 'y': (y_opt, ys), 'z': (z_opt, zs)}
+        processing_order = [first_axes_processed, second_axes_processed] + [a for a in 'xyz' if a not in (first_axes_processed, second_axes_processed)]
+        expected_checkpoints = []
+        repeats = 1
+        for axis in processing_order:
+            opt, values = axes[axis]
+            if opt.label == "Checkpoint name":
+                for checkpoint_info in [sd_models.get_closet_checkpoint_match(x) for x in values] * repeats:
+                    if not expected_checkpoints or expected_checkpoints[-1] is not checkpoint_info:
+                        expected_checkpoints.append(checkpoint_info)
+                break
+
+            repeats *= len(values)
+
+        sd_models_prefetch.prefetcher.expect("xyz_grid", expected_checkpoints)
+
         with SharedSettingsStackHelper():
-            processed = draw_xyz_grid(
-                p,
-                xs=xs,
-                ys=ys,
-                zs=zs,
-                x_labels=[x_opt.format_value(p, x_opt, x) for x in xs],
-                y_labels=[y_opt.format_value(p, y_opt, y) for y in ys],
-                z_labels=[z_opt.format_value(p, z_opt, z) for z in zs],
-                cell=cell,
-                draw_legend=draw_legend,
-                include_lone_images=include_lone_images,
-                include_sub_grids=include_sub_grids,
-                first_axes_processed=first_axes_processed,
-                second_axes_processed=second_axes_processed,
-                margin_size=margin_size
-            )
+            try:
+                processed = draw_xyz_grid(
+                    p,
+                    xs=xs,
+                    ys=ys,
+                    zs=zs,
+                    x_labels=[x_opt.format_value(p, x_opt, x) for x in xs],
+                    y_labels=[y_opt.format_value(p, y_opt, y) for y in ys],
+                    z_labels=[z_opt.format_value(p, z_opt, z) for z in zs],
+                    cell=cell,
+                    draw_legend=draw_legend,
+                    include_lone_images=include_lone_images,
+                    include_sub_grids=include_sub_grids,
+                    first_axes_processed=first_axes_processed,
+                    second_axes_processed=second_axes_processed,
+                    margin_size=margin_size
+                )
+            finally:
+                sd_models_prefetch.prefetcher.forget("xyz_grid")
+
+        if expected_checkpoints and sd_models_prefetch.prefetcher.is_enabled():
+            prefetch_stats = sd_models_prefetch.prefetcher.job_stats()
+            print(f"X/Y/Z plot checkpoint prefetch: {prefetch_stats['hits']} hits, {prefetch_stats['misses']} misses")
 
         if not processed.images:
             # It broke, no further handling needed.
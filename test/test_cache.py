@@ -0,0 +1,88 @@
+import diskcache
+import pytest
+
+from modules import cache
+
+
+@pytest.fixture
+def tiered(tmp_path):
+    return cache.TieredCache("test", diskcache.Cache(str(tmp_path)), max_items=2)
+
+
+def test_writes_are_batched(tiered):
+    tiered["a"] = {"sha256": "1"}
+    tiered.set_many({"b": {"sha256": "2"}, "c": {"sha256": "3"}})
+
+    assert tiered["a"] == {"sha256": "1"}
+    assert "a" not in tiered.disk
+
+    tiered.flush()
+
+    assert tiered.disk["a"] == {"sha256": "1"}
+    assert tiered.stats()["flushes"] == 1
+
+
+def test_lru_front_and_get_many(tiered):
+    tiered.set_many({"a": 1, "b": 2, "c": 3})
+    tiered.flush()
+
+    assert list(tiered.memory) == ["b", "c"]
+    assert tiered.get_many(["a", "b", "missing"]) == {"a": 1, "b": 2}
+    assert tiered.get("missing") is None
+
+    stats = tiered.stats()
+    assert stats["hits"] == 2  # b from get_many, missing remembered as absent
+    assert stats["misses"] == 2
+
+
+def test_values_are_not_shared_between_callers(tiered):
+    tiered["a"] = {"digests": [1]}
+    tiered["a"]["digests"].append(2)
+    assert tiered["a"] == {"digests": [1]}
+
+    tiered.flush()
+    tiered.memory.clear()
+    tiered.get("a")["digests"].append(2)
+    assert tiered.get_many(["a"]) == {"a": {"digests": [1]}}
+
+
+def test_without_memory_tier(tmp_path):
+    tiered = cache.TieredCache("test", diskcache.Cache(str(tmp_path)), max_items=0)
+    other = cache.TieredCache("test", diskcache.Cache(str(tmp_path)), max_items=0)
+
+    tiered["a"] = 1
+    assert other["a"] == 1
+
+    other["a"] = 2
+    assert tiered["a"] == 2
+    assert not tiered.memory and not tiered.pending
+
+
+def test_pop(tiered):
+    tiered["a"] = 1
+    tiered.flush()
+
+    assert tiered.pop("a") == 1
+    assert "a" not in tiered
+
+    tiered.flush()
+    assert "a" not in tiered.disk
+
+
+def test_pin(tmp_path):
+    tiered = cache.TieredCache("test", diskcache.Cache(str(tmp_path / "main")), max_items=2, pinned_directory=str(tmp_path / "pinned"))
+    tiered.set_many({"a": 1, "b": 2})
+
+    assert tiered.pin(["a", "missing"]) == 1
+    assert "a" not in tiered.disk
+    assert tiered.pinned["a"] == 1
+    assert tiered["a"] == 1
+    assert len(tiered) == 2
+
+    tiered["a"] = 3
+    tiered.flush()
+    assert tiered.pinned["a"] == 3
+
+    assert tiered.unpin(["a"]) == 1
+    assert tiered.disk["a"] == 3
+    assert not tiered.pinned_keys
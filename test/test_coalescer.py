@@ -0,0 +1,91 @@
+import threading
+import types
+
+from modules.api import coalescer
+from modules.fifo_lock import FIFOLock
+
+
+def submit_all(coalesce, requests, max_batch_size, max_wait):
+    results = {}
+
+    def submit(key, entry):
+        results[entry] = coalesce.submit(key, entry, max_batch_size, max_wait)
+
+    threads = [threading.Thread(target=submit, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def test_compatible_requests_run_as_one_batch():
+    batches = []
+
+    def run_batch(entries):
+        batches.append(list(entries))
+        return [entry.upper() for entry in entries]
+
+    coalesce = coalescer.Coalescer(FIFOLock(), run_batch)
+    results = submit_all(coalesce, [("512x512", "a"), ("512x512", "b"), ("512x512", "c"), ("768x768", "d")], max_batch_size=8, max_wait=0.5)
+
+    assert results == {"a": "A", "b": "B", "c": "C", "d": "D"}
+    assert sorted(len(batch) for batch in batches) == [1, 3]
+
+
+def test_batch_size_limit():
+    batches = []
+
+    def run_batch(entries):
+        batches.append(list(entries))
+        return entries
+
+    coalesce = coalescer.Coalescer(FIFOLock(), run_batch)
+    submit_all(coalesce, [("key", str(i)) for i in range(5)], max_batch_size=2, max_wait=0.5)
+
+    assert sorted(len(batch) for batch in batches) == [1, 2, 2]
+
+
+def test_errors_reach_every_request():
+    def run_batch(entries):
+        raise RuntimeError("out of memory")
+
+    coalesce = coalescer.Coalescer(FIFOLock(), run_batch)
+    errors = []
+
+    def submit(entry):
+        try:
+            coalesce.submit("key", entry, 2, 0.5)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=submit, args=(entry,)) for entry in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["out of memory", "out of memory"]
+
+
+def test_split_processed():
+    processed = types.SimpleNamespace(
+        images=["grid", "image a", "image b"],
+        infotexts=["grid info", "a\nSteps: 20, Batch size: 2, Batch pos: 0", "b\nNegative prompt: ugly\nSteps: 20, Batch size: 2, Batch pos: 1, Version: v1"],
+        index_of_first_image=1,
+        batch_size=2,
+        all_prompts=["a", "b"],
+        all_negative_prompts=["", "ugly"],
+        all_seeds=[1, 2],
+        all_subseeds=[3, 4],
+    )
+
+    res = coalescer.split_processed(processed, 1)
+
+    assert res.images == ["image b"]
+    assert res.info == "b\nNegative prompt: ugly\nSteps: 20, Version: v1"
+    assert res.infotexts == [res.info]
+    assert res.index_of_first_image == 0
+    assert (res.prompt, res.negative_prompt, res.seed, res.subseed) == ("b", "ugly", 2, 4)
+    assert processed.images == ["grid", "image a", "image b"]
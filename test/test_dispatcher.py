@@ -0,0 +1,186 @@
+import json
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+from modules import dispatcher
+
+stand_in_worker = """
+import http.server, json, sys
+
+port, checkpoint = int(sys.argv[1]), sys.argv[2]
+state = {"checkpoint": checkpoint, "options": 0}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/sdapi/v1/worker-status":
+            self.reply({"checkpoint": state["checkpoint"], "busy": False, "queued": 0})
+        elif self.path == "/metrics":
+            body = f"# HELP sd_port Port\\n# TYPE sd_port gauge\\nsd_port {port}\\n".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.reply({"port": port, "path": self.path, "options": state["options"]})
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        if self.path == "/sdapi/v1/options":
+            if data.get("fail_port") == port:
+                self.reply({"detail": "failed"}, status=500)
+                return
+            state["options"] += 1
+        state["checkpoint"] = (data.get("override_settings") or {}).get("sd_model_checkpoint", state["checkpoint"])
+        self.reply({"port": port, "task": data.get("force_task_id"), "checkpoint": state["checkpoint"]})
+
+http.server.HTTPServer(("127.0.0.1", port), Handler).serve_forever()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(dispatcher, "health_interval", 0.1)
+
+    workers = []
+    for i, checkpoint in enumerate(["first.safetensors [abcdef]", "second.safetensors [123456]"]):
+        port = free_port()
+        workers.append(dispatcher.Worker(i, port, [sys.executable, "-c", stand_in_worker, str(port), checkpoint]))
+
+    pool = dispatcher.Dispatcher(workers)
+    pool.start()
+
+    port = free_port()
+    threading.Thread(target=pool.serve, args=("127.0.0.1", port), daemon=True).start()
+    wait_for(lambda: len(pool.healthy_workers()) == len(workers) and pool.server is not None)
+
+    yield pool, f"http://127.0.0.1:{port}/sdapi/v1"
+
+    pool.stop()
+
+
+def test_routes_to_worker_with_checkpoint(pool):
+    pool, url = pool
+
+    response = requests.post(f"{url}/txt2img", json={"override_settings": {"sd_model_checkpoint": "second"}})
+    assert response.status_code == 200
+    assert response.json()["port"] == pool.workers[1].port
+
+    response = requests.post(f"{url}/txt2img", json={"override_settings": {"sd_model_checkpoint": "first.safetensors"}})
+    assert response.json()["port"] == pool.workers[0].port
+
+
+def test_task_requests_go_to_same_worker(pool):
+    pool, url = pool
+
+    task = requests.post(f"{url}/txt2img", json={"override_settings": {"sd_model_checkpoint": "second"}}).json()["task"]
+    assert task
+
+    response = requests.get(f"{url}/jobs/{task}")
+    assert response.json()["port"] == pool.workers[1].port
+
+
+def test_settings_go_to_every_worker(pool):
+    pool, url = pool
+
+    response = requests.post(f"{url}/options", json={"samples_format": "png"})
+    assert response.status_code == 200
+    assert response.json()["port"] == pool.workers[-1].port
+
+    for worker in pool.workers:
+        assert json.loads(requests.get(f"http://127.0.0.1:{worker.port}/sdapi/v1/options").content)["options"] == 1
+
+    response = requests.post(f"{url}/options", json={"fail_port": pool.workers[0].port})
+    assert response.status_code == 500
+    assert response.json() == {"detail": "failed"}
+    assert json.loads(requests.get(f"http://127.0.0.1:{pool.workers[1].port}/sdapi/v1/options").content)["options"] == 2
+
+
+def test_routing_of_settings_and_interrupts():
+    workers = [dispatcher.Worker(i, 7862 + i, []) for i in range(2)]
+    for worker, checkpoint in zip(workers, ["first.safetensors [abcdef]", "second.safetensors [123456]"]):
+        worker.healthy = True
+        worker.checkpoint = checkpoint
+    pool = dispatcher.Dispatcher(workers)
+
+    forwards = pool.route("POST", "/sdapi/v1/options", "", json.dumps({"sd_model_checkpoint": "second", "samples_format": "png"}).encode())
+    assert [(worker.index, json.loads(body), headers) for worker, body, headers in forwards] == [
+        (1, {"sd_model_checkpoint": "second", "samples_format": "png"}, {}),
+        (0, {"samples_format": "png"}, {dispatcher.copy_header: "1"}),
+    ]
+
+    forwards = pool.route("POST", "/sdapi/v1/txt2img", "", json.dumps({"force_task_id": "task(a)"}).encode())
+    assert [worker.index for worker, _, _ in forwards] == [0]
+    assert [worker.index for worker, _, _ in pool.route("POST", "/sdapi/v1/interrupt", "", b"")] == [0]
+
+    pool.remember_owner("task(b)", workers[1])
+    assert [worker.index for worker, _, _ in pool.route("POST", "/sdapi/v1/skip", "", b'{"id_task": "task(b)"}')] == [1]
+
+
+def test_metrics_of_every_worker(pool):
+    pool, url = pool
+
+    response = requests.get(url.replace("/sdapi/v1", "/metrics"))
+    assert response.status_code == 200
+    assert response.text.splitlines() == [
+        "# HELP sd_port Port",
+        "# TYPE sd_port gauge",
+        *[f'sd_port{{worker="{worker.index}"}} {worker.port}' for worker in pool.workers],
+    ]
+
+
+def test_merge_metrics():
+    first = '# HELP sd_seconds Time\n# TYPE sd_seconds histogram\nsd_seconds_bucket{le="1.0"} 1\nsd_seconds_count 1\n'
+    second = '# HELP sd_seconds Time\n# TYPE sd_seconds histogram\nsd_seconds_bucket{le="1.0"} 2\nsd_seconds_count 2\n'
+
+    assert dispatcher.merge_metrics([(0, first), (1, second)]).splitlines() == [
+        "# HELP sd_seconds Time",
+        "# TYPE sd_seconds histogram",
+        'sd_seconds_bucket{worker="0",le="1.0"} 1',
+        'sd_seconds_count{worker="0"} 1',
+        'sd_seconds_bucket{worker="1",le="1.0"} 2',
+        'sd_seconds_count{worker="1"} 2',
+    ]
+
+
+def test_exited_worker_is_restarted(pool):
+    pool, url = pool
+
+    worker = pool.workers[0]
+    worker.process.kill()
+    worker.process.wait()
+
+    wait_for(lambda: worker.restarts == 1 and worker.healthy)
+
+
+def test_worker_arguments():
+    argv = ["--dispatcher-workers", "2", "--port=7860", "--listen", "--api", "--xformers"]
+    assert dispatcher.worker_arguments(argv, 7861) == ["--xformers", "--nowebui", "--port", "7861", "--skip-prepare-environment"]
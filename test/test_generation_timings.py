@@ -0,0 +1,28 @@
+import pytest
+
+from modules import generation_timings
+
+
+@pytest.fixture(autouse=True)
+def empty_timings(monkeypatch):
+    storage = {}
+    monkeypatch.setattr(generation_timings, "timings", {})
+    monkeypatch.setattr(generation_timings.cache, "cache", lambda subsection: storage)
+
+
+def test_estimate_from_same_profile():
+    generation_timings.record("SD1", 512, 512, "Euler", 20, 2.0)
+    assert generation_timings.estimate("SD1", 512, 512, "Euler", 20) == pytest.approx(2.0)
+
+    generation_timings.record("SD1", 512, 512, "Euler", 20, 4.0)
+    assert generation_timings.estimate("SD1", 512, 512, "Euler", 20) == pytest.approx(2.0 * (1 - generation_timings.smoothing) + 4.0 * generation_timings.smoothing)
+
+
+def test_estimate_from_similar_profiles():
+    assert generation_timings.estimate("SD1", 512, 512, "Euler", 20) is None
+
+    generation_timings.record("SD1", 512, 512, "Euler", 20, 2.0)
+    generation_timings.record("SDXL", 1024, 1024, "DPM++ 2M", 20, 20.0)
+
+    assert generation_timings.estimate("SD1", 1024, 512, "Euler", 40) == pytest.approx(8.0)
+    assert generation_timings.estimate("SD1", 512, 512, "DPM++ 2M", 20) == pytest.approx(2.0)
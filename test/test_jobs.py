@@ -0,0 +1,104 @@
+import time
+
+import pytest
+import requests
+
+
+@pytest.fixture()
+def url_jobs(base_url):
+    return f"{base_url}/sdapi/v1/jobs"
+
+
+@pytest.fixture()
+def simple_txt2img_job():
+    return {
+        "prompt": "example prompt",
+        "sampler_index": "Euler a",
+        "steps": 3,
+        "width": 64,
+        "height": 64,
+    }
+
+
+def wait_for_job(url_jobs, job_id, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = requests.get(f"{url_jobs}/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+
+        time.sleep(0.5)
+
+    raise TimeoutError(job_id)
+
+
+def test_txt2img_job(url_jobs, simple_txt2img_job):
+    response = requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job, headers={"X-Client-Id": "test"})
+    assert response.status_code == 200
+
+    job = response.json()
+    assert job["status"] in ("queued", "running")
+    assert job["client"] == "test"
+
+    assert wait_for_job(url_jobs, job["id"])["status"] == "done"
+
+    result = requests.get(f"{url_jobs}/{job['id']}/result")
+    assert result.status_code == 200
+    assert len(result.json()["images"]) == 1
+
+
+def test_cancel_job(url_jobs, simple_txt2img_job):
+    job_ids = [requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job).json()["id"] for _ in range(2)]
+
+    assert requests.post(f"{url_jobs}/{job_ids[1]}/cancel").json()["status"] in ("cancelled", "running")
+    assert wait_for_job(url_jobs, job_ids[1])["status"] == "cancelled"
+    assert requests.get(f"{url_jobs}/{job_ids[1]}/result").status_code == 410
+
+    wait_for_job(url_jobs, job_ids[0])
+
+
+def test_unknown_job(url_jobs):
+    assert requests.get(f"{url_jobs}/task(unknown)").status_code == 404
+
+
+def stream_events(base_url, task_id):
+    events = []
+    with requests.get(f"{base_url}/sdapi/v1/progress/stream", params={"id_task": task_id}, stream=True, timeout=120) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                events.append(line[len("event: "):])
+
+    return events
+
+
+def test_progress_stream(base_url, url_jobs, simple_txt2img_job):
+    job = requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job).json()
+
+    assert stream_events(base_url, job["id"])[-1] == "done"
+    assert wait_for_job(url_jobs, job["id"])["status"] == "done"
+
+
+def test_progress_stream_of_failed_job(base_url, url_jobs, simple_txt2img_job):
+    simple_txt2img_job["sampler_index"] = "no such sampler"
+    job = requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job).json()
+
+    assert stream_events(base_url, job["id"])[-1] == "error"
+
+
+def test_progress_stream_of_cancelled_job(base_url, url_jobs, simple_txt2img_job):
+    job_ids = [requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job).json()["id"] for _ in range(2)]
+    requests.post(f"{url_jobs}/{job_ids[1]}/cancel")
+
+    assert stream_events(base_url, job_ids[1])[-1] == "cancelled"
+    wait_for_job(url_jobs, job_ids[0])
+
+
+def test_failed_job_leaves_queue(base_url, url_jobs, simple_txt2img_job):
+    simple_txt2img_job["sampler_index"] = "no such sampler"
+    job = requests.post(f"{url_jobs}/txt2img", json=simple_txt2img_job).json()
+
+    assert wait_for_job(url_jobs, job["id"])["status"] == "failed"
+    assert job["id"] not in requests.get(f"{base_url}/internal/pending-tasks").json()["tasks"]
+    assert requests.post(f"{base_url}/internal/progress", json={"id_task": job["id"]}).json()["completed"]
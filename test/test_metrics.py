@@ -0,0 +1,45 @@
+import requests
+
+from modules import metrics
+
+
+def make_histogram():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", buckets=(0.5, 1.0))
+    metrics.registry.remove(histogram)
+    return histogram
+
+
+def test_histogram_render():
+    histogram = make_histogram()
+    histogram.observe(0.25)
+    histogram.observe(1.0)
+    histogram.observe(100)
+
+    lines = histogram.render()
+
+    assert lines[:2] == ["# HELP test_seconds Test histogram", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{le="0.5"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_sum 101.25" in lines
+    assert "test_seconds_count 3" in lines
+
+
+def test_histogram_time_as_decorator():
+    histogram = make_histogram()
+
+    @histogram.time()
+    def func():
+        return 1
+
+    assert func() == 1
+    assert func() == 1
+    assert "test_seconds_count 2" in histogram.render()
+
+
+def test_metrics_endpoint(base_url):
+    response = requests.get(f"{base_url}/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE sd_sampling_step_seconds histogram" in response.text
+    assert "sd_queue_depth " in response.text
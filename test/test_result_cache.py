@@ -0,0 +1,42 @@
+import hashlib
+
+import pytest
+from PIL import Image
+
+# result_cache imports models and samplers, which need settings to be loaded
+pytestmark = pytest.mark.usefixtures("initialize")
+
+
+def digest(obj):
+    from modules import result_cache
+
+    h = hashlib.sha256()
+    result_cache.update_hash(h, obj)
+    return h.hexdigest()
+
+
+def test_hash_is_canonical():
+    assert digest({"a": 1, "b": [1, 2]}) == digest({"b": [1, 2], "a": 1})
+    assert digest([1, "1"]) != digest(["1", 1])
+    assert digest([True]) != digest([1])
+    assert digest(Image.new("RGB", (8, 8), "red")) != digest(Image.new("RGB", (8, 8), "blue"))
+
+
+def test_unknown_objects_are_not_cached():
+    from modules import result_cache
+
+    with pytest.raises(result_cache.Uncacheable):
+        digest({"callback": object()})
+
+
+def test_file_identity(tmp_path):
+    from modules import result_cache
+
+    filename = tmp_path / "model.safetensors"
+    filename.write_bytes(b"1")
+    before = result_cache.file_identity(str(filename))
+
+    filename.write_bytes(b"22")
+
+    assert result_cache.file_identity(str(filename)) != before
+    assert result_cache.file_identity(str(tmp_path / "missing")) == [str(tmp_path / "missing"), None]
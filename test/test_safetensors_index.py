@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from modules import safetensors_index
+
+
+def write_safetensors(filename, tensors, metadata):
+    header = {"__metadata__": metadata}
+    offset = 0
+    for name, shape in tensors.items():
+        size = 4
+        for x in shape:
+            size *= x
+
+        header[name] = {"dtype": "F32", "shape": shape, "data_offsets": [offset, offset + size]}
+        offset += size
+
+    header_bytes = json.dumps(header).encode("utf8")
+    with open(filename, "wb") as file:
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        file.write(b"\0" * offset)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    data = {}
+    monkeypatch.setattr(safetensors_index.cache, "cache", lambda subsection: data)
+    return data
+
+
+def test_header_is_indexed(tmp_path, index):
+    filename = str(tmp_path / "model.safetensors")
+    write_safetensors(filename, {"a": [2, 768], "b": [3]}, {"ss_output_name": "x", "json": '{"k": 1}'})
+
+    header = safetensors_index.get(filename)
+    assert header["metadata"] == {"ss_output_name": "x", "json": {"k": 1}}
+    assert header["tensors"]["a"] == ["F32", [2, 768], [0, 2 * 768 * 4]]
+    assert header["data_offset"] == 8 + int.from_bytes(open(filename, "rb").read(8), "little")
+    assert safetensors_index.tensor_shapes(filename) == {"a": [2, 768], "b": [3]}
+    assert os.path.abspath(filename) in index
+
+
+def test_modified_file_is_reindexed(tmp_path, index):
+    filename = str(tmp_path / "model.safetensors")
+    write_safetensors(filename, {"a": [1]}, {"v": "1"})
+    assert safetensors_index.metadata(filename) == {"v": "1"}
+
+    write_safetensors(filename, {"a": [1], "b": [1]}, {"v": "22"})
+    assert safetensors_index.metadata(filename) == {"v": "22"}
+
+
+def test_not_safetensors(tmp_path, index):
+    filename = str(tmp_path / "model.safetensors")
+    with open(filename, "wb") as file:
+        file.write(b"PK\x03\x04" + b"\0" * 100)
+
+    with pytest.raises(AssertionError):
+        safetensors_index.get(filename)
@@ -0,0 +1,43 @@
+import pytest
+
+from modules import sd_models_config
+
+
+class HeaderOnlyStateDict(dict):
+    """maps keys to shapes, like a streaming state dict that has only read the header; fails if a tensor is requested"""
+
+    def __getitem__(self, key):
+        raise AssertionError(f"tensor {key} was read")
+
+    def shape(self, key):
+        return dict.__getitem__(self, key)
+
+
+sdxl_keys = {
+    'conditioner.embedders.1.model.ln_final.weight': [1280],
+    'model.diffusion_model.input_blocks.0.0.weight': [320, 4, 3, 3],
+    'model.diffusion_model.middle_block.1.transformer_blocks.0.attn1.to_q.weight': [1280, 1280],
+}
+
+
+@pytest.mark.parametrize("shapes,architecture", [
+    ({'model.diffusion_model.input_blocks.0.0.weight': [320, 4, 3, 3]}, "SD1"),
+    ({'model.diffusion_model.input_blocks.0.0.weight': [320, 9, 3, 3]}, "SD1 inpainting"),
+    ({'model.diffusion_model.input_blocks.0.0.weight': [320, 8, 3, 3]}, "SD1 instruct-pix2pix"),
+    (sdxl_keys, "SDXL"),
+    ({k: v for k, v in sdxl_keys.items() if 'middle_block' not in k}, "SSD-1B"),
+    ({**sdxl_keys, 'model.diffusion_model.input_blocks.0.0.weight': [320, 9, 3, 3]}, "SDXL inpainting"),
+    ({'conditioner.embedders.0.model.ln_final.weight': [1280]}, "SDXL refiner"),
+    ({'model.diffusion_model.x_embedder.proj.weight': [1536, 16, 2, 2]}, "SD3"),
+])
+def test_architecture_from_header(shapes, architecture):
+    assert sd_models_config.guess_model_architecture_from_state_dict(HeaderOnlyStateDict(shapes)) == architecture
+
+
+def test_sd2_needs_tensor_reads():
+    shapes = HeaderOnlyStateDict({
+        'cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight': [3072, 1024],
+        'model.diffusion_model.input_blocks.0.0.weight': [320, 4, 3, 3],
+    })
+
+    assert sd_models_config.guess_model_architecture_from_state_dict(shapes, allow_tensor_reads=False) is None
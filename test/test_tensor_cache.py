@@ -0,0 +1,67 @@
+import types
+
+import pytest
+import torch
+
+from modules import tensor_cache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(tensor_cache.shared, "opts", types.SimpleNamespace(sd_tensor_cache_budget_mb=0, sd_tensor_cache_policy="LRU"))
+    return tensor_cache.TensorCache()
+
+
+def test_shared_tensors_are_stored_once(cache):
+    shared_weight = torch.ones(256, 1024)
+    cache.put("a", "checkpoint", {"vae": shared_weight, "unet": torch.zeros(16)}, max_entries=2, digests={"vae": "1", "unet": "2"})
+    cache.put("b", "checkpoint", {"vae": shared_weight.clone(), "unet": torch.full((16,), 2.0)}, max_entries=2, digests={"vae": "1", "unet": "3"})
+
+    stats = cache.stats()
+    assert stats["tensors"] == 3
+    assert stats["deduplicated_bytes"] == shared_weight.numel() * shared_weight.element_size()
+
+    b = cache.get("b")
+    assert torch.equal(b["unet"], torch.full((16,), 2.0))
+    assert torch.equal(b["vae"], shared_weight)
+
+
+def test_without_digests_only_the_same_tensor_is_shared(cache):
+    shared_weight = torch.ones(256, 1024)
+    cache.put("a", "checkpoint", {"vae": shared_weight, "unet": torch.zeros(16)}, max_entries=3)
+    cache.put("b", "checkpoint", {"vae": shared_weight, "unet": torch.zeros(16)}, max_entries=3)
+    cache.put("c", "checkpoint", {"vae": shared_weight.clone()}, max_entries=3)
+
+    stats = cache.stats()
+    assert stats["tensors"] == 4
+    assert stats["deduplicated_bytes"] == shared_weight.numel() * shared_weight.element_size()
+
+
+def test_eviction_by_count_and_budget(cache):
+    cache.put("a", "checkpoint", {"w": torch.zeros(1024)}, max_entries=2)
+    cache.put("b", "checkpoint", {"w": torch.ones(1024)}, max_entries=2)
+    assert cache.get("a") is not None  # a is now more recent than b
+
+    cache.put("c", "checkpoint", {"w": torch.full((1024,), 2.0)}, max_entries=2)
+    assert cache.keys("checkpoint") == ["a", "c"]
+
+    tensor_cache.shared.opts.sd_tensor_cache_budget_mb = 1
+    cache.put("d", "checkpoint", {"w": torch.zeros(1024 * 1024 // 4)}, max_entries=10)
+    assert cache.keys("checkpoint") == ["d"]
+
+    stats = cache.stats()
+    assert stats["evictions"] == 3
+    assert stats["hits"] == 1
+
+
+def test_lfu_policy(cache):
+    tensor_cache.shared.opts.sd_tensor_cache_policy = "LFU"
+
+    cache.put("a", "vae", {"w": torch.zeros(4)}, max_entries=2)
+    cache.put("b", "vae", {"w": torch.ones(4)}, max_entries=2)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    cache.put("c", "vae", {"w": torch.full((4,), 2.0)}, max_entries=2)
+    assert cache.keys("vae") == ["a", "c"]
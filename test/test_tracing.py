@@ -0,0 +1,96 @@
+import concurrent.futures
+import contextvars
+import threading
+import types
+
+import pytest
+
+from modules import tracing
+
+
+@pytest.fixture(autouse=True)
+def empty_traces(monkeypatch):
+    monkeypatch.setattr(tracing.shared, "opts", types.SimpleNamespace(api_traces_keep=2))
+    monkeypatch.setattr(tracing, "traces", type(tracing.traces)())
+    monkeypatch.setattr(tracing, "held", set())
+    monkeypatch.setattr(tracing, "current", contextvars.ContextVar("current trace", default=None))
+
+
+def test_spans_are_recorded_while_task_runs():
+    with tracing.span("before"):
+        pass
+
+    tracing.begin("task(a)")
+    with tracing.span("outer", batch=0):
+        with tracing.span("inner"):
+            pass
+    tracing.finish("task(a)")
+
+    with tracing.span("after"):
+        pass
+
+    info = tracing.get("task(a)").info()
+    assert [span["name"] for span in info["spans"]] == ["task", "outer", "inner"]
+    assert info["spans"][1]["args"] == {"batch": 0}
+
+    events = tracing.get("task(a)").chrome_trace()["traceEvents"]
+    assert sorted(event["name"] for event in events if event["ph"] == "X") == ["inner", "outer", "task"]
+
+
+def test_only_last_traces_are_kept():
+    for task_id in ["task(a)", "task(b)", "task(c)"]:
+        tracing.begin(task_id)
+        tracing.finish(task_id)
+
+    assert [info["task_id"] for info in tracing.list_traces()] == ["task(c)", "task(b)"]
+
+
+def test_coalesced_tasks_share_trace():
+    tracing.begin("task(a)", coalesced=["task(b)"])
+    tracing.finish("task(a)")
+
+    trace = tracing.get("task(b)")
+    assert trace is tracing.get("task(a)")
+    assert trace.finished is None
+
+    tracing.finish("task(b)")
+    assert trace.finished is not None
+    assert [(info["task_id"], info["coalesced"]) for info in tracing.list_traces()] == [("task(a)", ["task(b)"])]
+
+
+def test_trace_is_bound_to_task():
+    tracing.begin("task(a)")
+
+    def other_thread():
+        with tracing.span("other thread"):
+            pass
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+
+    def encode():
+        with tracing.span("encode"):
+            pass
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        executor.submit(tracing.bind(encode)).result()
+
+    tracing.finish("task(a)")
+
+    assert sorted(span["name"] for span in tracing.get("task(a)").info()["spans"]) == ["encode", "task"]
+
+
+def test_held_trace_finishes_after_block():
+    with tracing.hold("task(a)"):
+        tracing.begin("task(a)")
+        tracing.finish("task(a)")
+
+        with tracing.span("response"):
+            pass
+
+        assert tracing.get("task(a)").finished is None
+
+    assert tracing.get("task(a)").finished is not None
+    assert not tracing.is_active()
+    assert [span["name"] for span in tracing.get("task(a)").info()["spans"]] == ["task", "response"]
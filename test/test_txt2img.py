@@ -88,3 +88,48 @@ def test_txt2img_multiple_batches_performed(url_txt2img, simple_txt2img_request)
 def test_txt2img_batch_performed(url_txt2img, simple_txt2img_request):
     simple_txt2img_request["batch_size"] = 2
     assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+
+def test_txt2img_images_as_urls(base_url, url_txt2img, simple_txt2img_request):
+    simple_txt2img_request.update({"response_format": "urls", "image_format": "webp", "image_quality": 70})
+
+    response = requests.post(url_txt2img, json=simple_txt2img_request)
+    assert response.status_code == 200
+
+    urls = response.json()["images"]
+    assert len(urls) == 1
+    for url in urls:
+        image = requests.get(f"{base_url}{url}")
+        assert image.headers["content-type"] == "image/webp"
+
+
+def test_txt2img_images_as_multipart(url_txt2img, simple_txt2img_request):
+    simple_txt2img_request.update({"response_format": "multipart", "image_format": "png", "png_compress_level": 1})
+
+    response = requests.post(url_txt2img, json=simple_txt2img_request)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed")
+    assert response.content.count(b"Content-Type: image/png") == 1
+
+
+def test_txt2img_trace(base_url, url_txt2img, simple_txt2img_request):
+    simple_txt2img_request["force_task_id"] = "task(trace-test)"
+    assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+    trace = requests.get(f"{base_url}/sdapi/v1/traces/task(trace-test)").json()
+    names = {span["name"] for span in trace["spans"]}
+    assert {"task", "sampling", "sampling step", "vae decode", "api response"} <= names
+
+    chrome_trace = requests.get(f"{base_url}/sdapi/v1/traces/task(trace-test)/chrome").json()
+    assert any(event["ph"] == "X" and event["name"] == "sampling" for event in chrome_trace["traceEvents"])
+
+
+def test_txt2img_results_are_stored(base_url, url_txt2img, simple_txt2img_request):
+    simple_txt2img_request["force_task_id"] = "task(results-test)"
+    assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+    response = requests.get(f"{base_url}/sdapi/v1/results/task(results-test)")
+    assert response.status_code == 200
+    assert len(response.json()["images"]) == 1
+
+    assert requests.get(f"{base_url}/sdapi/v1/results/task(no-such-task)").status_code == 404
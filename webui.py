@@ -10,6 +10,10 @@ from modules import initialize
 startup_timer = timer.startup_timer
 startup_timer.record("launcher")
 
+if timer.args.startup_benchmark:
+    from modules import startup_benchmark
+    startup_benchmark.install()
+
 initialize.imports()
 
 initialize.check_versions()
@@ -38,6 +42,12 @@ def api_only():
     script_callbacks.app_started_callback(None, app)
 
     print(f"Startup time: {startup_timer.summary()}.")
+
+    if cmd_opts.startup_benchmark:
+        from modules import startup_benchmark
+        startup_benchmark.write(cmd_opts.startup_benchmark)
+        return
+
     api.launch(
         server_name=initialize_util.gradio_server_name(),
         port=cmd_opts.port if cmd_opts.port else 7861,
@@ -121,6 +131,12 @@ def webui():
         timer.startup_record = startup_timer.dump()
         print(f"Startup time: {startup_timer.summary()}.")
 
+        if cmd_opts.startup_benchmark:
+            from modules import startup_benchmark
+            startup_benchmark.write(cmd_opts.startup_benchmark)
+            shared.demo.close()
+            break
+
         try:
             while True:
                 server_command = shared.state.wait_for_server_command(timeout=5)